@@ -0,0 +1,34 @@
+"""unique derived data grant id
+
+Revision ID: 3e9d5a7c1b82
+Revises: 8c1f3a6b2d70
+Create Date: 2026-10-17 23:41:09.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3e9d5a7c1b82'
+down_revision: Union[str, None] = '8c1f3a6b2d70'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keep only the newest derived data of each grant before adding the constraint
+    op.execute(
+        """
+        DELETE FROM grant_derived_data d
+        USING grant_derived_data newer
+        WHERE d.grant_id = newer.grant_id AND d.id < newer.id
+        """
+    )
+    op.create_unique_constraint('unique_grant_derived_data_grant_id', 'grant_derived_data', ['grant_id'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('unique_grant_derived_data_grant_id', 'grant_derived_data', type_='unique')
@@ -0,0 +1,44 @@
+"""unique grantee name
+
+Revision ID: b3f1c27a9d04
+Revises: 46c047a5d2e6
+Create Date: 2026-10-17 09:12:44.381205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3f1c27a9d04'
+down_revision: Union[str, None] = '46c047a5d2e6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Collapse duplicate grantees onto the lowest id before adding the index
+    op.execute(
+        """
+        UPDATE grant_grantee gg
+        SET grantee_id = keep.id
+        FROM grantees g
+        JOIN (SELECT name, MIN(id) AS id FROM grantees GROUP BY name) keep
+            ON keep.name = g.name
+        WHERE gg.grantee_id = g.id AND g.id <> keep.id
+        """
+    )
+    op.execute(
+        """
+        DELETE FROM grantees g
+        USING grantees keep
+        WHERE g.name = keep.name AND g.id > keep.id
+        """
+    )
+    op.create_index('idx_grantee_name', 'grantees', ['name'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('idx_grantee_name', table_name='grantees')
@@ -0,0 +1,34 @@
+"""add grant content hash
+
+Revision ID: c5a8e0d4f213
+Revises: b3f1c27a9d04
+Create Date: 2026-10-17 11:40:02.915733
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5a8e0d4f213'
+down_revision: Union[str, None] = 'b3f1c27a9d04'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('grants', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index('idx_grant_data_source_award', 'grants', ['data_source_id', 'award_id'], unique=False)
+    # Same digest the ingest writer computes, so the next delta run can skip
+    # every grant that hasn't changed
+    op.execute(
+        "UPDATE grants SET content_hash = encode(sha256(raw_text), 'hex') "
+        "WHERE raw_text IS NOT NULL"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_grant_data_source_award', table_name='grants')
+    op.drop_column('grants', 'content_hash')
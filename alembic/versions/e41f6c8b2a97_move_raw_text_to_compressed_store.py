@@ -0,0 +1,122 @@
+"""move raw text to compressed store
+
+Revision ID: e41f6c8b2a97
+Revises: d7e2b9a1c358
+Create Date: 2026-10-17 16:22:37.048816
+
+"""
+import gzip
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41f6c8b2a97'
+down_revision: Union[str, None] = 'd7e2b9a1c358'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+
+# The encodings and levels of grant_search.db.raw_store as of this revision,
+# copied so the migration doesn't change when the application code does
+ZSTD_LEVEL = 9
+GZIP_LEVEL = 6
+
+raw_documents = sa.table(
+    'grant_raw_documents',
+    sa.column('grant_id', sa.Integer),
+    sa.column('encoding', sa.String),
+    sa.column('raw_size', sa.Integer),
+    sa.column('data', sa.LargeBinary),
+)
+
+
+def document_row(grant_id: int, data: bytes) -> dict:
+    if zstandard is not None:
+        encoding = 'zstd'
+        payload = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    else:
+        encoding = 'gzip'
+        payload = gzip.compress(data, compresslevel=GZIP_LEVEL)
+    return {
+        'grant_id': grant_id,
+        'encoding': encoding,
+        'raw_size': len(data),
+        'data': payload,
+    }
+
+
+def decompress(encoding: str, payload: bytes) -> bytes:
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise Exception("zstandard is required to read zstd raw documents")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    elif encoding == 'gzip':
+        return gzip.decompress(payload)
+    raise Exception(f"Unknown raw document encoding: {encoding}")
+
+
+def upgrade() -> None:
+    op.create_table(
+        'grant_raw_documents',
+        sa.Column('grant_id', sa.Integer(), nullable=False),
+        sa.Column('encoding', sa.String(), nullable=False),
+        sa.Column('raw_size', sa.Integer(), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(['grant_id'], ['grants.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('grant_id'),
+    )
+
+    # Compress existing documents in keyset-paginated batches
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.text(
+                "SELECT id, raw_text FROM grants "
+                "WHERE raw_text IS NOT NULL AND id > :last_id ORDER BY id LIMIT :limit"
+            ),
+            {"last_id": last_id, "limit": BATCH_SIZE},
+        ).fetchall()
+        if not rows:
+            break
+        connection.execute(
+            raw_documents.insert(),
+            [document_row(grant_id, bytes(raw)) for grant_id, raw in rows],
+        )
+        last_id = rows[-1][0]
+
+    # Compression savings: python -m grant_search.db.raw_store
+    op.drop_column('grants', 'raw_text')
+
+
+def downgrade() -> None:
+    op.add_column('grants', sa.Column('raw_text', sa.LargeBinary(), nullable=True))
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(raw_documents.c.grant_id, raw_documents.c.encoding, raw_documents.c.data)
+            .where(raw_documents.c.grant_id > last_id)
+            .order_by(raw_documents.c.grant_id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        connection.execute(
+            sa.text("UPDATE grants SET raw_text = :raw WHERE id = :id"),
+            [
+                {"id": grant_id, "raw": decompress(encoding, data)}
+                for grant_id, encoding, data in rows
+            ],
+        )
+        last_id = rows[-1][0]
+    op.drop_table('grant_raw_documents')
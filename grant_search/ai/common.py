@@ -1,8 +1,9 @@
 import logging
 import os
+import httpx
 from typing import List
 from instructor import from_openai
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from openai.types.chat import ChatCompletionMessageParam
 import threading
 
@@ -22,13 +23,47 @@ def format_for_llm(system_prompt: str, text: str) -> List[ChatCompletionMessageP
 _ai_client = None
 _lock = threading.Lock()
 
+AI_TIMEOUT = 12.0
+
+
+def _client_options() -> dict:
+    # OPEN_AI_BASE_URL points the clients at another endpoint, e.g.
+    # grant_search.bench.fake_openai
+    return {
+        "api_key": os.environ["OPEN_AI_KEY"],
+        "base_url": os.environ.get("OPEN_AI_BASE_URL") or None,
+        "timeout": AI_TIMEOUT,
+        # grant_search.ai.rate_limit retries, so 429s reach the shared limiter
+        "max_retries": 0,
+    }
+
 
 def get_ai_client():
     global _ai_client
     with _lock:
         if _ai_client is None:
-            _ai_client = from_openai(
-                OpenAI(api_key=os.environ["OPEN_AI_KEY"], timeout=12.0)
-            )
+            _ai_client = from_openai(OpenAI(**_client_options()))
             logging.info(f"AI client created")
     return _ai_client
+
+
+def get_openai_client() -> OpenAI:
+    """A plain OpenAI client, for the files and batches endpoints."""
+    # Request files run to hundreds of MB and aren't rate limited per call
+    return OpenAI(**{**_client_options(), "timeout": 600.0, "max_retries": 2})
+
+
+def get_async_ai_client(max_connections: int = 100):
+    """
+    A new instructor client over AsyncOpenAI. Its connection pool belongs to
+    the event loop it is first used on, so create one per asyncio.run, and
+    `await client.client.close()` before the loop ends.
+    """
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        ),
+        timeout=AI_TIMEOUT,
+    )
+    return from_openai(AsyncOpenAI(**_client_options(), http_client=http_client))
@@ -6,10 +6,12 @@ from pydantic import BaseModel, Field
 from datetime import datetime
 import logging
 
-from sqlalchemy.orm import undefer
+from sqlalchemy.orm import selectinload
 from sqlalchemy.orm.query import Query
 
+from grant_search.ai import telemetry
 from grant_search.ai.common import get_ai_client, format_for_llm
+from grant_search.ai.rate_limit import get_rate_limiter
 from grant_search.db.database import get_session
 from grant_search.db.models import (
     Agency,
@@ -19,7 +21,7 @@ from grant_search.db.models import (
     GrantDerivedData,
     GrantSearchQuery,
 )
-from grant_search.ingest.ingest import xml_string_to_dict
+from grant_search.ingest.nsf import xml_string_to_dict
 
 # logging.getLogger("instructor").setLevel(logging.DEBUG)
 
@@ -116,7 +118,9 @@ Fill out the results with appropriate JSON as described by the schema.
 def _get_search_function(text: str) -> SearchFunction:
     text = f"User description: {text}"
     messages = format_for_llm(SYSTEM_PROMPT, text)
-    return get_ai_client().chat.completions.create(
+    return get_rate_limiter().create(
+        get_ai_client(),
+        site="search_function",
         model=TOP_LEVEL_MODEL,
         messages=messages,
         response_model=SearchFunction,
@@ -135,7 +139,11 @@ def _filter_grants_from_linear(
         the filter criteria.
     """
     logger.info(f"Filtering grants with {lsf}")
-    query = session.query(Grant).options(undefer(Grant.raw_text))
+    # query_by_text reads these grants from its worker threads, which must not
+    # lazy load on the shared session, so load what they read up front
+    query = session.query(Grant).options(
+        selectinload(Grant.raw_document), selectinload(Grant.data_source)
+    )
     if lsf.data_source:
         datasource_query = session.query(DataSource).filter(
             DataSource.name.like(lsf.data_source)
@@ -201,7 +209,9 @@ def filter_grants_by_query(user_query: str, grant: Grant) -> Tuple[Grant, bool,
     The response must be in JSON format.
     """
     try:
-        if grant.data_source.agency == "NSF":
+        if grant.llm_view:
+            grant_text = grant.llm_view
+        elif grant.data_source.agency == "NSF":
             grant_json = xml_string_to_dict(grant.raw_text)
             award = grant_json["Award"]
             grant_data = {
@@ -216,7 +226,9 @@ def filter_grants_by_query(user_query: str, grant: Grant) -> Tuple[Grant, bool,
             grant_text = grant.raw_text
 
         messages = format_for_llm(prompt, f'grant_description: \n"{grant_text}"')
-        result = get_ai_client().chat.completions.create(
+        result = get_rate_limiter().create(
+            get_ai_client(),
+            site="filter_grant",
             model=FILTER_MODEL,
             messages=messages,
             response_model=GrantFilter,
@@ -260,7 +272,9 @@ def query_by_text(
         logging.info(f"{len(grants)} grants to scan")
         futures = [
             executor.submit(
-                filter_grants_by_query, search_function.grant_question, grant
+                telemetry.bind(filter_grants_by_query),
+                search_function.grant_question,
+                grant,
             )
             for grant in grants
         ]
@@ -3,6 +3,7 @@ import logging
 from threading import Thread
 
 from grant_search.ai.filter_string_to_function import query_by_text
+from grant_search.ai.telemetry import telemetry_run
 from grant_search.db.database import get_session
 from grant_search.db.models import Grant, GrantSearchQuery, User
 
@@ -11,7 +12,7 @@ logger = logging.getLogger(__name__)
 
 def _run_query(query_id: int):
     try:
-        with get_session() as session:
+        with telemetry_run("query", query_id=query_id), get_session() as session:
             grant_search_query = session.query(GrantSearchQuery).get(query_id)
             results = query_by_text(session, grant_search_query)
             grants = []
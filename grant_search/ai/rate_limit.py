@@ -0,0 +1,540 @@
+"""
+Shared rate limiting for OpenAI calls.
+
+Every completion goes through an LLMRateLimiter, which takes one request and
+an estimate of the call's tokens from a requests-per-minute and a
+tokens-per-minute bucket for the model before sending it. The buckets live
+in Redis (through grant_search.db.redis) so ingest workers, update runs and
+web queries all draw on the same budget; without REDISCLOUD_URL they fall
+back to buckets in this process.
+
+On top of the buckets each process runs AIMD concurrency control: the number
+of calls in flight grows by one for every `limit` successful calls and
+halves on a 429. A 429's retry-after also pauses the model for every
+process, then the call is retried.
+
+Limits default to DEFAULT_LIMITS and can be overridden for every model with
+AI_REQUESTS_PER_MINUTE and AI_TOKENS_PER_MINUTE.
+
+Each call's tokens, latency, retries and outcome are recorded with
+grant_search.ai.telemetry under the `site` the caller passes.
+"""
+
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+import openai
+from tenacity import (
+    AsyncRetrying,
+    RetryError,
+    Retrying,
+    retry_if_not_exception_type,
+    stop_after_attempt,
+)
+
+from grant_search.ai import telemetry
+
+logger = logging.getLogger(__name__)
+
+# (requests per minute, tokens per minute) by model
+DEFAULT_LIMITS = {
+    "gpt-4o": (5000, 800_000),
+    "gpt-4o-mini": (5000, 4_000_000),
+}
+FALLBACK_LIMITS = (500, 200_000)
+
+# Bucket capacity, in seconds of the per-minute rate. Smaller than a minute
+# so a burst can't spend the whole minute's budget at once.
+BURST_SECONDS = 10.0
+
+# Rough characters per token, for estimating a call before it is sent
+CHARS_PER_TOKEN = 4
+# Completion tokens assumed when a call doesn't set max_tokens
+DEFAULT_COMPLETION_TOKENS = 512
+
+MAX_ATTEMPTS = 6
+# Call site telemetry is recorded under when a caller doesn't name one
+DEFAULT_SITE = "other"
+# Retried with exponential backoff. The clients' own retries are off so that
+# 429s come back here.
+TRANSIENT_ERRORS = (openai.APIConnectionError, openai.InternalServerError)
+# instructor's own attempts, which re-ask after a response fails validation.
+# Defaults to the 3 of instructor's client; override with AI_REASK_ATTEMPTS.
+REASK_ATTEMPTS = int(os.environ.get("AI_REASK_ATTEMPTS", "3"))
+# Used when a 429 carries no retry-after
+DEFAULT_RETRY_AFTER = 2.0
+MAX_CONCURRENCY = int(os.environ.get("AI_MAX_CONCURRENCY", "256"))
+INITIAL_CONCURRENCY = int(os.environ.get("AI_CONCURRENCY", "64"))
+
+# Takes one request and ARGV[4] tokens if both buckets hold enough, after
+# refilling them. Returns the seconds to wait before trying again, as a string
+# since Lua numbers are truncated to integers on the way out.
+#
+# KEYS: requests bucket, tokens bucket, paused-until key
+# ARGV: requests per minute, tokens per minute, burst seconds, tokens
+_TAKE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local paused = tonumber(redis.call('GET', KEYS[3]) or '0')
+if paused > now then
+    return tostring(paused - now)
+end
+local burst = tonumber(ARGV[3])
+local function refill(key, per_minute)
+    local state = redis.call('HMGET', key, 'level', 'updated')
+    local capacity = per_minute * burst / 60
+    local level = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    return math.min(capacity, level + (now - updated) * per_minute / 60), capacity
+end
+local rpm = tonumber(ARGV[1])
+local tpm = tonumber(ARGV[2])
+local requests, requests_capacity = refill(KEYS[1], rpm)
+local tokens, tokens_capacity = refill(KEYS[2], tpm)
+local need_tokens = math.min(tonumber(ARGV[4]), tokens_capacity)
+local wait = 0
+if requests < 1 then
+    wait = (1 - requests) * 60 / rpm
+end
+if tokens < need_tokens then
+    wait = math.max(wait, (need_tokens - tokens) * 60 / tpm)
+end
+if wait > 0 then
+    return tostring(wait)
+end
+redis.call('HSET', KEYS[1], 'level', tostring(requests - 1), 'updated', tostring(now))
+redis.call('HSET', KEYS[2], 'level', tostring(tokens - need_tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], 120)
+redis.call('EXPIRE', KEYS[2], 120)
+return '0'
+"""
+
+# Returns ARGV[3] tokens to the tokens bucket, or takes more when it is
+# negative, once a call's actual usage is known.
+#
+# KEYS: tokens bucket
+# ARGV: tokens per minute, burst seconds, tokens
+_ADJUST_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local tpm = tonumber(ARGV[1])
+local capacity = tpm * tonumber(ARGV[2]) / 60
+local state = redis.call('HMGET', KEYS[1], 'level', 'updated')
+local level = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+level = math.min(capacity, level + (now - updated) * tpm / 60 + tonumber(ARGV[3]))
+redis.call('HSET', KEYS[1], 'level', tostring(level), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], 120)
+return tostring(level)
+"""
+
+# Pushes the paused-until time for a model forward, never back.
+#
+# KEYS: paused-until key
+# ARGV: seconds
+_PAUSE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local until_time = now + tonumber(ARGV[1])
+local paused = tonumber(redis.call('GET', KEYS[1]) or '0')
+if until_time > paused then
+    redis.call('SET', KEYS[1], tostring(until_time), 'EX', math.ceil(tonumber(ARGV[1])) + 1)
+end
+return tostring(until_time)
+"""
+
+
+def estimate_tokens(messages: list, max_tokens: Optional[int] = None) -> int:
+    """Prompt tokens estimated from its length, plus the completion allowance."""
+    prompt = sum(len(json.dumps(message, default=str)) for message in messages)
+    return prompt // CHARS_PER_TOKEN + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+def model_limits(model: str) -> tuple[int, int]:
+    requests, tokens = DEFAULT_LIMITS.get(model, FALLBACK_LIMITS)
+    requests = int(os.environ.get("AI_REQUESTS_PER_MINUTE") or requests)
+    tokens = int(os.environ.get("AI_TOKENS_PER_MINUTE") or tokens)
+    return requests, tokens
+
+
+def _api_error(error: BaseException, types) -> Optional[openai.APIError]:
+    """The API error behind an error, unwrapping instructor's retry exceptions."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, types):
+            return error
+        if isinstance(error, RetryError):
+            error = error.last_attempt.exception()
+        else:
+            error = error.__cause__ or error.__context__
+    return None
+
+
+def rate_limit_error(error: BaseException) -> Optional[openai.RateLimitError]:
+    return _api_error(error, openai.RateLimitError)
+
+
+def retry_after(error: openai.RateLimitError) -> float:
+    headers = error.response.headers if error.response is not None else {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return DEFAULT_RETRY_AFTER
+
+
+def _reask_options(kwargs: dict, retrying_class) -> dict:
+    """
+    Limits instructor's retries to validation re-asks. By default it retries
+    any error, which would send 429s straight back without the limiter.
+    """
+    if "response_model" not in kwargs or "max_retries" in kwargs:
+        return kwargs
+    retrying = retrying_class(
+        stop=stop_after_attempt(REASK_ATTEMPTS),
+        retry=retry_if_not_exception_type(openai.APIError),
+    )
+    return {**kwargs, "max_retries": retrying}
+
+
+def _usage_tokens(result) -> Optional[int]:
+    # instructor keeps the completion on the parsed model
+    response = getattr(result, "_raw_response", result)
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+class RedisBuckets:
+    """Per-model request and token buckets shared through Redis."""
+
+    def __init__(self, connection, prefix: str):
+        self.connection = connection
+        self.prefix = prefix
+        self._take = connection.register_script(_TAKE_SCRIPT)
+        self._adjust = connection.register_script(_ADJUST_SCRIPT)
+        self._pause = connection.register_script(_PAUSE_SCRIPT)
+
+    def _keys(self, model: str) -> list[str]:
+        base = f"{self.prefix}:llm_rate:{model}"
+        return [f"{base}:requests", f"{base}:tokens", f"{base}:paused_until"]
+
+    def take(self, model: str, tokens: int) -> float:
+        requests_per_minute, tokens_per_minute = model_limits(model)
+        return float(
+            self._take(
+                keys=self._keys(model),
+                args=[requests_per_minute, tokens_per_minute, BURST_SECONDS, tokens],
+            )
+        )
+
+    def adjust(self, model: str, tokens: int):
+        _, tokens_per_minute = model_limits(model)
+        self._adjust(
+            keys=self._keys(model)[1:2], args=[tokens_per_minute, BURST_SECONDS, tokens]
+        )
+
+    def pause(self, model: str, seconds: float):
+        self._pause(keys=self._keys(model)[2:], args=[seconds])
+
+
+class LocalBuckets:
+    """The same buckets held in this process, for when there is no Redis."""
+
+    def __init__(self):
+        self._levels: dict[str, list[float]] = {}
+        self._paused: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _refill(self, model: str, now: float) -> tuple[list[float], tuple]:
+        limits = model_limits(model)
+        capacity = [limit * BURST_SECONDS / 60 for limit in limits]
+        levels = self._levels.setdefault(model, [*capacity, now])
+        for i in range(2):
+            levels[i] = min(capacity[i], levels[i] + (now - levels[2]) * limits[i] / 60)
+        levels[2] = now
+        return levels, (limits, capacity)
+
+    def take(self, model: str, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            if self._paused.get(model, 0) > now:
+                return self._paused[model] - now
+            levels, (limits, capacity) = self._refill(model, now)
+            tokens = min(tokens, capacity[1])
+            wait = max(
+                (1 - levels[0]) * 60 / limits[0],
+                (tokens - levels[1]) * 60 / limits[1],
+            )
+            if wait > 0:
+                return wait
+            levels[0] -= 1
+            levels[1] -= tokens
+            return 0.0
+
+    def adjust(self, model: str, tokens: int):
+        with self._lock:
+            levels, (_, capacity) = self._refill(model, time.monotonic())
+            levels[1] = min(capacity[1], levels[1] + tokens)
+
+    def pause(self, model: str, seconds: float):
+        with self._lock:
+            until = time.monotonic() + seconds
+            self._paused[model] = max(self._paused.get(model, 0), until)
+
+
+class AIMDLimit:
+    """
+    In-flight calls allowed by this process: additive increase on success,
+    multiplicative decrease on a 429. Threads and event loops waiting for a
+    slot get one in the order they asked.
+    """
+
+    def __init__(
+        self, initial: int = INITIAL_CONCURRENCY, maximum: int = MAX_CONCURRENCY
+    ):
+        self.maximum = max(1, maximum)
+        self.limit = float(min(initial, self.maximum))
+        self.in_flight = 0
+        # Callbacks waking each waiter, which already holds the slot when woken
+        self._waiters: deque = deque()
+        self._lock = threading.Lock()
+
+    def _grant(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            self._waiters.popleft()()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if not self._waiters and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        granted = threading.Event()
+        with self._lock:
+            self._waiters.append(granted.set)
+            self._grant()
+        granted.wait()
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(
+                lambda: granted.done() or granted.set_result(None)
+            )
+
+        with self._lock:
+            self._waiters.append(wake)
+            self._grant()
+        try:
+            await granted
+        except asyncio.CancelledError:
+            with self._lock:
+                if wake in self._waiters:
+                    self._waiters.remove(wake)
+                else:
+                    # Woken as it was cancelled, so pass the slot on
+                    self.in_flight -= 1
+                    self._grant()
+            raise
+
+    def release(self, rate_limited: bool = False):
+        with self._lock:
+            self.in_flight -= 1
+            if rate_limited:
+                self.limit = max(1.0, self.limit / 2)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._grant()
+
+
+class LLMRateLimiter:
+    """Rate limits, and retries on 429, every completion sent through it."""
+
+    def __init__(self, buckets=None, concurrency: Optional[AIMDLimit] = None):
+        self.buckets = buckets or LocalBuckets()
+        self.concurrency = concurrency or AIMDLimit()
+        self.calls = 0
+        self.rate_limited = 0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def _count(self, waited: float = 0.0, rate_limited: bool = False):
+        with self._lock:
+            self.waited += waited
+            if rate_limited:
+                self.rate_limited += 1
+            else:
+                self.calls += 1
+
+    @contextmanager
+    def _slot(self, model: str, tokens: int):
+        self.concurrency.acquire()
+        outcome = {"rate_limited": False}
+        try:
+            started = time.monotonic()
+            while (wait := self.buckets.take(model, tokens)) > 0:
+                time.sleep(wait)
+            self._count(waited=time.monotonic() - started)
+            yield outcome
+        finally:
+            self.concurrency.release(outcome["rate_limited"])
+
+    @asynccontextmanager
+    async def _async_slot(self, model: str, tokens: int):
+        await self.concurrency.acquire_async()
+        outcome = {"rate_limited": False}
+        try:
+            started = time.monotonic()
+            while (
+                wait := await asyncio.to_thread(self.buckets.take, model, tokens)
+            ) > 0:
+                await asyncio.sleep(wait)
+            self._count(waited=time.monotonic() - started)
+            yield outcome
+        finally:
+            self.concurrency.release(outcome["rate_limited"])
+
+    def _finish(self, model: str, estimate: int, result):
+        used = _usage_tokens(result)
+        if used is not None and used != estimate:
+            self.buckets.adjust(model, estimate - used)
+
+    def _retry_delay(self, model: str, error: Exception, attempt: int, outcome):
+        """Seconds to wait before retrying a failed call, or raises the error."""
+        if attempt + 1 >= MAX_ATTEMPTS:
+            raise error
+        limited = rate_limit_error(error)
+        if limited is not None:
+            # The pause makes every process wait out the retry-after
+            delay = retry_after(limited)
+            self.buckets.pause(model, delay)
+            outcome["rate_limited"] = True
+            self._count(rate_limited=True)
+            logger.warning(f"Rate limited on {model}, retrying in {delay:.1f}s")
+            return 0.0
+        if _api_error(error, TRANSIENT_ERRORS) is not None:
+            delay = 2**attempt
+            logger.warning(f"{model} call failed ({error}), retrying in {delay}s")
+            return delay
+        raise error
+
+    def _failed(self, site: str, model: str, error, attempt: int, outcome, sent):
+        """The delay before retrying a failed call, recording it if it's final."""
+        try:
+            return self._retry_delay(model, error, attempt, outcome)
+        except Exception:
+            telemetry.record_call(
+                site,
+                model,
+                time.monotonic() - sent,
+                retries=attempt,
+                rate_limited=outcome["limited_calls"],
+                error=error,
+            )
+            raise
+
+    def create(self, client, site: str = DEFAULT_SITE, **kwargs):
+        """
+        Calls client.chat.completions.create(**kwargs) within the limits,
+        recording its telemetry under call site `site`.
+        """
+        model = kwargs["model"]
+        estimate = estimate_tokens(kwargs["messages"], kwargs.get("max_tokens"))
+        limited_calls = 0
+        for attempt in range(MAX_ATTEMPTS):
+            with self._slot(model, estimate) as outcome:
+                outcome["limited_calls"] = limited_calls
+                sent = time.monotonic()
+                try:
+                    result = client.chat.completions.create(
+                        **_reask_options(kwargs, Retrying)
+                    )
+                except Exception as e:
+                    delay = self._failed(site, model, e, attempt, outcome, sent)
+                else:
+                    delay = None
+                latency = time.monotonic() - sent
+            limited_calls += outcome["rate_limited"]
+            if delay is None:
+                telemetry.record_call(
+                    site,
+                    model,
+                    latency,
+                    result,
+                    retries=attempt,
+                    rate_limited=limited_calls,
+                )
+                self._finish(model, estimate, result)
+                return result
+            time.sleep(delay)
+
+    async def create_async(self, client, site: str = DEFAULT_SITE, **kwargs):
+        """The same as create, awaiting an async client."""
+        model = kwargs["model"]
+        estimate = estimate_tokens(kwargs["messages"], kwargs.get("max_tokens"))
+        limited_calls = 0
+        for attempt in range(MAX_ATTEMPTS):
+            async with self._async_slot(model, estimate) as outcome:
+                outcome["limited_calls"] = limited_calls
+                sent = time.monotonic()
+                try:
+                    result = await client.chat.completions.create(
+                        **_reask_options(kwargs, AsyncRetrying)
+                    )
+                except Exception as e:
+                    # Off the event loop, since a 429 pauses the model in Redis
+                    delay = await asyncio.to_thread(
+                        self._failed, site, model, e, attempt, outcome, sent
+                    )
+                else:
+                    delay = None
+                latency = time.monotonic() - sent
+            limited_calls += outcome["rate_limited"]
+            if delay is None:
+                telemetry.record_call(
+                    site,
+                    model,
+                    latency,
+                    result,
+                    retries=attempt,
+                    rate_limited=limited_calls,
+                )
+                await asyncio.to_thread(self._finish, model, estimate, result)
+                return result
+            await asyncio.sleep(delay)
+
+
+_rate_limiter = None
+_lock = threading.Lock()
+
+
+def get_rate_limiter() -> LLMRateLimiter:
+    """The process-wide limiter, on Redis when REDISCLOUD_URL is set."""
+    global _rate_limiter
+    with _lock:
+        if _rate_limiter is None:
+            if os.environ.get("REDISCLOUD_URL"):
+                from grant_search.db import redis
+
+                buckets = RedisBuckets(redis.connection, redis.INSTANCE_PREFIX)
+            else:
+                logger.warning("REDISCLOUD_URL is not set, rate limiting per process")
+                buckets = LocalBuckets()
+            _rate_limiter = LLMRateLimiter(buckets)
+    return _rate_limiter
@@ -0,0 +1,297 @@
+"""
+Per-call telemetry for LLM completions.
+
+LLMRateLimiter records every call it makes here: prompt, completion and
+cached tokens, latency, retries, 429s and errors, tagged by call site and
+model. Calls are aggregated in-process, with a latency histogram, by the
+process-wide `process_stats()` and by the current TelemetryRun.
+
+A run covers an enrichment job or a search query:
+
+    with telemetry_run("refresh_derived") as run:
+        ...
+
+It follows the code through contextvars, so asyncio tasks pick it up on
+their own; wrap work handed to other threads with `bind`. When a run ends
+its summary is logged and saved to llm_call_summaries, one row per call site
+and model.
+
+    python -m grant_search.ai.telemetry --limit 20
+"""
+
+import argparse
+from bisect import bisect_left
+import contextvars
+from contextlib import contextmanager
+import functools
+import logging
+import threading
+import time
+from typing import Callable, Optional
+import uuid
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+# US dollars per million (prompt, cached prompt, completion) tokens
+PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+}
+
+_current_run: contextvars.ContextVar[Optional["TelemetryRun"]] = contextvars.ContextVar(
+    "telemetry_run", default=None
+)
+
+
+class CallStats:
+    """Aggregate telemetry of the calls from one call site to one model."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        # One more bucket for anything over the last bound
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(
+        self,
+        latency: float,
+        usage: tuple[int, int, int],
+        retries: int,
+        rate_limited: int,
+        error: bool,
+    ):
+        self.calls += 1
+        self.errors += int(error)
+        self.retries += retries
+        self.rate_limited += rate_limited
+        self.prompt_tokens += usage[0]
+        self.completion_tokens += usage[1]
+        self.cached_tokens += usage[2]
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.histogram[bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def latency_percentile(self, fraction: float) -> Optional[float]:
+        """The upper bound of the bucket holding the given fraction of calls."""
+        if not self.calls:
+            return None
+        target = fraction * self.calls
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.histogram):
+            seen += count
+            if seen >= target:
+                return min(bound, self.latency_max)
+        return self.latency_max
+
+    def cost(self, model: str) -> Optional[float]:
+        if model not in PRICES:
+            return None
+        prompt, cached, completion = PRICES[model]
+        return (
+            (self.prompt_tokens - self.cached_tokens) * prompt
+            + self.cached_tokens * cached
+            + self.completion_tokens * completion
+        ) / 1_000_000
+
+
+class TelemetryRun:
+    """Call telemetry by (call site, model) for a job, query or process."""
+
+    def __init__(
+        self,
+        name: str,
+        query_id: Optional[int] = None,
+        parent: Optional["TelemetryRun"] = None,
+    ):
+        self.name = name
+        self.query_id = query_id
+        self.parent = parent
+        self.run_id = uuid.uuid4().hex
+        self.started = time.monotonic()
+        self.stats: dict[tuple[str, str], CallStats] = {}
+        self._lock = threading.Lock()
+
+    def record(self, site: str, model: str, latency: float, usage, **counts):
+        with self._lock:
+            stats = self.stats.setdefault((site, model), CallStats())
+            stats.add(latency, usage, **counts)
+
+    def summary_rows(self) -> list[dict]:
+        seconds = time.monotonic() - self.started
+        with self._lock:
+            items = sorted(self.stats.items())
+        return [
+            {
+                "run_id": self.run_id,
+                "run_name": self.name,
+                "query_id": self.query_id,
+                "call_site": site,
+                "model": model,
+                "calls": stats.calls,
+                "errors": stats.errors,
+                "retries": stats.retries,
+                "rate_limited": stats.rate_limited,
+                "prompt_tokens": stats.prompt_tokens,
+                "completion_tokens": stats.completion_tokens,
+                "cached_tokens": stats.cached_tokens,
+                "cost_usd": stats.cost(model),
+                "latency_mean": stats.latency_total / stats.calls,
+                "latency_p50": stats.latency_percentile(0.5),
+                "latency_p95": stats.latency_percentile(0.95),
+                "latency_max": stats.latency_max,
+                "seconds": seconds,
+            }
+            for (site, model), stats in items
+        ]
+
+    def log_summary(self):
+        for row in self.summary_rows():
+            cost = f"${row['cost_usd']:.4f}" if row["cost_usd"] is not None else "n/a"
+            logger.info(
+                f"LLM {self.name} {row['call_site']} ({row['model']}): "
+                f"{row['calls']} calls, {row['errors']} errors, "
+                f"{row['retries']} retries ({row['rate_limited']} rate limited), "
+                f"{row['prompt_tokens']} prompt tokens ({row['cached_tokens']} cached), "
+                f"{row['completion_tokens']} completion tokens, {cost}; latency "
+                f"p50 {row['latency_p50']:.2f}s p95 {row['latency_p95']:.2f}s "
+                f"max {row['latency_max']:.2f}s"
+            )
+
+    def save(self):
+        """Writes the summary to llm_call_summaries."""
+        from sqlalchemy import insert
+
+        from grant_search.db import database
+        from grant_search.db.models import LLMCallSummary
+
+        rows = self.summary_rows()
+        if not rows:
+            return
+        with database.engine.begin() as connection:
+            connection.execute(insert(LLMCallSummary), rows)
+
+
+_process_stats = TelemetryRun("process")
+
+
+def process_stats() -> TelemetryRun:
+    """Every call made by this process."""
+    return _process_stats
+
+
+def current_run() -> Optional[TelemetryRun]:
+    return _current_run.get()
+
+
+@contextmanager
+def telemetry_run(name: str, query_id: Optional[int] = None, save: bool = True):
+    """
+    Collects the telemetry of calls made within the block, then logs it and,
+    with `save`, writes it to llm_call_summaries. Calls also count towards
+    any enclosing run.
+    """
+    run = TelemetryRun(name, query_id=query_id, parent=_current_run.get())
+    token = _current_run.set(run)
+    try:
+        yield run
+    finally:
+        _current_run.reset(token)
+        run.log_summary()
+        if save:
+            try:
+                run.save()
+            except Exception as e:
+                # Telemetry must never fail the work it measures
+                logger.error(f"Could not save LLM telemetry of {name}: {e}")
+
+
+def bind(fn: Callable) -> Callable:
+    """
+    `fn` running in the current run, for handing to another thread. Bind once
+    per task: a bound function can't run on two threads at once.
+    """
+    context = contextvars.copy_context()
+    return functools.partial(context.run, fn)
+
+
+def usage_tokens(result) -> tuple[int, int, int]:
+    """(prompt, completion, cached prompt) tokens of a completion."""
+    # instructor keeps the completion on the parsed model
+    response = getattr(result, "_raw_response", result)
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return 0, 0, 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    return (
+        getattr(usage, "prompt_tokens", None) or 0,
+        getattr(usage, "completion_tokens", None) or 0,
+        getattr(details, "cached_tokens", None) or 0,
+    )
+
+
+def record_call(
+    site: str,
+    model: str,
+    latency: float,
+    result=None,
+    retries: int = 0,
+    rate_limited: int = 0,
+    error: Optional[BaseException] = None,
+):
+    """Records one call, successful or not, after any retries."""
+    usage = usage_tokens(result) if result is not None else (0, 0, 0)
+    counts = {
+        "retries": retries,
+        "rate_limited": rate_limited,
+        "error": error is not None,
+    }
+    _process_stats.record(site, model, latency, usage, **counts)
+    run = _current_run.get()
+    while run is not None:
+        run.record(site, model, latency, usage, **counts)
+        run = run.parent
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    from sqlalchemy import select
+
+    from grant_search.db import database
+    from grant_search.db.models import LLMCallSummary
+
+    parser = argparse.ArgumentParser(description="Recent LLM call summaries")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--run_name", help="Only runs with this name")
+    args = parser.parse_args()
+
+    query = (
+        select(LLMCallSummary)
+        .order_by(LLMCallSummary.created_at.desc())
+        .limit(args.limit)
+    )
+    if args.run_name:
+        query = query.where(LLMCallSummary.run_name == args.run_name)
+    with database.get_session() as session:
+        for summary in session.scalars(query):
+            cost = f"${summary.cost_usd:.4f}" if summary.cost_usd is not None else "n/a"
+            print(
+                f"{summary.created_at:%Y-%m-%d %H:%M} {summary.run_name} "
+                f"{summary.call_site} {summary.model}: {summary.calls} calls, "
+                f"{summary.errors} errors, {summary.retries} retries, "
+                f"{summary.prompt_tokens}+{summary.completion_tokens} tokens "
+                f"({summary.cached_tokens} cached), {cost}, "
+                f"p50 {summary.latency_p50:.2f}s p95 {summary.latency_p95:.2f}s"
+            )
@@ -0,0 +1,109 @@
+"""
+Analysis throughput against the fake OpenAI endpoint.
+
+Runs the LLM views of the same synthetic grants through the old four-thread
+pool and through AsyncAnalysisEngine at several concurrency limits and pack
+sizes, with results discarded instead of written, so the numbers show the
+requests alone. Tokens per grant come from the fake's usage counts:
+
+    python -m grant_search.bench.ai_bench --grants 2000 --latency 0.5 \\
+        --concurrency 4 64 256 --pack_sizes 1 4 8
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+# Only the engine's HTTP side is measured, but importing it needs these
+os.environ.setdefault("DATABASE_URL", "postgresql://bench@localhost/bench")
+os.environ.setdefault("OPEN_AI_KEY", "fake")
+
+from grant_search.bench.corpus import nsf_awards
+from grant_search.bench.fake_openai import FakeOpenAI
+from grant_search.ingest.llm_view import build_llm_view
+from grant_search.ingest.nsf import extract_nsf_award
+
+
+def _discard(results):
+    pass
+
+
+def run_threaded(texts: list[str], workers: int) -> float:
+    from grant_search.ai.common import format_for_llm, get_ai_client
+    from grant_search.ingest.send_to_ai import MODEL, SYSTEM_PROMPT, GrantAnalysis
+
+    client = get_ai_client()
+
+    def analyze(text: str):
+        return client.chat.completions.create(
+            model=MODEL,
+            messages=format_for_llm(SYSTEM_PROMPT, text),
+            response_model=GrantAnalysis,
+            max_tokens=1024,
+        )
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(analyze, texts))
+    return time.perf_counter() - started
+
+
+def run_async(texts: list[str], concurrency: int, pack_size: int = 1) -> float:
+    from grant_search.ingest.analysis_engine import AsyncAnalysisEngine
+
+    engine = AsyncAnalysisEngine(
+        concurrency=concurrency, writer=_discard, pack_size=pack_size
+    )
+    started = time.perf_counter()
+    engine.run(enumerate(texts))
+    elapsed = time.perf_counter() - started
+    if engine.failed:
+        raise Exception(f"{engine.failed} analyses failed")
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark LLM analysis engines")
+    parser.add_argument("--grants", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[4, 16, 64, 256])
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument(
+        "--pack_sizes",
+        type=int,
+        nargs="+",
+        default=[1],
+        help="Grants per request for the async runs",
+    )
+    parser.add_argument(
+        "--drop_rate",
+        type=float,
+        default=0.0,
+        help="Fraction of packed grants the fake leaves out",
+    )
+    args = parser.parse_args()
+
+    texts = [
+        build_llm_view(extract_nsf_award(content))
+        for content in nsf_awards(args.grants)
+    ]
+    with FakeOpenAI(latency=args.latency, drop_rate=args.drop_rate) as fake:
+        os.environ["OPEN_AI_BASE_URL"] = fake.base_url
+        runs = [(f"threads x{args.threads}", run_threaded, (args.threads,))] + [
+            (f"async x{limit} pack {pack_size}", run_async, (limit, pack_size))
+            for limit in args.concurrency
+            for pack_size in args.pack_sizes
+        ]
+        for name, run, options in runs:
+            fake.max_in_flight = 0
+            requests = fake.requests
+            tokens = fake.prompt_tokens + fake.completion_tokens
+            elapsed = run(texts, *options)
+            tokens = fake.prompt_tokens + fake.completion_tokens - tokens
+            print(
+                f"{name:>20}: {len(texts) / elapsed:8.1f} grants/sec, "
+                f"{tokens / len(texts):7.1f} tokens/grant, "
+                f"{fake.requests - requests} requests, "
+                f"{fake.max_in_flight} max in flight"
+            )
@@ -0,0 +1,442 @@
+"""
+Synthetic grant documents shaped like the real NSF and NIH sources.
+
+Documents are generated from a seeded random.Random so the same seed always
+produces the same corpus, which keeps benchmark runs comparable.
+
+    python -m grant_search.bench.corpus --grants 100000 \
+        --nsf_zip /tmp/nsf.zip --nih_pages /tmp/nih_pages
+"""
+
+import argparse
+import csv
+from datetime import datetime, timedelta
+import json
+import os
+import random
+import threading
+from typing import Iterator
+from xml.sax.saxutils import escape
+import zipfile
+
+WORDS = (
+    "adaptive analysis biology carbon cellular climate community computational "
+    "data design development dynamics ecology education energy engineering "
+    "equity genomic graduate imaging inclusive infrastructure learning "
+    "materials mechanisms modeling molecular network neural ocean outreach "
+    "physics plasma polymer quantum regional research resilience robotics "
+    "science sensing signaling spatial students sustainable systems theory "
+    "training transport underrepresented urban water"
+).split()
+
+FIRST_NAMES = (
+    "Alex Maria Wei Priya John Fatima Carlos Yuki Olga Samuel Aisha David "
+    "Elena Kwame Laura Mohammed Nina Pedro Sara Tomas"
+).split()
+LAST_NAMES = (
+    "Anderson Brown Chen Garcia Hernandez Ivanova Johnson Kim Lopez Martin "
+    "Nguyen Okafor Patel Rossi Smith Tanaka Umar Williams Xu Zhang"
+).split()
+INSTITUTIONS = [
+    "University of Chicago",
+    "Stanford University",
+    "University of Michigan Ann Arbor",
+    "Georgia Tech Research Corporation",
+    "University of Texas at Austin",
+    "Ohio State University",
+    "Arizona State University",
+    "University of Washington",
+]
+DIRECTORATES = [
+    ("MPS", "Direct For Mathematical & Physical Scien"),
+    ("BIO", "Direct For Biological Sciences"),
+    ("EDU", "Directorate for STEM Education"),
+    ("ENG", "Directorate For Engineering"),
+    ("GEO", "Directorate For Geosciences"),
+]
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    text = " ".join(rng.choices(WORDS, k=words))
+    return text[0].upper() + text[1:] + "."
+
+
+def _paragraph(rng: random.Random, sentences: int) -> str:
+    return " ".join(_sentence(rng, rng.randint(8, 24)) for _ in range(sentences))
+
+
+def _person(rng: random.Random) -> tuple[str, str]:
+    return rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+
+
+def _start_date(rng: random.Random, year: int) -> datetime:
+    return datetime(year, 1, 1) + timedelta(days=rng.randrange(365))
+
+
+def nsf_award_xml(index: int, rng: random.Random, year: int = 2024) -> bytes:
+    """A single NSF award file, including the fields ingest doesn't read."""
+    award_id = f"{year % 100:02d}{index:05d}"
+    start = _start_date(rng, year)
+    end = start + timedelta(days=365 * rng.randint(1, 5))
+    amount = rng.randrange(20_000, 3_000_000)
+    abbreviation, directorate = rng.choice(DIRECTORATES)
+    institution = rng.choice(INSTITUTIONS)
+
+    investigators = []
+    for role_index in range(rng.randint(1, 4)):
+        first, last = _person(rng)
+        role = "Principal Investigator" if role_index == 0 else "Co-Principal Investigator"
+        investigators.append(
+            f"<Investigator><PI_FULL_NAME>{first} {last}</PI_FULL_NAME>"
+            f"<PI_FIRST_NAME>{first}</PI_FIRST_NAME><PI_LAST_NAME>{last}</PI_LAST_NAME>"
+            f"<PI_MID_INIT/><PI_SUFX_NAME/>"
+            f"<PI_EMAI_ADDR>{first.lower()}.{last.lower()}@example.edu</PI_EMAI_ADDR>"
+            f"<NSF_ID>000{rng.randrange(100000, 999999)}</NSF_ID>"
+            f"<PI_START_DATE>{start:%m/%d/%Y}</PI_START_DATE><PI_END_DATE/>"
+            f"<ROLE_CODE>{role}</ROLE_CODE></Investigator>"
+        )
+    abstract = "&lt;br/&gt;&lt;br/&gt;".join(
+        escape(_paragraph(rng, rng.randint(3, 8))) for _ in range(rng.randint(1, 4))
+    )
+    program_elements = "".join(
+        f"<ProgramElement><Code>{rng.randrange(1000, 9999)}</Code>"
+        f"<Text>{escape(_sentence(rng, 3))}</Text></ProgramElement>"
+        for _ in range(rng.randint(1, 3))
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<rootTag>\n<Award>\n'
+        f"<AwardTitle>{escape(_sentence(rng, rng.randint(5, 14)))}</AwardTitle>\n"
+        "<AGENCY>NSF</AGENCY>\n"
+        f"<AwardEffectiveDate>{start:%m/%d/%Y}</AwardEffectiveDate>\n"
+        f"<AwardExpirationDate>{end:%m/%d/%Y}</AwardExpirationDate>\n"
+        f"<AwardTotalIntnAmount>{amount}.00</AwardTotalIntnAmount>\n"
+        f"<AwardAmount>{amount}</AwardAmount>\n"
+        "<AwardInstrument><Value>Standard Grant</Value></AwardInstrument>\n"
+        f"<Organization><Code>0{rng.randrange(1000000, 9999999)}</Code>"
+        f"<Directorate><Abbreviation>{abbreviation}</Abbreviation>"
+        f"<LongName>{escape(directorate)}</LongName></Directorate>"
+        "<Division><Abbreviation>DIV</Abbreviation><LongName>Division</LongName>"
+        "</Division></Organization>\n"
+        "<ProgramOfficer><SignBlockName>Program Officer</SignBlockName>"
+        "<PO_EMAI>po@nsf.gov</PO_EMAI><PO_PHON>7032920000</PO_PHON></ProgramOfficer>\n"
+        f"<AbstractNarration>{abstract}</AbstractNarration>\n"
+        f"<MinAmdLetterDate>{start:%m/%d/%Y}</MinAmdLetterDate>\n"
+        f"<MaxAmdLetterDate>{start:%m/%d/%Y}</MaxAmdLetterDate>\n"
+        "<TRAN_TYPE>Grant</TRAN_TYPE>\n<CFDA_NUM>47.049</CFDA_NUM>\n"
+        "<NSF_PAR_USE_FLAG>1</NSF_PAR_USE_FLAG>\n"
+        f"<AwardID>{award_id}</AwardID>\n"
+        + "\n".join(investigators)
+        + f"\n<Institution><Name>{escape(institution)}</Name>"
+        "<CityName>Chicago</CityName><ZipCode>606375418</ZipCode>"
+        "<PhoneNumber>7737028669</PhoneNumber><StreetAddress>5801 S Ellis Ave</StreetAddress>"
+        "<CountryName>United States</CountryName><StateName>Illinois</StateName>"
+        "<StateCode>IL</StateCode></Institution>\n"
+        + program_elements
+        + f"\n<FUND_OBLG>{year}~{amount}</FUND_OBLG>\n</Award>\n</rootTag>\n"
+    ).encode()
+
+
+def iter_nsf_awards(
+    count: int, seed: int = 0, year: int = 2024
+) -> Iterator[tuple[str, bytes]]:
+    """Yields (member name, XML) pairs named like the NSF bulk download."""
+    rng = random.Random(seed)
+    for index in range(count):
+        yield f"{year % 100:02d}{index:05d}.xml", nsf_award_xml(index, rng, year)
+
+
+def nsf_awards(count: int, seed: int = 0, year: int = 2024) -> list[bytes]:
+    return [content for _, content in iter_nsf_awards(count, seed, year)]
+
+
+def write_nsf_zip(path: str, count: int, seed: int = 0, year: int = 2024):
+    """Writes an NSF-style zip of one XML file per award, one award at a time."""
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        for name, content in iter_nsf_awards(count, seed, year):
+            zip_ref.writestr(name, content)
+
+
+# Generated days NIHCorpus keeps around for the next page
+RECENT_DAYS = 16
+
+
+def _day_weight(day: datetime) -> float:
+    # NIH project starts cluster on the first of the month and avoid weekends
+    if day.day == 1:
+        return 3.0
+    return 0.2 if day.weekday() >= 5 else 1.0
+
+
+class NIHCorpus:
+    """
+    A year of RePORTER projects, generated on demand one start date at a time.
+
+    `count` projects are spread over the year's days by a fixed weighting and
+    each day's projects come from their own seeded generator, so any date
+    window can be produced (or counted) without materialising the year. That
+    lets a stub API answer windowed, paged searches at 1M-project scale.
+    """
+
+    def __init__(self, count: int, seed: int = 0, year: int = 2024):
+        self.count = count
+        self.seed = seed
+        self.year = year
+        start = datetime(year, 1, 1)
+        self.days = [
+            start + timedelta(days=offset)
+            for offset in range((datetime(year + 1, 1, 1) - start).days)
+        ]
+        weights = [_day_weight(day) for day in self.days]
+        total_weight = sum(weights)
+        # Largest-remainder apportionment so the days add up to `count`
+        shares = [count * weight / total_weight for weight in weights]
+        self.day_counts = [int(share) for share in shares]
+        by_remainder = sorted(
+            range(len(shares)), key=lambda i: shares[i] - self.day_counts[i], reverse=True
+        )
+        for i in by_remainder[: count - sum(self.day_counts)]:
+            self.day_counts[i] += 1
+        # appl_ids are assigned consecutively through the year
+        self.first_ids = []
+        next_id = 10_000_000
+        for day_count in self.day_counts:
+            self.first_ids.append(next_id)
+            next_id += day_count
+        self._recent: dict[int, list[dict]] = {}
+        self._lock = threading.Lock()
+
+    def _day_index(self, day: datetime) -> int:
+        return (day - self.days[0]).days
+
+    def projects_for_day(self, day: datetime) -> list[dict]:
+        index = self._day_index(day)
+        with self._lock:
+            if index in self._recent:
+                return self._recent[index]
+        rng = random.Random(f"{self.seed}-{self.year}-{index}")
+        projects = [
+            nih_project(self.first_ids[index] + i, rng, day)
+            for i in range(self.day_counts[index])
+        ]
+        with self._lock:
+            # Consecutive pages usually share a day at their boundary
+            self._recent[index] = projects
+            while len(self._recent) > RECENT_DAYS:
+                del self._recent[next(iter(self._recent))]
+        return projects
+
+    def _window_days(self, from_date: datetime, to_date: datetime) -> range:
+        first = max(0, self._day_index(from_date))
+        last = min(len(self.days) - 1, self._day_index(to_date))
+        return range(first, last + 1)
+
+    def total(self, from_date: datetime, to_date: datetime) -> int:
+        return sum(self.day_counts[i] for i in self._window_days(from_date, to_date))
+
+    def search(
+        self, from_date: datetime, to_date: datetime, offset: int, limit: int
+    ) -> list[dict]:
+        """One page of the projects starting in [from_date, to_date]."""
+        results = []
+        for i in self._window_days(from_date, to_date):
+            if offset >= self.day_counts[i]:
+                offset -= self.day_counts[i]
+                continue
+            projects = self.projects_for_day(self.days[i])
+            results.extend(projects[offset : offset + limit - len(results)])
+            offset = 0
+            if len(results) >= limit:
+                break
+        return results
+
+    def __iter__(self) -> Iterator[dict]:
+        for day in self.days:
+            yield from self.projects_for_day(day)
+
+
+def nih_project(appl_id: int, rng: random.Random, start: datetime) -> dict:
+    """A RePORTER v2 project record, including fields ingest doesn't read."""
+    end = start + timedelta(days=365 * rng.randint(1, 5) - 1)
+    activity = rng.choice(["R01", "R21", "R35", "K99", "U01", "P30", "F31"])
+    institute = rng.choice(["CA", "GM", "HL", "AI", "MH", "NS", "DK"])
+    serial = rng.randrange(100000, 999999)
+    investigators = []
+    for role_index in range(rng.randint(1, 3)):
+        first, last = _person(rng)
+        investigators.append(
+            {
+                "profile_id": rng.randrange(1_000_000, 99_999_999),
+                "first_name": first,
+                "middle_name": "",
+                "last_name": last,
+                "is_contact_pi": role_index == 0,
+                "full_name": f"{first} {last}",
+                "title": "PROFESSOR",
+            }
+        )
+    return {
+        "appl_id": appl_id,
+        "subproject_id": None,
+        "fiscal_year": start.year,
+        "project_num": f"1{activity}{institute}{serial}-01",
+        "project_serial_num": f"{institute}{serial}",
+        "organization": {
+            "org_name": rng.choice(INSTITUTIONS).upper(),
+            "org_city": "CHICAGO",
+            "org_country": "UNITED STATES",
+            "org_state": "IL",
+            "org_zipcode": "606375418",
+        },
+        "award_type": "1",
+        "activity_code": activity,
+        # Some RePORTER projects come back without an amount
+        "award_amount": (
+            None if rng.random() < 0.1 else rng.randrange(50_000, 3_000_000)
+        ),
+        "is_active": True,
+        "principal_investigators": investigators,
+        "contact_pi_name": investigators[0]["full_name"].upper(),
+        "program_officers": [
+            {"first_name": "Program", "last_name": "Officer", "full_name": "Program Officer"}
+        ],
+        "agency_ic_admin": {
+            "code": institute,
+            "abbreviation": f"NI{institute}",
+            "name": "National Institute",
+        },
+        "agency_ic_fundings": [
+            {"fy": start.year, "code": institute, "name": "National Institute"}
+        ],
+        "project_start_date": f"{start:%Y-%m-%d}T00:00:00Z",
+        "project_end_date": f"{end:%Y-%m-%d}T00:00:00Z",
+        "budget_start": f"{start:%Y-%m-%d}T00:00:00Z",
+        "budget_end": f"{start + timedelta(days=364):%Y-%m-%d}T00:00:00Z",
+        "project_title": _sentence(rng, rng.randint(5, 14)).rstrip("."),
+        "abstract_text": "\n\n".join(
+            _paragraph(rng, rng.randint(3, 8)) for _ in range(rng.randint(2, 5))
+        ),
+        "phr_text": _paragraph(rng, 2),
+        "pref_terms": ";".join(sorted({rng.choice(WORDS) for _ in range(12)})),
+        "spending_categories_desc": "Basic Science",
+        "agency_code": "NIH",
+        "date_added": f"{start:%Y-%m-%d}T00:00:00",
+    }
+
+
+def write_nih_pages(directory: str, corpus: NIHCorpus, page_size: int = 500):
+    """
+    Writes the corpus as RePORTER search responses, `page_size` results each,
+    to numbered JSON files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    page = []
+    offset = 0
+
+    def write():
+        content = {
+            "meta": {
+                "search_id": f"bench-{corpus.seed}",
+                "total": corpus.count,
+                "offset": offset,
+                "limit": page_size,
+            },
+            "results": page,
+        }
+        path = os.path.join(directory, f"page-{offset // page_size:05d}.json")
+        with open(path, "wt") as f:
+            json.dump(content, f)
+
+    for project in corpus:
+        page.append(project)
+        if len(page) == page_size:
+            write()
+            offset += len(page)
+            page = []
+    if page:
+        write()
+
+
+def exporter_rows(project: dict) -> tuple[dict, dict]:
+    """The ExPORTER projects and abstracts rows for a RePORTER project."""
+    names = ";".join(
+        f"{pi['last_name'].upper()}, {pi['first_name'].upper()}"
+        + (" (contact)" if pi["is_contact_pi"] else "")
+        for pi in project["principal_investigators"]
+    )
+    start = datetime.strptime(project["project_start_date"], "%Y-%m-%dT%H:%M:%SZ")
+    end = datetime.strptime(project["project_end_date"], "%Y-%m-%dT%H:%M:%SZ")
+    organization = project["organization"]
+    amount = project["award_amount"]
+    row = {
+        "APPLICATION_ID": project["appl_id"],
+        "ACTIVITY": project["activity_code"],
+        "ADMINISTERING_IC": project["agency_ic_admin"]["code"],
+        "APPLICATION_TYPE": project["award_type"],
+        "CORE_PROJECT_NUM": project["project_num"][1:12],
+        "FULL_PROJECT_NUM": project["project_num"],
+        "FY": project["fiscal_year"],
+        "IC_NAME": project["agency_ic_admin"]["name"].upper(),
+        "ORG_CITY": organization["org_city"],
+        "ORG_COUNTRY": organization["org_country"],
+        "ORG_NAME": organization["org_name"],
+        "ORG_STATE": organization["org_state"],
+        "ORG_ZIPCODE": organization["org_zipcode"],
+        "PHR": project["phr_text"],
+        "PI_NAMEs": names + ";",
+        "PROJECT_START": f"{start:%m/%d/%Y}",
+        "PROJECT_END": f"{end:%m/%d/%Y}",
+        "PROJECT_TERMS": project["pref_terms"],
+        "PROJECT_TITLE": project["project_title"].upper(),
+        "SUBPROJECT_ID": "",
+        "TOTAL_COST": "" if amount is None else amount,
+        "TOTAL_COST_SUB_PROJECT": "",
+    }
+    return row, {
+        "APPLICATION_ID": project["appl_id"],
+        "ABSTRACT_TEXT": project["abstract_text"],
+    }
+
+
+def write_exporter_csvs(projects_path: str, abstracts_path: str, corpus: NIHCorpus):
+    """Writes the corpus as ExPORTER projects and abstracts CSVs."""
+    with open(projects_path, "wt", newline="") as projects_file, open(
+        abstracts_path, "wt", newline=""
+    ) as abstracts_file:
+        projects = abstracts = None
+        for project in corpus:
+            row, abstract = exporter_rows(project)
+            if projects is None:
+                projects = csv.DictWriter(projects_file, fieldnames=list(row))
+                abstracts = csv.DictWriter(abstracts_file, fieldnames=list(abstract))
+                projects.writeheader()
+                abstracts.writeheader()
+            projects.writerow(row)
+            abstracts.writerow(abstract)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic grant corpus")
+    parser.add_argument("--grants", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--year", type=int, default=2024)
+    parser.add_argument("--nsf_zip", help="Write NSF award XML to this zip")
+    parser.add_argument("--nih_pages", help="Write RePORTER JSON pages here")
+    parser.add_argument(
+        "--exporter_csvs",
+        nargs=2,
+        metavar=("PROJECTS", "ABSTRACTS"),
+        help="Write ExPORTER projects and abstracts CSVs",
+    )
+    args = parser.parse_args()
+
+    if args.nsf_zip:
+        write_nsf_zip(args.nsf_zip, args.grants, seed=args.seed, year=args.year)
+        print(f"Wrote {args.grants} NSF awards to {args.nsf_zip}")
+    if args.nih_pages:
+        write_nih_pages(args.nih_pages, NIHCorpus(args.grants, args.seed, args.year))
+        print(f"Wrote {args.grants} NIH projects to {args.nih_pages}")
+    if args.exporter_csvs:
+        write_exporter_csvs(
+            *args.exporter_csvs, NIHCorpus(args.grants, args.seed, args.year)
+        )
+        print(f"Wrote {args.grants} NIH projects to {' and '.join(args.exporter_csvs)}")
@@ -0,0 +1,429 @@
+"""
+A local stand-in for the OpenAI chat completions, files and batches endpoints.
+
+Answers instructor's tool calls (and JSON-mode requests) with arguments
+generated from the request's own JSON schema, after an injected latency, so
+the analysis engines can be exercised and benchmarked without the real API:
+
+    python -m grant_search.bench.fake_openai --port 8766 --latency 0.5
+    OPEN_AI_BASE_URL=http://127.0.0.1:8766/v1 OPEN_AI_KEY=fake ...
+
+A fraction of requests can be answered with 429 and a retry-after header.
+Packed requests (see grant_search.ingest.packing) get one entry per
+`### Grant <id>` in the prompt, less `drop_rate` of them.
+Batch jobs are run on a background thread over their uploaded JSONL file and
+complete after `batch_delay` seconds; with `error_rate` set, that fraction of
+their requests land in the error file instead of the output file.
+"""
+
+import argparse
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import random
+import re
+import threading
+import time
+from typing import Optional
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Rough characters per token, for the usage block
+CHARS_PER_TOKEN = 4
+
+GRANT_HEADER = re.compile(r"### Grant (\d+)")
+
+
+def _resolve(schema: dict, defs: dict) -> dict:
+    while "$ref" in schema:
+        schema = defs[schema["$ref"].split("/")[-1]]
+    return schema
+
+
+def fake_value(
+    schema: dict,
+    defs: dict,
+    rng: random.Random,
+    name: str = "",
+    grant_ids: Optional[list[int]] = None,
+):
+    """
+    A value matching a (pydantic-generated) JSON schema. Arrays of objects
+    with a grant_id get one item per id in `grant_ids`.
+    """
+    if "$ref" in schema:
+        return fake_value(_resolve(schema, defs), defs, rng, name, grant_ids)
+    for key in ["anyOf", "oneOf", "allOf"]:
+        if key in schema:
+            options = [option for option in schema[key] if option.get("type") != "null"]
+            return fake_value(options[0], defs, rng, name, grant_ids)
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    kind = schema.get("type", "object")
+    if kind == "object":
+        return {
+            key: fake_value(value, defs, rng, key, grant_ids)
+            for key, value in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        items = _resolve(schema.get("items", {}), defs)
+        if grant_ids is not None and "grant_id" in items.get("properties", {}):
+            return [
+                {**fake_value(items, defs, rng, name), "grant_id": grant_id}
+                for grant_id in grant_ids
+            ]
+        return [
+            fake_value(schema.get("items", {}), defs, rng, name)
+            for _ in range(max(1, schema.get("minItems", 1)))
+        ]
+    if kind == "boolean":
+        return rng.random() < 0.5
+    if kind == "integer":
+        return rng.randint(schema.get("minimum", 0), schema.get("maximum", 100))
+    if kind == "number":
+        return round(rng.uniform(schema.get("minimum", 0), schema.get("maximum", 1)), 3)
+    return f"Fake {name or 'text'} {rng.randrange(1_000_000)}"
+
+
+def _schema_of(request: dict) -> tuple[str, dict]:
+    if request.get("tools"):
+        function = request["tools"][0]["function"]
+        return function["name"], function["parameters"]
+    response_format = request.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        schema = response_format["json_schema"]
+        return schema.get("name", "response"), schema["schema"]
+    return "response", {"type": "object", "properties": {}}
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def parse_multipart(content_type: str, body: bytes) -> dict[str, tuple]:
+    """Form fields of a multipart body as name -> (filename, bytes)."""
+    message = BytesParser().parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    return {
+        part.get_param("name", header="content-disposition"): (
+            part.get_filename(),
+            part.get_payload(decode=True),
+        )
+        for part in message.get_payload()
+    }
+
+
+def _not_found(path: str) -> tuple[int, dict, dict]:
+    return 404, {"error": {"message": f"Unknown path {path}"}}, {}
+
+
+class FakeOpenAI:
+    """
+    Serves fake chat completions on a background thread.
+
+    Each response waits `latency` seconds, +/- `jitter` of that. `error_rate`
+    of requests get a 429 telling the client to retry after `retry_after`.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.2,
+        error_rate: float = 0.0,
+        retry_after: float = 1.0,
+        batch_delay: float = 0.0,
+        drop_rate: float = 0.0,
+        port: int = 0,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.batch_delay = batch_delay
+        self.drop_rate = drop_rate
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.files: dict[str, dict] = {}
+        self.file_contents: dict[str, bytes] = {}
+        self.batches: dict[str, dict] = {}
+        self.requests = 0
+        self.rate_limited = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, content, headers: dict):
+                if isinstance(content, bytes):
+                    body, content_type = content, "application/octet-stream"
+                else:
+                    body, content_type = (
+                        json.dumps(content).encode(),
+                        "application/json",
+                    )
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                content_type = self.headers.get("Content-Type", "")
+                if content_type.startswith("multipart/form-data"):
+                    request = parse_multipart(content_type, body)
+                else:
+                    request = json.loads(body or b"{}")
+                status, content, headers = fake.handle(self.path, request)
+                self._send(status, content, headers)
+
+            def do_GET(self):
+                status, content, headers = fake.handle_get(self.path)
+                self._send(status, content, headers)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.server.request_queue_size = 1024
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _wait(self):
+        with self._lock:
+            delay = self.latency * (1 + self._rng.uniform(-self.jitter, self.jitter))
+        if delay > 0:
+            time.sleep(delay)
+
+    def handle(self, path: str, request: dict) -> tuple[int, dict, dict]:
+        path = path.split("?")[0].rstrip("/")
+        if path.endswith("/chat/completions"):
+            return self.chat_completion(request)
+        if path.endswith("/files"):
+            filename, data = request["file"]
+            purpose = request.get("purpose", (None, b"batch"))[1].decode()
+            return 200, self.add_file(data, filename, purpose), {}
+        if path.endswith("/batches"):
+            return self.create_batch(request)
+        return _not_found(path)
+
+    def handle_get(self, path: str) -> tuple:
+        parts = path.split("?")[0].strip("/").split("/")
+        if len(parts) >= 3 and parts[-3] == "files" and parts[-1] == "content":
+            if parts[-2] in self.file_contents:
+                return 200, self.file_contents[parts[-2]], {}
+        elif len(parts) >= 2 and parts[-2] == "files":
+            if parts[-1] in self.files:
+                return 200, self.files[parts[-1]], {}
+        elif len(parts) >= 2 and parts[-2] == "batches":
+            if parts[-1] in self.batches:
+                with self._lock:
+                    return 200, dict(self.batches[parts[-1]]), {}
+        return _not_found(path)
+
+    def add_file(self, data: bytes, filename: str, purpose: str) -> dict:
+        file = {
+            "id": f"file-{uuid.uuid4().hex[:24]}",
+            "object": "file",
+            "bytes": len(data),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        self.files[file["id"]] = file
+        self.file_contents[file["id"]] = data
+        return file
+
+    def create_batch(self, request: dict) -> tuple[int, dict, dict]:
+        if request.get("input_file_id") not in self.file_contents:
+            return 400, {"error": {"message": "Unknown input_file_id"}}, {}
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}",
+            "object": "batch",
+            "endpoint": request["endpoint"],
+            "errors": None,
+            "input_file_id": request["input_file_id"],
+            "completion_window": request["completion_window"],
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": request.get("metadata"),
+        }
+        self.batches[batch["id"]] = batch
+        threading.Thread(target=self._run_batch, args=(batch,), daemon=True).start()
+        return 200, dict(batch), {}
+
+    def _run_batch(self, batch: dict):
+        lines = self.file_contents[batch["input_file_id"]].decode().splitlines()
+        requests = [json.loads(line) for line in lines if line.strip()]
+        with self._lock:
+            batch["status"] = "in_progress"
+            batch["in_progress_at"] = int(time.time())
+            batch["request_counts"]["total"] = len(requests)
+        output, errors = [], []
+        for request in requests:
+            with self._lock:
+                failed = self._rng.random() < self.error_rate
+            if failed:
+                response = {
+                    "status_code": 500,
+                    "request_id": uuid.uuid4().hex,
+                    "body": {"error": {"message": "Server error (fake)"}},
+                }
+            else:
+                response = {
+                    "status_code": 200,
+                    "request_id": uuid.uuid4().hex,
+                    "body": self.completion(request["body"]),
+                }
+            line = {
+                "id": f"batch_req_{uuid.uuid4().hex[:24]}",
+                "custom_id": request["custom_id"],
+                "response": response,
+                "error": None,
+            }
+            (errors if failed else output).append(json.dumps(line))
+        if self.batch_delay > 0:
+            time.sleep(self.batch_delay)
+        output_file = self.add_file(
+            "\n".join(output).encode(), "batch_output.jsonl", "batch_output"
+        )
+        error_file = None
+        if errors:
+            error_file = self.add_file(
+                "\n".join(errors).encode(), "batch_errors.jsonl", "batch_output"
+            )
+        with self._lock:
+            batch["request_counts"]["completed"] = len(output)
+            batch["request_counts"]["failed"] = len(errors)
+            batch["output_file_id"] = output_file["id"]
+            batch["error_file_id"] = error_file["id"] if error_file else None
+            batch["status"] = "completed"
+            batch["completed_at"] = int(time.time())
+
+    def completion(self, request: dict) -> dict:
+        """The chat.completion body for a request, without waiting."""
+        name, schema = _schema_of(request)
+        prompt = json.dumps(request.get("messages", []))
+        with self._lock:
+            grant_ids = [
+                int(grant_id)
+                for grant_id in GRANT_HEADER.findall(prompt)
+                if self._rng.random() >= self.drop_rate
+            ]
+            arguments = json.dumps(
+                fake_value(schema, schema.get("$defs", {}), self._rng, "", grant_ids)
+            )
+            self.prompt_tokens += _tokens(prompt)
+            self.completion_tokens += _tokens(arguments)
+        message = {"role": "assistant", "content": None}
+        if request.get("tools"):
+            message["tool_calls"] = [
+                {
+                    "id": f"call_{uuid.uuid4().hex[:24]}",
+                    "type": "function",
+                    "function": {"name": name, "arguments": arguments},
+                }
+            ]
+            finish_reason = "tool_calls"
+        else:
+            message["content"] = arguments
+            finish_reason = "stop"
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [
+                {"index": 0, "message": message, "finish_reason": finish_reason}
+            ],
+            "usage": {
+                "prompt_tokens": _tokens(prompt),
+                "completion_tokens": _tokens(arguments),
+                "total_tokens": _tokens(prompt) + _tokens(arguments),
+            },
+        }
+
+    def chat_completion(self, request: dict) -> tuple[int, dict, dict]:
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            limited = self._rng.random() < self.error_rate
+        try:
+            self._wait()
+            if limited:
+                with self._lock:
+                    self.rate_limited += 1
+                return (
+                    429,
+                    {
+                        "error": {
+                            "message": "Rate limit reached (fake)",
+                            "type": "requests",
+                            "code": "rate_limit_exceeded",
+                        }
+                    },
+                    {"retry-after": str(self.retry_after)},
+                )
+            return 200, self.completion(request), {}
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def start(self) -> "FakeOpenAI":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "FakeOpenAI":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fake OpenAI endpoint")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--retry_after", type=float, default=1.0)
+    parser.add_argument("--batch_delay", type=float, default=5.0)
+    parser.add_argument("--drop_rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        batch_delay=args.batch_delay,
+        drop_rate=args.drop_rate,
+        port=args.port,
+    )
+    print(f"Serving fake completions at {fake.base_url}")
+    fake.server.serve_forever()
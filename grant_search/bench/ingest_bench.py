@@ -0,0 +1,329 @@
+"""
+End-to-end ingest benchmark.
+
+Each scenario runs `Ingester.ingest()` in a fresh subprocess against the
+database in DATABASE_URL (which must be a local Postgres with the schema
+migrated), so peak RSS is per run. NSF scenarios read a generated award zip
+from disk, NIH scenarios fetch from a ReporterStub serving a generated
+corpus, and the AI handoff is replaced with a stub that only counts grants.
+
+Results are appended to a JSONL file together with the git commit, so runs
+of the same scenario and scale can be compared across commits:
+
+    python -m grant_search.bench.ingest_bench --grants 10000 \\
+        --scenarios nsf nsf-stream nih --results bench_results.jsonl
+"""
+
+import argparse
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+
+DEFAULT_YEAR = 2024
+
+# Ingester options per scenario, on top of the common ones
+SCENARIOS = {
+    "nsf": {"agency": "NSF", "stream": False, "workers": 1},
+    "nsf-stream": {"agency": "NSF", "stream": True, "workers": 1},
+    "nsf-parallel": {"agency": "NSF", "stream": True, "workers": 4},
+    "nih": {"agency": "NIH", "workers": 4},
+    "nih-exporter": {"agency": "NIH", "nih_source": "exporter", "workers": 1},
+}
+
+LOCAL_HOSTS = [None, "", "localhost", "127.0.0.1", "::1"]
+
+
+class StubAI:
+    """Stands in for SendToAI so runs measure ingest, not the model."""
+
+    grants = 0
+
+    def process_grant_texts(self, grants) -> int:
+        count = sum(1 for _ in grants)
+        StubAI.grants += count
+        return count
+
+
+def _peak_rss_mb(who: int) -> float:
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+def _git_commit() -> tuple[str, bool]:
+    root = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=root, text=True
+        ).strip()
+        dirty = bool(
+            subprocess.check_output(
+                ["git", "status", "--porcelain", "--untracked-files=no"],
+                cwd=root,
+                text=True,
+            ).strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+def _source_name(scenario: dict, grants: int, seed: int) -> str:
+    if scenario.get("nih_source") == "exporter":
+        return f"NIH exporter bench-{grants}-{seed}"
+    if scenario["agency"] == "NIH":
+        # Ingester takes the year from the second word
+        return f"NIH {DEFAULT_YEAR} bench-{grants}-{seed}"
+    return f"NSF bench-{grants}-{seed}"
+
+
+def _clear_source(source_name: str):
+    """Empties a bench data source so replace runs always start the same."""
+    from grant_search.db.database import engine, Session
+    from grant_search.db.models import DataSource
+    from grant_search.ingest.writer import delete_grants, load_existing
+
+    with Session() as session:
+        data_source = (
+            session.query(DataSource).filter(DataSource.name == source_name).first()
+        )
+        if data_source is None:
+            return
+        data_source.checkpoint = None
+        session.commit()
+        data_source_id = data_source.id
+    with engine.begin() as connection:
+        existing = load_existing(connection, data_source_id)
+        delete_grants(connection, [grant_id for grant_id, _ in existing.values()])
+
+
+def run_child(options: dict) -> dict:
+    """Runs one ingest in this process and returns its measurements."""
+    from grant_search.ingest import ingest
+
+    ingest.SendToAI = StubAI
+    if options["mode"] == "replace":
+        _clear_source(options["source_name"])
+
+    ingester = ingest.Ingester(
+        options["source_name"],
+        options.get("source"),
+        options["agency"],
+        stream=options.get("stream", False),
+        batch_size=options["batch_size"],
+        commit_every=options["commit_every"],
+        workers=options["workers"],
+        mode=options["mode"],
+        requests_per_second=options["requests_per_second"],
+        quiet=not options["verbose"],
+        api_url=options.get("api_url") or ingest.API_URL,
+        nih_source=options.get("nih_source", "api"),
+        abstracts_source=options.get("abstracts_source"),
+    )
+    started = time.perf_counter()
+    ingester.ingest()
+    seconds = time.perf_counter() - started
+
+    writer = ingester.writer
+    grants = writer.written + writer.updated + writer.skipped
+    return {
+        "seconds": round(seconds, 3),
+        "grants_ingested": grants,
+        "grants_per_sec": round(grants / seconds, 1) if seconds else None,
+        "peak_rss_mb": round(_peak_rss_mb(resource.RUSAGE_SELF), 1),
+        "children_peak_rss_mb": round(_peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        "ai_stub_grants": StubAI.grants,
+        "stages": ingester.stats.summary()["stages"],
+    }
+
+
+def _run_scenario(name: str, options: dict) -> dict:
+    with tempfile.NamedTemporaryFile("rt", suffix=".json") as output:
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "grant_search.bench.ingest_bench",
+                "--child",
+                json.dumps(options),
+                "--child_output",
+                output.name,
+            ],
+            check=True,
+        )
+        return json.load(output)
+
+
+def _previous(results_path: str, record: dict) -> Optional[dict]:
+    """Latest earlier result for the same scenario and scale at another commit."""
+    if not os.path.exists(results_path):
+        return None
+    previous = None
+    with open(results_path, "rt") as f:
+        for line in f:
+            other = json.loads(line)
+            if (
+                other["scenario"] == record["scenario"]
+                and other["grants"] == record["grants"]
+                and other["seed"] == record["seed"]
+                and other["options"] == record["options"]
+                and other["commit"] != record["commit"]
+            ):
+                previous = other
+    return previous
+
+
+def _print_result(record: dict, previous: Optional[dict]):
+    line = (
+        f"{record['scenario']:>13}: {record['grants_ingested']} grants in "
+        f"{record['seconds']:.1f}s, {record['grants_per_sec']:,.1f} grants/sec, "
+        f"peak RSS {record['peak_rss_mb']:.0f}MB"
+    )
+    if record["children_peak_rss_mb"]:
+        line += f" (workers {record['children_peak_rss_mb']:.0f}MB)"
+    if previous and previous["grants_per_sec"] and record["grants_per_sec"]:
+        change = record["grants_per_sec"] / previous["grants_per_sec"] - 1
+        line += f", {change:+.1%} vs {previous['commit'][:8]}"
+    print(line)
+
+
+if __name__ == "__main__":
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end ingest")
+    parser.add_argument("--grants", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--mode", choices=["replace", "delta", "swap"], default="replace")
+    parser.add_argument("--batch_size", type=int, default=500)
+    parser.add_argument("--commit_every", type=int, default=1)
+    parser.add_argument(
+        "--nih_latency",
+        type=float,
+        default=0.0,
+        help="Seconds added to every stub RePORTER response",
+    )
+    parser.add_argument(
+        "--corpus_dir",
+        default=os.path.join(tempfile.gettempdir(), "grant_search_bench"),
+        help="Where generated corpora are kept between runs",
+    )
+    parser.add_argument("--results", default="bench_results.jsonl")
+    parser.add_argument("--label", help="Free-form note stored with the results")
+    parser.add_argument(
+        "--verbose", action="store_true", help="Keep the per-grant log lines"
+    )
+    parser.add_argument(
+        "--allow_remote",
+        action="store_true",
+        help="Run even if DATABASE_URL is not a local database",
+    )
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--child_output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        with open(args.child_output, "wt") as f:
+            json.dump(run_child(json.loads(args.child)), f)
+        sys.exit(0)
+
+    from sqlalchemy.engine import make_url
+
+    from grant_search.bench.corpus import (
+        NIHCorpus,
+        write_exporter_csvs,
+        write_nsf_zip,
+    )
+    from grant_search.bench.reporter_stub import ReporterStub
+
+    host = make_url(
+        os.environ["DATABASE_URL"].replace("postgres://", "postgresql://")
+    ).host
+    if host not in LOCAL_HOSTS and not args.allow_remote:
+        raise Exception(
+            f"DATABASE_URL points at {host}; the benchmark writes and deletes "
+            "grants, use a local database or pass --allow_remote"
+        )
+
+    commit, dirty = _git_commit()
+    os.makedirs(args.corpus_dir, exist_ok=True)
+    nsf_zip = os.path.join(args.corpus_dir, f"nsf-{args.grants}-{args.seed}.zip")
+    if any(SCENARIOS[name]["agency"] == "NSF" for name in args.scenarios):
+        if not os.path.exists(nsf_zip):
+            print(f"Generating {args.grants} NSF awards in {nsf_zip}")
+            write_nsf_zip(nsf_zip + ".tmp", args.grants, args.seed, DEFAULT_YEAR)
+            os.replace(nsf_zip + ".tmp", nsf_zip)
+    exporter_csvs = [
+        os.path.join(args.corpus_dir, f"exporter-{kind}-{args.grants}-{args.seed}.csv")
+        for kind in ["projects", "abstracts"]
+    ]
+    if "nih-exporter" in args.scenarios and not os.path.exists(exporter_csvs[1]):
+        print(f"Generating {args.grants} ExPORTER projects in {args.corpus_dir}")
+        write_exporter_csvs(
+            *exporter_csvs, NIHCorpus(args.grants, args.seed, DEFAULT_YEAR)
+        )
+
+    stub = None
+    if "nih" in args.scenarios:
+        stub = ReporterStub(
+            NIHCorpus(args.grants, args.seed, DEFAULT_YEAR), args.nih_latency
+        ).start()
+
+    try:
+        for name in args.scenarios:
+            scenario = SCENARIOS[name]
+            options = {
+                **scenario,
+                "source_name": _source_name(scenario, args.grants, args.seed),
+                "mode": args.mode,
+                "batch_size": args.batch_size,
+                "commit_every": args.commit_every,
+                "verbose": args.verbose,
+                # The stub has no rate limit to respect
+                "requests_per_second": 1000.0,
+            }
+            if name == "nih":
+                options["api_url"] = stub.url
+            elif name == "nih-exporter":
+                options["source"], options["abstracts_source"] = exporter_csvs
+            else:
+                options["source"] = nsf_zip
+
+            for _ in range(args.repeat):
+                measured = _run_scenario(name, options)
+                record = {
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                    "commit": commit,
+                    "dirty": dirty,
+                    "label": args.label,
+                    "python": platform.python_version(),
+                    "scenario": name,
+                    "grants": args.grants,
+                    "seed": args.seed,
+                    "options": {
+                        key: value
+                        for key, value in options.items()
+                        if key
+                        not in ["source", "abstracts_source", "api_url", "source_name"]
+                    },
+                    "nih_latency": args.nih_latency if stub else None,
+                    **measured,
+                }
+                _print_result(record, _previous(args.results, record))
+                with open(args.results, "at") as f:
+                    f.write(json.dumps(record) + "\n")
+    finally:
+        if stub:
+            stub.stop()
@@ -0,0 +1,66 @@
+import argparse
+import io
+import time
+
+from grant_search.bench.corpus import nsf_awards
+from grant_search.ingest.nsf import (
+    extract_nsf_award,
+    extract_nsf_award_stream,
+    parse_nsf_award,
+    xml_string_to_dict,
+)
+
+
+def _dict_parse(content: bytes):
+    return parse_nsf_award(xml_string_to_dict(content), b"")
+
+
+def _extract(content: bytes):
+    return extract_nsf_award(content)
+
+
+def _extract_stream(content: bytes):
+    return extract_nsf_award_stream(io.BytesIO(content))._replace(raw_text=b"")
+
+
+def _time(parse, awards: list[bytes], repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for content in awards:
+            parse(content)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare NSF award parsing: xml_string_to_dict vs extractor"
+    )
+    parser.add_argument("--awards", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    awards = nsf_awards(args.awards, seed=args.seed)
+    total_bytes = sum(len(content) for content in awards)
+
+    # Both paths must agree before their timings mean anything
+    for content in awards:
+        expected = _dict_parse(content)
+        for actual in [_extract(content), _extract_stream(content)]:
+            if expected != actual:
+                raise Exception(f"Parsers disagree:\n{expected}\n{actual}")
+    print(f"{len(awards)} awards ({total_bytes / 1e6:.1f}MB), outputs identical")
+
+    baseline = _time(_dict_parse, awards, args.repeat)
+    for name, elapsed in [
+        ("xml_string_to_dict", baseline),
+        ("extract", _time(_extract, awards, args.repeat)),
+        ("extract_stream", _time(_extract_stream, awards, args.repeat)),
+    ]:
+        print(
+            f"{name:>18}: {elapsed:.3f}s, {len(awards) / elapsed:,.0f} awards/sec, "
+            f"{baseline / elapsed:.2f}x"
+        )
@@ -0,0 +1,112 @@
+"""
+A local stand-in for the RePORTER search API, serving an NIHCorpus.
+
+Answers the same POST /v2/projects/search requests NIHFetcher makes,
+including the MAX_RESULTS offset cap, so windowed and paged fetching can be
+benchmarked without touching (or being rate limited by) the real service.
+"""
+
+import argparse
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import threading
+import time
+
+from grant_search.bench.corpus import NIHCorpus
+from grant_search.ingest.nih import MAX_RESULTS
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PATH = "/v2/projects/search"
+
+
+class ReporterStub:
+    """
+    Serves `corpus` on a background thread. `latency` seconds are added to
+    every response to approximate the real API's round trip.
+    """
+
+    def __init__(self, corpus: NIHCorpus, latency: float = 0.0, port: int = 0):
+        self.corpus = corpus
+        self.latency = latency
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                request = json.loads(self.rfile.read(length))
+                status, content = stub.search(request)
+                body = json.dumps(content).encode()
+                if stub.latency:
+                    time.sleep(stub.latency)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}{SEARCH_PATH}"
+
+    def search(self, request: dict) -> tuple[int, dict]:
+        self.requests += 1
+        dates = request["criteria"]["project_start_date"]
+        from_date = datetime.strptime(dates["from_date"], "%Y-%m-%d")
+        to_date = datetime.strptime(dates["to_date"], "%Y-%m-%d")
+        offset = request.get("offset", 0)
+        limit = request.get("limit", 50)
+        if offset + limit > MAX_RESULTS:
+            return 400, {"error": f"offset + limit must be at most {MAX_RESULTS}"}
+        return 200, {
+            "meta": {
+                "search_id": request.get("searchId") or f"stub-{self.requests}",
+                "total": self.corpus.total(from_date, to_date),
+                "offset": offset,
+                "limit": limit,
+            },
+            "results": self.corpus.search(from_date, to_date, offset, limit),
+        }
+
+    def start(self) -> "ReporterStub":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "ReporterStub":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a synthetic RePORTER API")
+    parser.add_argument("--grants", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--year", type=int, default=2024)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    stub = ReporterStub(
+        NIHCorpus(args.grants, args.seed, args.year), args.latency, args.port
+    )
+    print(f"Serving {args.grants} projects at {stub.url}")
+    stub.server.serve_forever()
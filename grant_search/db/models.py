@@ -16,19 +16,21 @@ from sqlalchemy import (
     Integer,
     String,
     Float,
+    JSON,
     desc,
     Table,
     event,
 )
 
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, mapped_column, Mapped, deferred
+from sqlalchemy.orm import relationship, mapped_column, Mapped
 from sqlalchemy.orm import declarative_mixin
 from datetime import datetime
 
 from pgvector.sqlalchemy import Vector
 
 import grant_search.db.database as database
+from grant_search.db import raw_store
 
 Base = declarative_base()
 
@@ -62,6 +64,9 @@ class DataSource(Base):
     name = Column(String, nullable=False)
     timestamp = Column(DateTime)
     origin = Column(String)
+    # Progress of an unfinished ingest, e.g. {"completed": [[from, to], ...]}
+    # for NIH windows. Cleared when the ingest finishes.
+    checkpoint = Column(JSON)
 
     # Add foreign key to Agency
     agency_id = Column(Integer, ForeignKey("agencies.id"))
@@ -80,6 +85,9 @@ class Grantee(Base):
     # Many-to-many relationship with grants
     grants = relationship("Grant", secondary="grant_grantee", back_populates="grantees")
 
+    # Ingest resolves grantees by name with INSERT ... ON CONFLICT
+    __table_args__ = (Index("idx_grantee_name", "name", unique=True),)
+
 
 # Association table for the many-to-many relationship between Grant and Grantee
 grant_grantee = Table(
@@ -108,7 +116,19 @@ class Grant(Base):
     grantees = relationship(
         "Grantee", secondary="grant_grantee", back_populates="grants"
     )
-    raw_text = deferred(Column(LargeBinary))
+    # sha256 of raw_text, used by delta ingest to skip unchanged awards
+    content_hash = Column(String(64))
+    # Compact text sent to the LLM, see grant_search.ingest.llm_view
+    llm_view = Column(String)
+
+    # The source document lives compressed in its own table and is only
+    # loaded when raw_text is read
+    raw_document = relationship(
+        "GrantRawDocument",
+        back_populates="grant",
+        cascade="all, delete-orphan",
+        uselist=False,
+    )
 
     # Update the relationship to include cascade delete
     derived_data = relationship(
@@ -122,6 +142,14 @@ class Grant(Base):
         "GrantEmbedding", back_populates="grant", cascade="all, delete-orphan"
     )
 
+    __table_args__ = (
+        Index("idx_grant_data_source_award", "data_source_id", "award_id"),
+    )
+
+    @property
+    def raw_text(self) -> Optional[bytes]:
+        return self.raw_document.content if self.raw_document else None
+
     def get_award_url(self):
         if self.data_source.agency.name == "NSF":
             return f"https://www.nsf.gov/awardsearch/showAward?AWD_ID={self.award_id}&HistoricalAwards=false"
@@ -131,6 +159,49 @@ class Grant(Base):
             return None
 
 
+class GrantRawDocument(Base):
+    __tablename__ = "grant_raw_documents"
+    grant_id = Column(
+        Integer, ForeignKey("grants.id", ondelete="CASCADE"), primary_key=True
+    )
+    # Compression format tag, see grant_search.db.raw_store
+    encoding = Column(String, nullable=False)
+    # Uncompressed size in bytes
+    raw_size = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+
+    grant = relationship("Grant", back_populates="raw_document")
+
+    @property
+    def content(self) -> bytes:
+        return raw_store.decompress(self.encoding, self.data)
+
+
+class GrantStaging(Base):
+    """
+    Grants loaded by a swap-mode ingest, waiting to replace their data
+    source's rows in one transaction. Grantees are already resolved and the
+    raw document already compressed, so the swap is pure SQL.
+    """
+
+    __tablename__ = "grant_staging"
+    data_source_id = Column(
+        Integer, ForeignKey("data_sources.id", ondelete="CASCADE"), primary_key=True
+    )
+    award_id = Column(String, primary_key=True)
+    start_date = Column(DateTime)
+    end_date = Column(DateTime)
+    amount = Column(Float)
+    title = Column(String)
+    description = Column(String)
+    content_hash = Column(String(64))
+    llm_view = Column(String)
+    grantee_ids = Column(ARRAY(Integer))
+    raw_encoding = Column(String, nullable=False)
+    raw_size = Column(Integer, nullable=False)
+    raw_data = Column(LargeBinary, nullable=False)
+
+
 class DEIStatus(enum.Enum):
     NONE = "none"
     MENTIONS_DEI = "mentions_dei"
@@ -154,6 +225,91 @@ class GrantDerivedData(Base):
 
     grant = relationship("Grant", back_populates="derived_data")
 
+    __table_args__ = (
+        UniqueConstraint("grant_id", name="unique_grant_derived_data_grant_id"),
+    )
+
+
+class AnalysisBatchJob(Base, TimestampMixin):
+    """
+    A GrantAnalysis job submitted to the OpenAI Batch API, tracked until its
+    results are applied. See grant_search.ingest.batch_analysis.
+    """
+
+    __tablename__ = "analysis_batch_jobs"
+    id = Column(Integer, primary_key=True)
+    # Both unset while the job is "submitting", which is recorded before the
+    # upload so a batch is never created without a row to track it
+    batch_id = Column(String, unique=True)
+    input_file_id = Column(String)
+    output_file_id = Column(String)
+    error_file_id = Column(String)
+    # "submitting", then the OpenAI batch status: validating, in_progress,
+    # finalizing, completed, failed, expired, cancelling or cancelled
+    status = Column(String, nullable=False)
+    model = Column(String, nullable=False)
+    grant_ids = Column(ARRAY(Integer), nullable=False)
+    request_count = Column(Integer, nullable=False)
+    applied_count = Column(Integer)
+    failed_count = Column(Integer)
+    applied_at = Column(DateTime)
+    # GrantAnalysisCache keys of the requests, in grant_ids order
+    cache_keys = Column(ARRAY(String))
+
+    __table_args__ = (Index("idx_analysis_batch_jobs_status", "status"),)
+
+
+class GrantAnalysisCache(Base):
+    """
+    GrantAnalysis results keyed by a hash of everything that decides them: the
+    LLM input text, system prompt, model and response schema. See
+    grant_search.ingest.analysis_cache.
+    """
+
+    __tablename__ = "grant_analysis_cache"
+    key = Column(String(64), primary_key=True)
+    model = Column(String, nullable=False)
+    result = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class LLMCallSummary(Base):
+    """
+    LLM call telemetry of one run or search query, by call site and model.
+    See grant_search.ai.telemetry.
+    """
+
+    __tablename__ = "llm_call_summaries"
+    id = Column(Integer, primary_key=True)
+    run_id = Column(String(32), nullable=False)
+    run_name = Column(String, nullable=False)
+    query_id = Column(
+        Integer, ForeignKey("grant_search_queries.id", ondelete="SET NULL")
+    )
+    call_site = Column(String, nullable=False)
+    model = Column(String, nullable=False)
+    calls = Column(Integer, nullable=False)
+    errors = Column(Integer, nullable=False)
+    retries = Column(Integer, nullable=False)
+    rate_limited = Column(Integer, nullable=False)
+    prompt_tokens = Column(Integer, nullable=False)
+    completion_tokens = Column(Integer, nullable=False)
+    cached_tokens = Column(Integer, nullable=False)
+    # None for models without a price in telemetry.PRICES
+    cost_usd = Column(Float)
+    latency_mean = Column(Float, nullable=False)
+    latency_p50 = Column(Float, nullable=False)
+    latency_p95 = Column(Float, nullable=False)
+    latency_max = Column(Float, nullable=False)
+    # Length of the run so far when it was saved
+    seconds = Column(Float, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("idx_llm_call_summaries_created_at", "created_at"),
+        Index("idx_llm_call_summaries_query_id", "query_id"),
+    )
+
 
 class GrantEmbedding(Base):
     __tablename__ = "grant_embedding"
@@ -0,0 +1,102 @@
+import gzip
+import logging
+
+from sqlalchemy import func, select
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Format tags stored next to each payload in grant_raw_documents.encoding
+ENCODING_ZSTD = "zstd"
+ENCODING_GZIP = "gzip"
+
+ZSTD_LEVEL = 9
+GZIP_LEVEL = 6
+
+
+def compress(data: bytes) -> tuple[str, bytes]:
+    """Compresses a raw document, returning (encoding tag, payload)."""
+    if zstandard is not None:
+        return ENCODING_ZSTD, zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(
+            data
+        )
+    return ENCODING_GZIP, gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def decompress(encoding: str, payload: bytes) -> bytes:
+    if encoding == ENCODING_ZSTD:
+        if zstandard is None:
+            raise Exception("zstandard is required to read zstd raw documents")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    elif encoding == ENCODING_GZIP:
+        return gzip.decompress(payload)
+    raise Exception(f"Unknown raw document encoding: {encoding}")
+
+
+def document_row(grant_id: int, data: bytes) -> dict:
+    """Builds a grant_raw_documents row for a bulk insert."""
+    encoding, payload = compress(data)
+    return {
+        "grant_id": grant_id,
+        "encoding": encoding,
+        "raw_size": len(data),
+        "data": payload,
+    }
+
+
+def report(session) -> list[dict]:
+    """Per-encoding document counts and bytes before/after compression."""
+    from grant_search.db.models import GrantRawDocument
+
+    rows = session.execute(
+        select(
+            GrantRawDocument.encoding,
+            func.count(),
+            func.sum(GrantRawDocument.raw_size),
+            func.sum(func.octet_length(GrantRawDocument.data)),
+        ).group_by(GrantRawDocument.encoding)
+    )
+    return [
+        {
+            "encoding": encoding,
+            "documents": count,
+            "raw_bytes": int(raw_bytes or 0),
+            "stored_bytes": int(stored_bytes or 0),
+        }
+        for encoding, count, raw_bytes, stored_bytes in rows
+    ]
+
+
+def print_report(rows: list[dict]):
+    total_raw = sum(row["raw_bytes"] for row in rows)
+    total_stored = sum(row["stored_bytes"] for row in rows)
+    for row in rows + [
+        {
+            "encoding": "total",
+            "documents": sum(row["documents"] for row in rows),
+            "raw_bytes": total_raw,
+            "stored_bytes": total_stored,
+        }
+    ]:
+        ratio = row["raw_bytes"] / row["stored_bytes"] if row["stored_bytes"] else 0
+        print(
+            f"{row['encoding']:>6}: {row['documents']} documents, "
+            f"{row['raw_bytes'] / 1e6:.1f}MB -> {row['stored_bytes'] / 1e6:.1f}MB, "
+            f"saved {(row['raw_bytes'] - row['stored_bytes']) / 1e6:.1f}MB "
+            f"({ratio:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    from grant_search.db.database import get_session
+
+    with get_session() as session:
+        print_report(report(session))
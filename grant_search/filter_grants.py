@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import List, Optional
 from sqlalchemy import and_
-from sqlalchemy.orm import Query, undefer
+from sqlalchemy.orm import Query, selectinload
 
 from grant_search.db.models import Agency, Grant, DataSource
 
@@ -24,7 +24,7 @@ def filter_grants_query(
     Returns:
         Filtered SQLAlchemy query
     """
-    query = session.query(Grant).options(undefer(Grant.raw_text))
+    query = session.query(Grant).options(selectinload(Grant.raw_document))
 
     if start_date_before:
         query = query.filter(Grant.start_date <= start_date_before)
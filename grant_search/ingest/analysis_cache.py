@@ -0,0 +1,137 @@
+"""
+Content-addressed cache of GrantAnalysis results.
+
+A result is stored under the sha256 of the exact LLM input text, the system
+prompt, the model and the response JSON schema, so a grant whose text
+hasn't changed is never sent twice, while changing the prompt, model or
+schema naturally misses every old entry. Answers from packed requests (see
+grant_search.ingest.packing) are keyed by the packed prompt and schema.
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import threading
+from typing import Iterable, Optional
+
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from grant_search.db import database
+from grant_search.db.models import GrantAnalysisCache
+from grant_search.ingest.send_to_ai import MODEL, SYSTEM_PROMPT, GrantAnalysis
+
+logger = logging.getLogger(__name__)
+
+# Keys per lookup query
+LOOKUP_BATCH_SIZE = 500
+
+
+@functools.lru_cache(maxsize=None)
+def _fingerprint(prompt: str, response_model: type[BaseModel]) -> bytes:
+    schema = json.dumps(response_model.model_json_schema(), sort_keys=True)
+    return "\0".join([prompt, MODEL, schema]).encode()
+
+
+def analysis_key(
+    text: str,
+    prompt: str = SYSTEM_PROMPT,
+    response_model: type[BaseModel] = GrantAnalysis,
+) -> str:
+    """
+    The cache key of an analysis of `text` with the current model, made with
+    `prompt` and `response_model` (a single-grant request by default).
+    """
+    digest = hashlib.sha256(_fingerprint(prompt, response_model))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """Looks up and stores GrantAnalysis results, counting hits and misses."""
+
+    hits: int
+    misses: int
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, GrantAnalysis]:
+        keys = list(dict.fromkeys(keys))
+        found = self._lookup(keys)
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def _lookup(self, keys: Iterable[str]) -> dict[str, GrantAnalysis]:
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with database.engine.connect() as connection:
+            for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+                rows = connection.execute(
+                    select(GrantAnalysisCache.key, GrantAnalysisCache.result).where(
+                        GrantAnalysisCache.key.in_(
+                            keys[start : start + LOOKUP_BATCH_SIZE]
+                        )
+                    )
+                )
+                for key, result in rows:
+                    found[key] = GrantAnalysis.model_validate(result)
+        return found
+
+    def get_any(self, keys: dict[int, tuple[str, ...]]) -> dict[int, GrantAnalysis]:
+        """
+        For items with several acceptable keys, the analysis under the first
+        key found, counting one hit or miss per item.
+        """
+        found = self._lookup(key for item_keys in keys.values() for key in item_keys)
+        results = {}
+        for item, item_keys in keys.items():
+            for key in item_keys:
+                if key in found:
+                    results[item] = found[key]
+                    break
+        with self._lock:
+            self.hits += len(results)
+            self.misses += len(keys) - len(results)
+        return results
+
+    def get(self, key: str) -> Optional[GrantAnalysis]:
+        return self.get_many([key]).get(key)
+
+    def put_many(self, results: Iterable[tuple[str, GrantAnalysis]]):
+        rows = {
+            key: {
+                "key": key,
+                "model": MODEL,
+                "result": analysis.model_dump(mode="json"),
+            }
+            for key, analysis in results
+        }
+        if not rows:
+            return
+        with database.engine.begin() as connection:
+            connection.execute(
+                insert(GrantAnalysisCache).on_conflict_do_nothing(),
+                list(rows.values()),
+            )
+
+    def put(self, key: str, analysis: GrantAnalysis):
+        self.put_many([(key, analysis)])
+
+    @property
+    def hit_rate(self) -> Optional[float]:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+    def summary(self) -> str:
+        rate = self.hit_rate
+        return f"analysis cache: {self.hits} hits, {self.misses} misses" + (
+            f" ({rate:.0%} hit rate)" if rate is not None else ""
+        )
@@ -0,0 +1,226 @@
+import asyncio
+from itertools import islice
+import logging
+import os
+import time
+from typing import Iterable, Optional
+
+from grant_search.ai.common import format_for_llm, get_async_ai_client
+from grant_search.ai.rate_limit import get_rate_limiter
+from grant_search.ingest.analysis_cache import (
+    LOOKUP_BATCH_SIZE,
+    AnalysisCache,
+    analysis_key,
+)
+from grant_search.ingest.derived_writer import (
+    WRITE_BATCH_SIZE,
+    DerivedDataWriter,
+    Writer,
+    upsert_derived_data,
+)
+from grant_search.ingest.packing import (
+    PACK_TOKEN_BUDGET,
+    PACKED_SYSTEM_PROMPT,
+    GrantPacker,
+    PackedGrantAnalyses,
+    packed_max_tokens,
+    packed_text,
+    unpack,
+)
+from grant_search.ingest.send_to_ai import MODEL, SYSTEM_PROMPT, GrantAnalysis
+
+logger = logging.getLogger(__name__)
+
+# In-flight completions; override with AI_CONCURRENCY
+DEFAULT_CONCURRENCY = int(os.environ.get("AI_CONCURRENCY", "64"))
+
+
+class AsyncAnalysisEngine:
+    """
+    Runs GrantAnalysis completions on an asyncio event loop.
+
+    Up to `concurrency` requests are in flight at once. Completions are
+    handled in the order they finish, not the order they were sent, and a
+    DerivedDataWriter thread upserts them `write_batch_size` at a time, so
+    the database never holds up the requests.
+
+    With a `cache`, grants are looked up LOOKUP_BATCH_SIZE at a time first;
+    hits go straight to the writer and new results are added to the cache.
+
+    With `pack_size` above one, each request carries a pack of grants (see
+    grant_search.ingest.packing) and grants missing from its answer are
+    retried one at a time.
+    """
+
+    concurrency: int
+    write_batch_size: int
+    pack_size: int
+    analyzed: int
+    failed: int
+    requests: int
+    retried: int
+
+    def __init__(
+        self,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        write_batch_size: int = WRITE_BATCH_SIZE,
+        writer: Writer = upsert_derived_data,
+        client=None,
+        cache: Optional[AnalysisCache] = None,
+        pack_size: int = 1,
+        pack_token_budget: int = PACK_TOKEN_BUDGET,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.write_batch_size = max(1, write_batch_size)
+        self.writer = writer
+        self.client = client
+        self.cache = cache
+        self.pack_size = max(1, pack_size)
+        self.pack_token_budget = pack_token_budget
+        self.analyzed = 0
+        self.failed = 0
+        self.requests = 0
+        self.retried = 0
+
+    def run(self, grants: Iterable[tuple[int, str]]):
+        """Analyzes (grant id, text) pairs and saves the results."""
+        asyncio.run(self.process(grants))
+
+    async def process(self, grants: Iterable[tuple[int, str]]):
+        client = self.client or get_async_ai_client(self.concurrency)
+        writer = DerivedDataWriter(
+            self.writer, cache=self.cache, batch_size=self.write_batch_size
+        )
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending: set[asyncio.Task] = set()
+        started = time.monotonic()
+
+        packer = GrantPacker(self.pack_size, self.pack_token_budget)
+
+        async def analyze(pack: list[tuple[int, str]]):
+            missing = []
+            try:
+                if len(pack) == 1:
+                    grant_id, text = pack[0]
+                    found = {grant_id: await self.analyze(client, grant_id, text)}
+                else:
+                    found = await self.analyze_pack(client, pack)
+                    missing = [item for item in pack if item[0] not in found]
+                    self.retried += len(missing)
+                for grant_id, text in pack:
+                    if found.get(grant_id) is not None:
+                        writer.put(
+                            grant_id,
+                            found[grant_id],
+                            self._cache_key(text, packed=len(pack) > 1),
+                        )
+            finally:
+                semaphore.release()
+            # Each retry takes a slot of its own, after this pack gave its up
+            for item in missing:
+                await start([item])
+
+        async def start(pack: list[tuple[int, str]]):
+            # Bounds the in-flight tasks, not just the requests
+            await semaphore.acquire()
+            task = asyncio.create_task(analyze(pack))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        try:
+            grants = iter(grants)
+            # Off the event loop, since reading grants may wait on the database
+            while chunk := await asyncio.to_thread(
+                lambda: list(islice(grants, LOOKUP_BATCH_SIZE))
+            ):
+                cached = {}
+                if self.cache is not None:
+                    cached = await asyncio.to_thread(self._lookup, chunk)
+                for grant_id, text in chunk:
+                    if grant_id in cached:
+                        # Already in the cache, so saved without a key
+                        writer.put(grant_id, cached[grant_id])
+                        continue
+                    for pack in packer.add((grant_id, text), text):
+                        await start(pack)
+            if pack := packer.flush():
+                await start(pack)
+            # Tasks may start retries of their own while these are awaited
+            while pending:
+                await asyncio.gather(*pending)
+        finally:
+            await asyncio.to_thread(writer.close)
+            if self.client is None:
+                # Its connection pool would otherwise outlive the event loop
+                await client.client.close()
+        self.analyzed += writer.written
+        self.failed += writer.failed
+
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Analyzed {self.analyzed} grants in {elapsed:.1f}s "
+            f"({self.analyzed / elapsed if elapsed else 0:.1f} grants/sec), "
+            f"{self.failed} failed, {self.requests} requests"
+            + (f", {self.retried} retried alone" if self.pack_size > 1 else "")
+            + (f"; {self.cache.summary()}" if self.cache is not None else "")
+        )
+
+    async def analyze(
+        self, client, grant_id: int, text: str
+    ) -> Optional[GrantAnalysis]:
+        self.requests += 1
+        try:
+            return await get_rate_limiter().create_async(
+                client,
+                site="analyze_grant",
+                model=MODEL,
+                messages=format_for_llm(SYSTEM_PROMPT, text),
+                response_model=GrantAnalysis,
+                max_tokens=1024,
+            )
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Error processing grant {grant_id}: {e}")
+            return None
+
+    async def analyze_pack(
+        self, client, grants: list[tuple[int, str]]
+    ) -> dict[int, GrantAnalysis]:
+        """
+        The analyses a packed request returns, by grant id. Grants it misses
+        are left out, and are left to the caller to retry alone.
+        """
+        self.requests += 1
+        try:
+            result = await get_rate_limiter().create_async(
+                client,
+                site="analyze_pack",
+                model=MODEL,
+                messages=format_for_llm(PACKED_SYSTEM_PROMPT, packed_text(grants)),
+                response_model=PackedGrantAnalyses,
+                max_tokens=packed_max_tokens(len(grants)),
+            )
+            return unpack(result, [grant_id for grant_id, _ in grants])
+        except Exception as e:
+            logger.warning(f"Pack of {len(grants)} grants failed, retrying alone: {e}")
+            return {}
+
+    def _cache_key(self, text: str, packed: bool = False) -> Optional[str]:
+        """The key a new result is cached under, by the request that made it."""
+        if self.cache is None:
+            return None
+        if packed:
+            return analysis_key(text, PACKED_SYSTEM_PROMPT, PackedGrantAnalyses)
+        return analysis_key(text)
+
+    def _lookup(self, chunk: list[tuple[int, str]]) -> dict[int, GrantAnalysis]:
+        """
+        Cached analyses of a chunk by grant id. Packed runs also take answers
+        cached from packs, while single-grant runs only take single-grant ones.
+        """
+        keys = {}
+        for grant_id, text in chunk:
+            keys[grant_id] = (analysis_key(text),)
+            if self.pack_size > 1:
+                keys[grant_id] += (self._cache_key(text, packed=True),)
+        return self.cache.get_any(keys)
@@ -0,0 +1,378 @@
+"""
+Bulk GrantAnalysis through the OpenAI Batch API.
+
+Grants are written as chat completion requests to JSONL, `chunk_size` per
+file, and each file is submitted as a batch job. Every job is recorded in
+analysis_batch_jobs before its file is uploaded, so an interrupted run picks
+up where it left off and never leaves a batch it doesn't know about: `submit`
+skips grants already in an unapplied job, `poll` refreshes job statuses and
+`apply` bulk-writes the results of finished jobs into grant_derived_data.
+
+Grants whose analysis is already in the GrantAnalysisCache are written
+straight from it instead of being submitted, and applied results are added
+to the cache.
+
+    python -m grant_search.ingest.batch_analysis run --wait
+    python -m grant_search.ingest.batch_analysis poll
+    python -m grant_search.ingest.batch_analysis apply
+"""
+
+import argparse
+from datetime import datetime
+import json
+import logging
+import os
+import tempfile
+import time
+from itertools import islice
+from typing import Iterator, Optional
+
+from dotenv import load_dotenv
+from instructor import openai_schema
+from sqlalchemy import select
+
+logger = logging.getLogger(__name__)
+
+# The Batch API accepts up to 50,000 requests and 200MB per file
+DEFAULT_CHUNK_SIZE = 10000
+# Grants read per query while writing request files
+PAGE_SIZE = 1000
+# Results written per transaction when applying
+APPLY_BATCH_SIZE = 500
+POLL_INTERVAL = 60.0
+
+ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+TERMINAL_STATUSES = ["completed", "failed", "expired", "cancelled"]
+# Expired and cancelled batches still have an output file with the requests
+# they finished
+APPLY_STATUSES = ["completed", "expired", "cancelled"]
+# Status of a job recorded before its batch is created
+SUBMITTING = "submitting"
+
+CUSTOM_ID_PREFIX = "grant-"
+
+
+def analysis_request(grant_id: int, text: str) -> dict:
+    """One Batch API request line, the same call instructor makes for SendToAI."""
+    from grant_search.ai.common import format_for_llm
+    from grant_search.ingest.send_to_ai import (
+        MODEL,
+        SYSTEM_PROMPT,
+        GrantAnalysis,
+    )
+
+    function = openai_schema(GrantAnalysis).openai_schema
+    return {
+        "custom_id": f"{CUSTOM_ID_PREFIX}{grant_id}",
+        "method": "POST",
+        "url": ENDPOINT,
+        "body": {
+            "model": MODEL,
+            "messages": format_for_llm(SYSTEM_PROMPT, text),
+            "max_tokens": 1024,
+            "tools": [{"type": "function", "function": function}],
+            "tool_choice": {"type": "function", "function": {"name": function["name"]}},
+        },
+    }
+
+
+def parse_result(line: dict):
+    """Returns (grant id, GrantAnalysis) for one output line, or raises."""
+    from grant_search.ingest.send_to_ai import GrantAnalysis
+
+    grant_id = int(line["custom_id"][len(CUSTOM_ID_PREFIX) :])
+    if line.get("error"):
+        raise Exception(f"Grant {grant_id}: {line['error']}")
+    response = line["response"]
+    if response["status_code"] != 200:
+        raise Exception(f"Grant {grant_id}: HTTP {response['status_code']}")
+    message = response["body"]["choices"][0]["message"]
+    arguments = message["tool_calls"][0]["function"]["arguments"]
+    return grant_id, GrantAnalysis.model_validate_json(arguments)
+
+
+class BatchAnalysis:
+    """Submits, polls and applies GrantAnalysis batch jobs."""
+
+    def __init__(
+        self, chunk_size: int = DEFAULT_CHUNK_SIZE, client=None, use_cache=True
+    ):
+        from grant_search.ai.common import get_openai_client
+        from grant_search.ingest.analysis_cache import AnalysisCache
+
+        self.chunk_size = max(1, chunk_size)
+        self.client = client or get_openai_client()
+        self.cache = AnalysisCache() if use_cache else None
+
+    def _pending_grant_ids(self, session) -> set[int]:
+        from grant_search.db.models import AnalysisBatchJob
+
+        pending = set()
+        for (grant_ids,) in session.execute(
+            select(AnalysisBatchJob.grant_ids).where(
+                AnalysisBatchJob.applied_at.is_(None),
+                AnalysisBatchJob.status != "failed",
+            )
+        ):
+            pending.update(grant_ids)
+        return pending
+
+    def _grants(self, session, all_grants: bool) -> Iterator[tuple[int, str]]:
+        """Keyset-paginated (id, text) of the grants to analyze."""
+        from grant_search.ingest.candidates import select_candidates
+
+        skip = self._pending_grant_ids(session)
+        if skip:
+            logger.info(f"Skipping {len(skip)} grants already in unfinished jobs")
+        return select_candidates(
+            session, partial=not all_grants, skip=skip, page_size=PAGE_SIZE
+        )
+
+    def _uncached(
+        self, grants: Iterator[tuple[int, str]]
+    ) -> Iterator[tuple[int, str, str]]:
+        """Saves cached analyses, yielding (id, text, cache key) of the rest."""
+        from grant_search.ingest.analysis_cache import LOOKUP_BATCH_SIZE, analysis_key
+        from grant_search.ingest.derived_writer import upsert_derived_data
+
+        while chunk := list(islice(grants, LOOKUP_BATCH_SIZE)):
+            chunk = [(grant_id, text, analysis_key(text)) for grant_id, text in chunk]
+            cached = {}
+            if self.cache is not None:
+                cached = self.cache.get_many([key for _, _, key in chunk])
+            hits = [
+                (grant_id, cached[key]) for grant_id, _, key in chunk if key in cached
+            ]
+            if hits:
+                upsert_derived_data(hits)
+            for grant_id, text, key in chunk:
+                if key not in cached:
+                    yield grant_id, text, key
+
+    def submit(self, all_grants: bool = False, limit: Optional[int] = None) -> int:
+        """Writes and submits request files, returning the number of jobs."""
+        from grant_search.db.database import Session
+
+        jobs = 0
+        submitted = 0
+        with Session() as session:
+            grants = self._uncached(self._grants(session, all_grants))
+            while limit is None or submitted < limit:
+                size = self.chunk_size
+                if limit is not None:
+                    size = min(size, limit - submitted)
+                count = self._submit_chunk(session, grants, size)
+                if not count:
+                    break
+                jobs += 1
+                submitted += count
+        logger.info(
+            f"Submitted {submitted} grants in {jobs} batch jobs"
+            + (f", {self.cache.summary()}" if self.cache is not None else "")
+        )
+        return jobs
+
+    def _submit_chunk(self, session, grants: Iterator[tuple[int, str, str]], size: int):
+        from grant_search.db.models import AnalysisBatchJob
+        from grant_search.ingest.send_to_ai import MODEL
+
+        grant_ids = []
+        cache_keys = []
+        with tempfile.NamedTemporaryFile("w+b", suffix=".jsonl") as requests_file:
+            for grant_id, text, key in grants:
+                line = json.dumps(analysis_request(grant_id, text)) + "\n"
+                requests_file.write(line.encode())
+                grant_ids.append(grant_id)
+                cache_keys.append(key)
+                if len(grant_ids) >= size:
+                    break
+            if not grant_ids:
+                return 0
+            # Committed first, so the grants stay claimed even if we stop
+            # between creating the batch and recording its id
+            job = AnalysisBatchJob(
+                status=SUBMITTING,
+                model=MODEL,
+                grant_ids=grant_ids,
+                cache_keys=cache_keys,
+                request_count=len(grant_ids),
+            )
+            session.add(job)
+            session.commit()
+            try:
+                requests_file.flush()
+                requests_file.seek(0)
+                uploaded = self.client.files.create(
+                    file=(os.path.basename(requests_file.name), requests_file),
+                    purpose="batch",
+                )
+                job.input_file_id = uploaded.id
+                session.commit()
+                batch = self.client.batches.create(
+                    input_file_id=uploaded.id,
+                    endpoint=ENDPOINT,
+                    completion_window=COMPLETION_WINDOW,
+                    # Finds the batch of a job left submitting
+                    metadata={"analysis_batch_job_id": str(job.id)},
+                )
+            except Exception:
+                # Nothing to wait for, so the grants go in a later job
+                job.status = "failed"
+                session.commit()
+                raise
+        job.batch_id = batch.id
+        job.status = batch.status
+        session.commit()
+        logger.info(f"Submitted batch {batch.id} with {len(grant_ids)} grants")
+        return len(grant_ids)
+
+    def poll(self) -> int:
+        """Refreshes unfinished jobs, returning how many are still running."""
+        from grant_search.db.database import Session
+        from grant_search.db.models import AnalysisBatchJob
+
+        running = 0
+        with Session() as session:
+            jobs = (
+                session.query(AnalysisBatchJob)
+                .filter(AnalysisBatchJob.status.not_in(TERMINAL_STATUSES))
+                .all()
+            )
+            for job in jobs:
+                if job.batch_id is None:
+                    logger.warning(
+                        f"Job {job.id} has no batch yet; if its submit was "
+                        "interrupted, find the batch with metadata "
+                        f"analysis_batch_job_id={job.id} or mark the job failed"
+                    )
+                    continue
+                batch = self.client.batches.retrieve(job.batch_id)
+                job.status = batch.status
+                job.output_file_id = batch.output_file_id
+                job.error_file_id = batch.error_file_id
+                counts = batch.request_counts
+                logger.info(
+                    f"Batch {job.batch_id}: {batch.status}"
+                    + (
+                        f", {counts.completed}/{counts.total} done, {counts.failed} failed"
+                        if counts
+                        else ""
+                    )
+                )
+                if batch.status not in TERMINAL_STATUSES:
+                    running += 1
+            session.commit()
+        return running
+
+    def apply(self) -> int:
+        """Writes the results of finished, unapplied jobs. Returns grants saved."""
+        from grant_search.db.database import Session
+        from grant_search.db.models import AnalysisBatchJob
+
+        saved = 0
+        with Session() as session:
+            jobs = (
+                session.query(AnalysisBatchJob)
+                .filter(
+                    AnalysisBatchJob.status.in_(APPLY_STATUSES),
+                    AnalysisBatchJob.applied_at.is_(None),
+                )
+                .all()
+            )
+            for job in jobs:
+                applied, failed = 0, 0
+                batch = []
+                keys = dict(zip(job.grant_ids, job.cache_keys or []))
+                if job.output_file_id:
+                    content = self.client.files.content(job.output_file_id)
+                    for raw in content.iter_lines():
+                        if not raw.strip():
+                            continue
+                        try:
+                            batch.append(parse_result(json.loads(raw)))
+                        except Exception as e:
+                            failed += 1
+                            logger.error(f"Batch {job.batch_id}: {e}")
+                            continue
+                        if len(batch) >= APPLY_BATCH_SIZE:
+                            self._apply_results(batch, keys)
+                            applied += len(batch)
+                            batch = []
+                if batch:
+                    self._apply_results(batch, keys)
+                    applied += len(batch)
+                # Requests that errored outright are only in the error file
+                failed = job.request_count - applied
+                job.applied_count = applied
+                job.failed_count = failed
+                job.applied_at = datetime.utcnow()
+                session.commit()
+                saved += applied
+                logger.info(
+                    f"Applied batch {job.batch_id}: {applied} saved, {failed} failed"
+                )
+        return saved
+
+    def _apply_results(self, results: list, keys: dict[int, str]):
+        from grant_search.ingest.derived_writer import upsert_derived_data
+
+        upsert_derived_data(results)
+        if self.cache is not None:
+            self.cache.put_many(
+                (keys[grant_id], analysis)
+                for grant_id, analysis in results
+                if grant_id in keys
+            )
+
+    def run(
+        self,
+        all_grants: bool = False,
+        wait: bool = False,
+        limit=None,
+        poll_interval: float = POLL_INTERVAL,
+    ):
+        self.submit(all_grants=all_grants, limit=limit)
+        while self.poll() and wait:
+            self.apply()
+            time.sleep(poll_interval)
+        self.apply()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    parser = argparse.ArgumentParser(description="GrantAnalysis via the Batch API")
+    parser.add_argument("command", choices=["submit", "poll", "apply", "run"])
+    parser.add_argument(
+        "--all", action="store_true", help="Re-analyze grants that have a summary"
+    )
+    parser.add_argument("--chunk_size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--limit", type=int, help="Submit at most this many grants")
+    parser.add_argument(
+        "--wait", action="store_true", help="run: poll until every job finishes"
+    )
+    parser.add_argument("--poll_interval", type=float, default=POLL_INTERVAL)
+    parser.add_argument(
+        "--no_cache", action="store_true", help="Ignore cached analyses on submit"
+    )
+    args = parser.parse_args()
+
+    batch_analysis = BatchAnalysis(
+        chunk_size=args.chunk_size, use_cache=not args.no_cache
+    )
+    if args.command == "submit":
+        batch_analysis.submit(all_grants=args.all, limit=args.limit)
+    elif args.command == "poll":
+        batch_analysis.poll()
+    elif args.command == "apply":
+        batch_analysis.apply()
+    else:
+        batch_analysis.run(
+            all_grants=args.all,
+            wait=args.wait,
+            limit=args.limit,
+            poll_interval=args.poll_interval,
+        )
@@ -0,0 +1,173 @@
+"""
+Selects the grants an enrichment job should analyze.
+
+Candidates are read PAGE_SIZE at a time by keyset pagination on Grant.id,
+selecting only the id, the LLM view and the compressed raw document of
+grants without one, so no page costs more than the last and nothing but
+(id, text) pairs is kept. `stream_candidates` runs the selection on a thread
+of its own ahead of the consumer, through a queue of at most `prefetch`
+grants, so memory stays flat and the first requests go out as soon as the
+first page is read.
+"""
+
+import logging
+import queue
+import threading
+from typing import Container, Iterator, Optional
+
+from sqlalchemy import select
+
+from grant_search.db import raw_store
+from grant_search.db.database import Session
+from grant_search.db.models import Grant, GrantDerivedData, GrantRawDocument
+
+logger = logging.getLogger(__name__)
+
+# Grants per query
+PAGE_SIZE = 1000
+# Grants selected ahead of the consumer
+PREFETCH = 5000
+
+_DONE = object()
+
+
+def _text_columns(query):
+    # Only fetch raw documents where there is no view to send instead
+    return query.add_columns(
+        Grant.llm_view, GrantRawDocument.encoding, GrantRawDocument.data
+    ).outerjoin(
+        GrantRawDocument,
+        (GrantRawDocument.grant_id == Grant.id) & Grant.llm_view.is_(None),
+    )
+
+
+def _text(llm_view: Optional[str], encoding, data) -> Optional[str]:
+    if llm_view:
+        return llm_view
+    if data is not None:
+        return raw_store.decompress(encoding, data).decode("utf-8")
+    return None
+
+
+def _pages(
+    session,
+    query,
+    partial: bool,
+    data_source_id: Optional[int],
+    page_size: int,
+):
+    """Pages of rows of `query`, whose first column is Grant.id."""
+    if data_source_id is not None:
+        query = query.where(Grant.data_source_id == data_source_id)
+    if partial:
+        query = query.outerjoin(
+            GrantDerivedData, GrantDerivedData.grant_id == Grant.id
+        ).where(GrantDerivedData.summary.is_(None))
+    last_id = 0
+    while True:
+        rows = session.execute(
+            query.where(Grant.id > last_id).order_by(Grant.id).limit(page_size)
+        ).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def select_candidates(
+    session,
+    partial: bool = True,
+    data_source_id: Optional[int] = None,
+    skip: Container[int] = frozenset(),
+    page_size: int = PAGE_SIZE,
+) -> Iterator[tuple[int, str]]:
+    """
+    Keyset-paginated (id, text) of grants to analyze: those without a summary
+    when `partial`, otherwise every grant. Grants with ids in `skip` are left
+    out.
+    """
+    query = _text_columns(select(Grant.id))
+    for rows in _pages(session, query, partial, data_source_id, page_size):
+        for grant_id, llm_view, encoding, data in rows:
+            if grant_id in skip:
+                continue
+            text = _text(llm_view, encoding, data)
+            if text is not None:
+                yield grant_id, text
+
+
+def select_candidate_ids(
+    session,
+    partial: bool = True,
+    data_source_id: Optional[int] = None,
+    page_size: int = PAGE_SIZE,
+) -> Iterator[int]:
+    """The ids select_candidates would return, without reading any text."""
+    for rows in _pages(session, select(Grant.id), partial, data_source_id, page_size):
+        for (grant_id,) in rows:
+            yield grant_id
+
+
+def grant_texts(session, grant_ids: list[int]) -> dict[int, str]:
+    """The text to analyze of each of `grant_ids` that has one."""
+    rows = session.execute(
+        _text_columns(select(Grant.id)).where(Grant.id.in_(grant_ids))
+    )
+    texts = {}
+    for grant_id, llm_view, encoding, data in rows:
+        text = _text(llm_view, encoding, data)
+        if text is not None:
+            texts[grant_id] = text
+    return texts
+
+
+def stream_candidates(
+    partial: bool = True,
+    data_source_id: Optional[int] = None,
+    prefetch: int = PREFETCH,
+) -> Iterator[tuple[int, str]]:
+    """
+    select_candidates on a background thread, handed over through a queue
+    of at most `prefetch` grants. Errors in the selection are raised here.
+    """
+    grants = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                grants.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def select_all():
+        try:
+            with Session() as session:
+                for grant in select_candidates(
+                    session, partial=partial, data_source_id=data_source_id
+                ):
+                    if not put(grant):
+                        return
+        except Exception as e:
+            put(e)
+        put(_DONE)
+
+    selector = threading.Thread(target=select_all, daemon=True)
+    selector.start()
+    selected = 0
+    try:
+        while True:
+            item = grants.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            selected += 1
+            yield item
+    finally:
+        # Lets the selector stop early if the consumer gave up
+        stop.set()
+        selector.join()
+    logger.info(f"Selected {selected} grants")
@@ -8,14 +8,92 @@ if __name__ == "__main__":
     load_dotenv()
 
     # Load after setting up API key
+    from grant_search.ingest.download import DEFAULT_CACHE_DIR
     from grant_search.ingest.ingest import Ingester
 
     parser = argparse.ArgumentParser(description="Ingest grant data from a URL or file")
     parser.add_argument("--input_url", help="URL or path to input file")
     parser.add_argument("--source_name", help="short name for source", required=True)
     parser.add_argument("--agency", help="Agency name", required=True)
+    parser.add_argument(
+        "--nih_source",
+        choices=["api", "exporter"],
+        default="api",
+        help="NIH only. api: page through RePORTER by year. "
+        "exporter: load the ExPORTER projects CSV/zip given as --input_url",
+    )
+    parser.add_argument(
+        "--abstracts_url",
+        help="ExPORTER abstracts CSV/zip joined to the projects by application id",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Spool the download to disk and read archive members in place",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=500,
+        help="Number of grants written per INSERT batch",
+    )
+    parser.add_argument(
+        "--commit_every",
+        type=int,
+        default=1,
+        help="Number of batches written per commit",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Parallelism: NSF XML parse processes, or concurrent NIH API windows",
+    )
+    parser.add_argument(
+        "--requests_per_second",
+        type=float,
+        default=1.0,
+        help="Request rate shared by all NIH API fetchers",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["replace", "delta", "swap"],
+        default="replace",
+        help="replace: delete and reinsert an existing source. "
+        "delta: only write new/changed awards and delete vanished ones. "
+        "swap: load into a staging table, then apply the changes atomically",
+    )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="Log progress per batch instead of a line per grant",
+    )
+    parser.add_argument(
+        "--stats_json",
+        help="Write the per-stage timing report to this JSON file",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        default=DEFAULT_CACHE_DIR,
+        help="Where downloads are cached and resumed from",
+    )
 
     args = parser.parse_args()
 
-    ingester = Ingester(args.source_name, args.input_url, args.agency)
+    ingester = Ingester(
+        args.source_name,
+        args.input_url,
+        args.agency,
+        stream=args.stream,
+        batch_size=args.batch_size,
+        commit_every=args.commit_every,
+        workers=args.workers,
+        mode=args.mode,
+        requests_per_second=args.requests_per_second,
+        quiet=args.quiet,
+        stats_json=args.stats_json,
+        cache_dir=args.cache_dir,
+        nih_source=args.nih_source,
+        abstracts_source=args.abstracts_url,
+    )
     ingester.ingest()
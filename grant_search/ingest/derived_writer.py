@@ -0,0 +1,132 @@
+"""
+Writes GrantAnalysis results to grant_derived_data.
+
+Each batch is one `INSERT ... ON CONFLICT (grant_id) DO UPDATE`, so saving a
+grant's analysis is a single statement whether or not it was analyzed
+before. DerivedDataWriter runs those batches on a thread of its own: callers
+`put` results and carry on, and the database never holds up the LLM calls.
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+from sqlalchemy.dialects.postgresql import insert
+
+from grant_search.db import database
+from grant_search.db.models import GrantDerivedData
+from grant_search.ingest.send_to_ai import GrantAnalysis
+
+logger = logging.getLogger(__name__)
+
+# Results written per statement, and the longest a result waits for one
+WRITE_BATCH_SIZE = 100
+WRITE_INTERVAL = 2.0
+
+Writer = Callable[[list[tuple[int, GrantAnalysis]]], None]
+
+_DONE = object()
+
+
+def upsert_derived_data(results: list[tuple[int, GrantAnalysis]]):
+    """Inserts or replaces the derived data of a batch of grants."""
+    # A statement can't update the same row twice, so the last result wins
+    rows = {
+        grant_id: {"grant_id": grant_id, **analysis.model_dump()}
+        for grant_id, analysis in results
+    }
+    if not rows:
+        return
+    statement = insert(GrantDerivedData)
+    statement = statement.on_conflict_do_update(
+        index_elements=[GrantDerivedData.grant_id],
+        # Every column, so a grant's earlier analysis is replaced, not merged
+        set_={
+            column.name: statement.excluded[column.name]
+            for column in GrantDerivedData.__table__.columns
+            if column.name not in ("id", "grant_id")
+        },
+    )
+    with database.engine.begin() as connection:
+        connection.execute(statement, list(rows.values()))
+
+
+class DerivedDataWriter:
+    """
+    Saves analyses `batch_size` at a time (or every `interval` seconds) on a
+    dedicated thread. Results put with a cache key are also added to `cache`.
+
+        with DerivedDataWriter() as writer:
+            writer.put(grant_id, analysis)
+    """
+
+    batch_size: int
+    interval: float
+    written: int
+    failed: int
+
+    def __init__(
+        self,
+        writer: Writer = upsert_derived_data,
+        cache=None,
+        batch_size: int = WRITE_BATCH_SIZE,
+        interval: float = WRITE_INTERVAL,
+    ):
+        self.writer = writer
+        self.cache = cache
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self.written = 0
+        self.failed = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, grant_id: int, analysis: GrantAnalysis, key: Optional[str] = None):
+        self._queue.put((grant_id, analysis, key))
+
+    def close(self):
+        """Writes everything put so far and stops the thread."""
+        self._queue.put(_DONE)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is not None and item is not _DONE:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.interval
+            full = len(batch) >= self.batch_size
+            if batch and (full or item is None or item is _DONE):
+                self._save(batch)
+                batch = []
+                deadline = None
+            if item is _DONE:
+                return
+
+    def _save(self, batch: list[tuple[int, GrantAnalysis, Optional[str]]]):
+        try:
+            self.writer([(grant_id, analysis) for grant_id, analysis, _ in batch])
+            new = [(key, analysis) for _, analysis, key in batch if key is not None]
+            if new and self.cache is not None:
+                self.cache.put_many(new)
+            self.written += len(batch)
+            logger.info(f"Saved derived data for {self.written} grants")
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Failed to save derived data for {len(batch)} grants: {e}")
@@ -0,0 +1,211 @@
+import hashlib
+import http.client
+import json
+import logging
+import os
+import ssl
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from typing import Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# Read size used when copying a response to the cache file.
+CHUNK_SIZE = 1024 * 1024
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "INGEST_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "grant_search_downloads"),
+)
+
+# Attempts made to finish a transfer whose connection drops mid-body
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 2.0
+
+
+def _ssl_context() -> ssl.SSLContext:
+    # Create an SSL context that ignores certificate verification
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def filename_from_response(url: str, headers) -> str:
+    # Try to get filename from Content-Disposition header
+    filename = None
+    if "Content-Disposition" in headers:
+        cd = headers["Content-Disposition"]
+        if "filename=" in cd:
+            filename = cd.split("filename=")[1].strip('"')
+
+    # Fall back to URL path if no Content-Disposition
+    if not filename:
+        filename = os.path.basename(urlparse(url).path)
+
+    # If still no filename, use a default
+    if not filename:
+        filename = "downloaded_file"
+    return filename
+
+
+class CachedDownloader:
+    """
+    Downloads URLs into a local cache directory.
+
+    The body is streamed to `<key>.part` in CHUNK_SIZE pieces and renamed into
+    place once complete, next to a `<key>.json` sidecar holding the response's
+    ETag and Last-Modified. With those validators:
+
+    - a complete cached file is revalidated with If-None-Match /
+      If-Modified-Since; a 304 skips the download entirely, and any other
+      answer is downloaded from that same response;
+    - an interrupted `.part` file is resumed with a Range request guarded by
+      If-Range, so a source that changed in between is fetched from scratch
+      instead of being spliced onto stale bytes.
+
+    Servers that ignore Range answer 200, in which case the file is rewritten
+    from the start. Failures to connect are retried like interrupted bodies.
+    """
+
+    cache_dir: str
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.context = _ssl_context()
+
+    def _paths(self, url: str) -> tuple[str, str, str]:
+        key = hashlib.sha256(url.encode()).hexdigest()[:32]
+        base = os.path.join(self.cache_dir, key)
+        return base, base + ".part", base + ".json"
+
+    def _load_meta(self, path: str, url: str) -> dict:
+        try:
+            with open(path, "rt") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return meta if meta.get("url") == url else {}
+
+    def _save_meta(self, path: str, meta: dict):
+        with open(path + ".tmp", "wt") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+    def _open(self, url: str, headers: dict):
+        request = urllib.request.Request(url, headers=headers)
+        try:
+            return urllib.request.urlopen(request, context=self.context)
+        except urllib.error.HTTPError as e:
+            # 304 and 416 are answers we handle, not failures
+            if e.code in (304, 416):
+                return e
+            raise
+
+    @staticmethod
+    def _validator(meta: dict) -> Optional[str]:
+        return meta.get("etag") or meta.get("last_modified")
+
+    def fetch(self, url: str) -> tuple[str, str]:
+        """
+        Makes sure `url` is fully cached, returning (local path, filename).
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path, part_path, meta_path = self._paths(url)
+        meta = self._load_meta(meta_path, url)
+
+        revalidate = bool(
+            os.path.exists(path) and meta.get("complete") and self._validator(meta)
+        )
+        if not revalidate and not (os.path.exists(part_path) and self._validator(meta)):
+            meta = {}
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            headers = {}
+            if revalidate:
+                if meta.get("etag"):
+                    headers["If-None-Match"] = meta["etag"]
+                if meta.get("last_modified"):
+                    headers["If-Modified-Since"] = meta["last_modified"]
+                logger.info(f"Revalidating cached download: {url}")
+            else:
+                # Without a validator there is no safe way to resume
+                offset = os.path.getsize(part_path) if self._validator(meta) else 0
+                if offset:
+                    headers["Range"] = f"bytes={offset}-"
+                    headers["If-Range"] = self._validator(meta)
+                    logger.info(f"Resuming download of {url} at byte {offset}")
+                else:
+                    logger.info(f"Downloading: {url}")
+            response = None
+            try:
+                response = self._open(url, headers)
+                if revalidate and response.status == 304:
+                    logger.info(f"Not modified, using cached file: {path}")
+                    return path, meta["filename"]
+                # Changed upstream: this response is the new download
+                revalidate = False
+                if response.status == 416:
+                    # The partial file is no longer a prefix of the source
+                    meta = {}
+                    continue
+                append = response.status == 206
+                if not append:
+                    meta = self._start(url, response, meta_path)
+                self._copy(response, part_path, append=append)
+                size = os.path.getsize(part_path)
+                if meta["size"] is not None and size < meta["size"]:
+                    raise http.client.IncompleteRead(b"", meta["size"] - size)
+            except urllib.error.HTTPError:
+                # An answer from the server, which retrying won't change
+                raise
+            except (
+                http.client.IncompleteRead,
+                ConnectionError,
+                TimeoutError,
+                urllib.error.URLError,
+            ) as e:
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                logger.warning(f"Download of {url} interrupted ({e}), retrying")
+                time.sleep(RETRY_DELAY * attempt)
+                continue
+            finally:
+                if response is not None:
+                    response.close()
+            return self._finish(url, path, part_path, meta_path, meta)
+        raise Exception(f"Could not download {url}")
+
+    def _start(self, url: str, response, meta_path: str) -> dict:
+        # Written before the body so an interrupted transfer can be resumed
+        meta = {
+            "url": url,
+            "filename": filename_from_response(url, response.headers),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "size": int(response.headers.get("Content-Length") or 0) or None,
+            "complete": False,
+        }
+        self._save_meta(meta_path, meta)
+        return meta
+
+    def _copy(self, response, part_path: str, append: bool):
+        with open(part_path, "ab" if append else "wb") as f:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+
+    def _finish(
+        self, url: str, path: str, part_path: str, meta_path: str, meta: dict
+    ) -> tuple[str, str]:
+        size = os.path.getsize(part_path)
+        os.replace(part_path, path)
+        meta["size"] = size
+        meta["complete"] = True
+        self._save_meta(meta_path, meta)
+        logger.info(f"Downloaded {size / 1e6:.1f}MB to {path}")
+        return path, meta["filename"]
@@ -0,0 +1,187 @@
+"""
+NIH ExPORTER bulk files.
+
+ExPORTER publishes each fiscal year as a projects CSV (RePORTER_PRJ_C_FY*.csv)
+and a separate abstracts CSV (RePORTER_PRJABS_C_FY*.csv), usually zipped and
+too large to hold in memory. Both are read row by row through `csv`, and the
+abstracts are joined to their projects on APPLICATION_ID by hash partitioning:
+each file is split into PARTITIONS bucket files on disk, then each bucket's
+abstracts are loaded into a dict and its projects streamed past it, so memory
+is bounded by one bucket rather than the whole year.
+"""
+
+import codecs
+from contextlib import contextmanager
+import csv
+from datetime import datetime
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+from typing import Iterator, Optional
+import zipfile
+import zlib
+
+from grant_search.ingest.records import ParsedGrant
+
+logger = logging.getLogger(__name__)
+
+# Bucket files per side of the join
+PARTITIONS = 64
+
+ENCODING = "utf-8"
+# Older ExPORTER years are cp1252 (or mix it into utf-8 text), so bytes that
+# aren't valid utf-8 are decoded as cp1252 rather than replaced
+DECODE_ERRORS = "exporter_cp1252"
+DATE_FORMAT = "%m/%d/%Y"
+
+# Abstracts routinely exceed csv's default 128KB field limit
+csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+
+
+def _decode_cp1252(error: UnicodeDecodeError) -> tuple[str, int]:
+    invalid = error.object[error.start : error.end]
+    # cp1252 leaves five bytes undefined, which latin-1 maps to themselves
+    text = "".join(
+        bytes([byte]).decode("cp1252", errors="ignore") or chr(byte) for byte in invalid
+    )
+    return text, error.end
+
+
+codecs.register_error(DECODE_ERRORS, _decode_cp1252)
+
+
+@contextmanager
+def open_csv(path: str) -> Iterator[csv.DictReader]:
+    """Opens a CSV, or the first CSV inside a zip, as a streaming DictReader."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zip_ref:
+            members = [
+                info
+                for info in zip_ref.infolist()
+                if info.filename.lower().endswith(".csv")
+            ]
+            if not members:
+                raise Exception(f"No CSV file in {path}")
+            with zip_ref.open(members[0]) as member:
+                text = io.TextIOWrapper(
+                    member, encoding=ENCODING, errors=DECODE_ERRORS, newline=""
+                )
+                yield csv.DictReader(text)
+    else:
+        with open(path, "rt", encoding=ENCODING, errors=DECODE_ERRORS, newline="") as f:
+            yield csv.DictReader(f)
+
+
+def _partition_of(application_id: str, partitions: int) -> int:
+    return zlib.crc32(application_id.strip().encode()) % partitions
+
+
+def _partition(
+    reader: csv.DictReader, directory: str, prefix: str, partitions: int
+) -> list[str]:
+    """Splits a CSV into `partitions` bucket files by APPLICATION_ID."""
+    paths = [
+        os.path.join(directory, f"{prefix}-{i:03d}.csv") for i in range(partitions)
+    ]
+    files = [open(path, "wt", encoding="utf-8", newline="") for path in paths]
+    try:
+        writers = [csv.DictWriter(f, fieldnames=reader.fieldnames) for f in files]
+        for writer in writers:
+            writer.writeheader()
+        for row in reader:
+            application_id = row.get("APPLICATION_ID")
+            if not application_id:
+                continue
+            writers[_partition_of(application_id, partitions)].writerow(row)
+    finally:
+        for f in files:
+            f.close()
+    return paths
+
+
+def join_abstracts(
+    projects_path: str,
+    abstracts_path: Optional[str],
+    partitions: int = PARTITIONS,
+    temp_dir: Optional[str] = None,
+) -> Iterator[dict]:
+    """
+    Yields each project row with its ABSTRACT_TEXT added.
+
+    Without an abstracts file the projects are streamed through as they are.
+    Rows come out grouped by partition, not in file order.
+    """
+    if abstracts_path is None:
+        with open_csv(projects_path) as projects:
+            yield from projects
+        return
+
+    with tempfile.TemporaryDirectory(dir=temp_dir) as directory:
+        with open_csv(projects_path) as projects:
+            project_buckets = _partition(projects, directory, "projects", partitions)
+        with open_csv(abstracts_path) as abstracts:
+            abstract_buckets = _partition(abstracts, directory, "abstracts", partitions)
+        logger.info(f"Partitioned projects and abstracts into {partitions} buckets")
+
+        for projects_bucket, abstracts_bucket in zip(project_buckets, abstract_buckets):
+            with open(abstracts_bucket, "rt", encoding="utf-8", newline="") as f:
+                abstracts = {
+                    row["APPLICATION_ID"].strip(): row.get("ABSTRACT_TEXT") or ""
+                    for row in csv.DictReader(f)
+                }
+            with open(projects_bucket, "rt", encoding="utf-8", newline="") as f:
+                for row in csv.DictReader(f):
+                    row["ABSTRACT_TEXT"] = abstracts.get(
+                        row["APPLICATION_ID"].strip(), ""
+                    )
+                    yield row
+            os.remove(projects_bucket)
+            os.remove(abstracts_bucket)
+
+
+def _pi_name(value: str) -> Optional[str]:
+    # "SMITH, JOHN A. (contact)" -> "JOHN SMITH", keeping the file's casing
+    # since grantees are matched on the exact name
+    value = value.replace("(contact)", "").strip()
+    if not value:
+        return None
+    last, _, first = value.partition(",")
+    # Drop middle initials, matching the API's separate first_name field
+    first_names = [part for part in first.split() if len(part.rstrip(".")) > 1]
+    name = " ".join(first_names[:1] + [last.strip()]).strip()
+    return name or None
+
+
+def parse_pi_names(value: str) -> list[str]:
+    names = [_pi_name(part) for part in (value or "").split(";")]
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def _date(value: str) -> Optional[datetime]:
+    value = (value or "").strip()
+    return datetime.strptime(value, DATE_FORMAT) if value else None
+
+
+def _amount(row: dict) -> float:
+    for column in ["TOTAL_COST", "TOTAL_COST_SUB_PROJECT"]:
+        value = (row.get(column) or "").strip()
+        if value:
+            return float(value)
+    return 0.0
+
+
+def parse_exporter_project(row: dict) -> ParsedGrant:
+    return ParsedGrant(
+        award_id=row["APPLICATION_ID"].strip(),
+        title=row.get("PROJECT_TITLE") or "",
+        start_date=_date(row.get("PROJECT_START")),
+        end_date=_date(row.get("PROJECT_END")),
+        amount=_amount(row),
+        description=row.get("ABSTRACT_TEXT") or "",
+        investigators=parse_pi_names(row.get("PI_NAMEs")),
+        raw_text=json.dumps(row).encode(),
+        institution=(row.get("ORG_NAME") or "").strip() or None,
+    )
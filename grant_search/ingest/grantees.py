@@ -0,0 +1,89 @@
+import logging
+import threading
+from typing import Iterable
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from grant_search.db import database
+from grant_search.db.models import Grantee
+
+logger = logging.getLogger(__name__)
+
+# Number of names sent per INSERT ... ON CONFLICT statement
+INSERT_CHUNK_SIZE = 1000
+
+
+class GranteeResolver:
+    """
+    Maps investigator names to grantee ids without a query per name.
+
+    All existing grantees are loaded into memory on first use. Names that are
+    not in the cache are created in bulk with INSERT ... ON CONFLICT DO NOTHING
+    (relying on the unique index on grantees.name) in their own committed
+    transaction, so the returned ids stay valid even if the caller's grant
+    transaction is rolled back.
+
+    One resolver can be shared by ingests running on several threads: loading
+    and creating grantees are serialized by a lock, lookups of cached names
+    are not.
+    """
+
+    ids: dict[str, int]
+    created: int
+
+    def __init__(self):
+        self.ids = {}
+        self.created = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def preload(self):
+        with database.engine.connect() as connection:
+            for grantee_id, name in connection.execute(
+                select(Grantee.id, Grantee.name)
+            ):
+                self.ids[name] = grantee_id
+        self._loaded = True
+        logger.info(f"Preloaded {len(self.ids)} grantees")
+
+    def resolve(self, names: Iterable[str]) -> dict[str, int]:
+        """
+        Returns a name -> grantee id mapping for every name, creating the
+        grantees that don't exist yet.
+        """
+        names = list(dict.fromkeys(names))
+        with self._lock:
+            if not self._loaded:
+                self.preload()
+        missing = [name for name in names if name not in self.ids]
+        if missing:
+            with self._lock:
+                # Another thread may have created some of them meanwhile
+                missing = [name for name in missing if name not in self.ids]
+                if missing:
+                    self._create(missing)
+        return {name: self.ids[name] for name in names}
+
+    def _create(self, names: list[str]):
+        with database.engine.begin() as connection:
+            for i in range(0, len(names), INSERT_CHUNK_SIZE):
+                chunk = names[i : i + INSERT_CHUNK_SIZE]
+                inserted = connection.execute(
+                    insert(Grantee)
+                    .values([{"name": name} for name in chunk])
+                    .on_conflict_do_nothing(index_elements=[Grantee.name])
+                    .returning(Grantee.id, Grantee.name)
+                )
+                for grantee_id, name in inserted:
+                    self.ids[name] = grantee_id
+                    self.created += 1
+
+            # Names inserted concurrently by another process hit the conflict
+            # clause and are not returned, so look them up.
+            raced = [name for name in names if name not in self.ids]
+            if raced:
+                for grantee_id, name in connection.execute(
+                    select(Grantee.id, Grantee.name).where(Grantee.name.in_(raced))
+                ):
+                    self.ids[name] = grantee_id
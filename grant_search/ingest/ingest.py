@@ -4,240 +4,373 @@ import gzip
 import json
 import os
 import tempfile
-import urllib.request
 import zipfile
 from urllib.parse import urlparse
 import io
 import logging
-import xml.etree.ElementTree as ET
-import ssl
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Iterator, Optional
 
-from grant_search.db.models import Agency, DataSource, Grant, Grantee
+from grant_search.db.models import Agency, DataSource, Grant
 from grant_search.db.database import Session
-from grant_search.ingest.nih import API_URL, get_nih_grants_by_year
+from grant_search.ingest.candidates import stream_candidates
+from grant_search.ingest.download import DEFAULT_CACHE_DIR, CachedDownloader
+from grant_search.ingest.exporter import join_abstracts, parse_exporter_project
+from grant_search.ingest.grantees import GranteeResolver
+from grant_search.ingest.stats import IngestStats, TimedReader
+from grant_search.ingest.writer import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_COMMIT_EVERY,
+    GrantWriter,
+    StagingWriter,
+    load_existing,
+)
+from grant_search.ingest.nih import (
+    API_URL,
+    DEFAULT_REQUESTS_PER_SECOND,
+    TokenBucket,
+    Window,
+    get_nih_grants_by_year,
+    parse_nih_project,
+)
+from grant_search.ingest.nsf import (
+    extract_nsf_award,
+    extract_nsf_award_stream,
+    parse_nsf_members,
+)
 from grant_search.ingest.send_to_ai import SendToAI
 
-
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 logger = logging.getLogger(__name__)
 
+# How an existing data source is refreshed: "replace" deletes every grant and
+# reinserts, "delta" only writes awards whose content changed, "swap" loads
+# into a staging table and swaps the changes in with one short transaction.
+INGEST_MODES = ["replace", "delta", "swap"]
 
-def xml_string_to_dict(xml_string: str):
-    tree = ET.fromstring(xml_string)
-    return _xml_to_dict(tree)
+# Zip members sent to a parse worker per task, and tasks kept in flight per
+# worker. Bounds memory while keeping the pool busy.
+PARSE_CHUNK_SIZE = 64
+PARSE_TASKS_PER_WORKER = 4
 
-
-def _xml_to_dict(element):
-    result = {}
-    # Add element attributes if any exist
-    if element.attrib:
-        result.update(element.attrib)
-
-    # Handle child elements
-    for child in element:
-        child_dict = _xml_to_dict(child)
-        child_tag = child.tag
-
-        if child_tag in result:
-            # If key exists, convert to list if not already
-            if not isinstance(result[child_tag], list):
-                result[child_tag] = [result[child_tag]]
-            result[child_tag].append(child_dict)
-        else:
-            result[child_tag] = child_dict
-
-    # Handle element text
-    if element.text and element.text.strip():
-        if result:  # If we have child elements/attributes
-            result["text"] = element.text.strip()
-        else:
-            result = element.text.strip()
-
-    return result
+# Where NIH grants come from: the paged RePORTER API, or ExPORTER bulk CSVs
+# given as the source (projects) and abstracts_source.
+NIH_SOURCES = ["api", "exporter"]
 
 
 class Ingester:
     source: str
     agency: str
     source_name: str
-
-    def __init__(self, source_name: str, source: str, agency: str):
+    stream: bool
+    grantees: GranteeResolver
+    writer: GrantWriter
+    stats: IngestStats
+    downloader: CachedDownloader
+
+    def __init__(
+        self,
+        source_name: str,
+        source: str,
+        agency: str,
+        stream: bool = False,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        commit_every: int = DEFAULT_COMMIT_EVERY,
+        workers: int = 1,
+        mode: str = "replace",
+        requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+        quiet: bool = False,
+        stats_json: Optional[str] = None,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        api_url: str = API_URL,
+        nih_source: str = "api",
+        abstracts_source: Optional[str] = None,
+        grantees: Optional[GranteeResolver] = None,
+        nih_limiter: Optional[TokenBucket] = None,
+    ):
         self.source = source
         self.agency = agency
         self.source_name = source_name
-
-        if self.agency != "NIH":
-            assert self.source, "Source (--input_url) is required for non-NIH data"
+        self.stream = stream
+        self.batch_size = batch_size
+        self.commit_every = commit_every
+        self.workers = workers
+        self.mode = mode
+        self.requests_per_second = requests_per_second
+        self.api_url = api_url
+        self.nih_source = nih_source
+        self.abstracts_source = abstracts_source
+        self.quiet = quiet
+        self.stats_json = stats_json
+        # Both can be shared by ingests running side by side
+        self.grantees = grantees or GranteeResolver()
+        self.nih_limiter = nih_limiter
+        self.stats = IngestStats()
+        self.downloader = CachedDownloader(cache_dir)
+
+        if self.nih_source not in NIH_SOURCES:
+            raise Exception(f"NIH source must be in {NIH_SOURCES}")
+
+        if self.agency != "NIH" or self.nih_source == "exporter":
+            assert self.source, "Source (--input_url) is required for file data"
         else:
-            self.source = f"{API_URL}?year={self.source_name}"
+            self.source = f"{self.api_url}?year={self.source_name}"
 
         if self.agency not in ["NIH", "NSF"]:
             raise Exception("Agency must be in [NIH, NSF]")
 
+        if self.mode not in INGEST_MODES:
+            raise Exception(f"Mode must be in {INGEST_MODES}")
+
+    def _download(self, url: Optional[str] = None) -> tuple[str, str]:
+        """Fetches the source (or another) URL into the download cache."""
+        with self.stats.stage("download"):
+            path, filename = self.downloader.fetch(url or self.source)
+        logger.info(f"Detected filename: {filename}")
+        self.stats.add("download", bytes=os.path.getsize(path))
+        return path, filename
+
     def _get_content(self) -> tuple[io.BytesIO, str]:
         # Check if source is URL or local file
         parsed = urlparse(self.source)
         is_url = bool(parsed.scheme)
-        print(f"Getting {self.source} {is_url}")
+        logger.info(f"Getting {self.source} {is_url}")
         # Get file object either from URL or local path
         if is_url:
-            logger.info(f"Downloading: {self.source}")
-            # Create an SSL context that ignores certificate verification
-            context = ssl.create_default_context()
-            context.check_hostname = False
-            context.verify_mode = ssl.CERT_NONE
-
-            response = urllib.request.urlopen(self.source, context=context)
-            file_content = response.read()
-
-            # Try to get filename from Content-Disposition header
-            filename = None
-            if "Content-Disposition" in response.headers:
-                cd = response.headers["Content-Disposition"]
-                if "filename=" in cd:
-                    filename = cd.split("filename=")[1].strip('"')
-
-            # Fall back to URL path if no Content-Disposition
-            if not filename:
-                filename = os.path.basename(parsed.path)
-
-            # If still no filename, use a default
-            if not filename:
-                filename = "downloaded_file"
-
-            logger.info(f"Detected filename: {filename}")
+            path, filename = self._download()
         else:
-            with open(self.source, "rb") as f:
-                file_content = f.read()
-            filename = os.path.basename(self.source)
+            path, filename = self.source, os.path.basename(self.source)
+        with open(path, "rb") as f:
+            file_content = f.read()
 
         return io.BytesIO(file_content), filename
 
+    def _spool_content(self) -> tuple[BinaryIO, str]:
+        """
+        Streaming counterpart of `_get_content`.
+
+        Downloads go through the download cache and are read from the cached
+        file, local files are opened in place. The caller owns the returned
+        file.
+        """
+        parsed = urlparse(self.source)
+        if not parsed.scheme:
+            return open(self.source, "rb"), os.path.basename(self.source)
+
+        path, filename = self._download()
+        return open(path, "rb"), filename
+
     def _handle_zip(self, filename, file_content: io.BytesIO):
         # Create temporary directory
         temp_dir = tempfile.mkdtemp()
 
         # Extract zip contents to temp directory
-        with zipfile.ZipFile(file_content, "r") as zip_ref:
+        with self.stats.stage("decompress"), zipfile.ZipFile(
+            file_content, "r"
+        ) as zip_ref:
             zip_ref.extractall(temp_dir)
 
+        if self.workers > 1:
+            self._parse_parallel(self._read_extracted(temp_dir))
+            return
+
         i = 0
         # Walk through all files in temp directory
         for root, dirs, files in os.walk(temp_dir):
             for file in files:
                 i += 1
                 file_path = os.path.join(root, file)
-                with open(file_path, "rt") as f:
+                # As bytes, so content_hash is the same on every ingest path
+                with open(file_path, "rb") as f:
                     self.process_file(file_path, f.read())
 
-    def process_file(self, file_name, content):
+    def _read_extracted(self, temp_dir: str) -> Iterator[tuple[str, bytes]]:
+        for root, dirs, files in os.walk(temp_dir):
+            for file in files:
+                file_path = os.path.join(root, file)
+                with open(file_path, "rb") as f:
+                    yield file_path, f.read()
+
+    def _stream_zip(self, file_content: BinaryIO):
+        # Members are decompressed one at a time straight from the archive
+        with zipfile.ZipFile(file_content, "r") as zip_ref:
+            if self.workers > 1:
+                self._parse_parallel(self._read_members(zip_ref))
+                return
+            for info in zip_ref.infolist():
+                if info.is_dir():
+                    continue
+                with zip_ref.open(info) as member:
+                    self.process_stream(info.filename, member)
+
+    def _read_members(self, zip_ref: zipfile.ZipFile) -> Iterator[tuple[str, bytes]]:
+        for info in zip_ref.infolist():
+            if info.is_dir():
+                continue
+            with self.stats.stage("decompress"):
+                content = zip_ref.read(info)
+            self.stats.add("decompress", bytes=len(content))
+            yield info.filename, content
+
+    def _parse_parallel(self, members: Iterator[tuple[str, bytes]]):
+        """
+        Fans XML members out to a process pool in chunks and feeds the parsed
+        grants to the writer, in archive order, from this thread.
+        """
+        pending = deque()
+
+        def write_next():
+            chunk, future = pending.popleft()
+            # Parsing overlaps with this thread, so this is time spent waiting
+            with self.stats.stage("parse", rows=len(chunk)):
+                grants = future.result()
+            for (file_name, content), grant in zip(chunk, grants):
+                if grant is None:
+                    logger.error(f"Error parsing award file: {file_name}")
+                    continue
+                self.writer.add(grant._replace(raw_text=content))
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            chunk = []
+            for file_name, content in members:
+                if not file_name.endswith(".xml"):
+                    continue
+                chunk.append((file_name, content))
+                if len(chunk) < PARSE_CHUNK_SIZE:
+                    continue
+                pending.append((chunk, executor.submit(parse_nsf_members, chunk)))
+                chunk = []
+                if len(pending) >= self.workers * PARSE_TASKS_PER_WORKER:
+                    write_next()
+            if chunk:
+                pending.append((chunk, executor.submit(parse_nsf_members, chunk)))
+            while pending:
+                write_next()
+
+    def process_stream(self, file_name: str, stream: BinaryIO):
         if file_name.endswith(".xml"):
-            data = xml_string_to_dict(content)
-            # For NSF data:
-            award = data["Award"]
-            award_id = award["AwardID"]
-            title = award["AwardTitle"]
-            start_date = datetime.strptime(award["AwardEffectiveDate"], "%m/%d/%Y")
-            end_date = datetime.strptime(award["AwardExpirationDate"], "%m/%d/%Y")
-            amount = award["AwardAmount"]
-            description = award["AbstractNarration"]
-            if description is None or len(description) == 0:
-                description = "No description provided"
-            investigators = award["Investigator"]
-            if type(investigators) != list:
-                investigators = [investigators]
-            investigators = [x["PI_FULL_NAME"] for x in investigators]
-            # Create grantees from investigators
-            grantees = []
-            for investigator in investigators:
-                # Check if grantee already exists
-                grantee = (
-                    self.session.query(Grantee)
-                    .filter(Grantee.name == investigator)
-                    .first()
-                )
-                if not grantee:
-                    logger.info(f"Creating new grantee: {investigator}")
-                    grantee = Grantee(name=investigator)
-                    self.session.add(grantee)
-                grantees.append(grantee)
-            self.session.commit()
-            grant = Grant(
-                title=title,
-                start_date=start_date,
-                end_date=end_date,
-                amount=float(amount),
-                description=description,
-                award_id=award_id,
-                data_source_id=self.data_source.id,
-                raw_text=content.encode(),
+            reader = TimedReader(stream, self.stats, "decompress")
+            started = time.perf_counter()
+            grant = extract_nsf_award_stream(reader)
+            elapsed = time.perf_counter() - started
+            self.stats.record("decompress", reader.seconds)
+            self.stats.record(
+                "parse", elapsed - reader.seconds, rows=1, bytes=len(grant.raw_text)
             )
-            # Add grantees to grant
-            grant.grantees.extend(grantees)
-            self.session.add(grant)
-            self.session.commit()
-            logger.info(f"Created grant: {title}")
+            self.writer.add(grant)
+
+    def process_file(self, file_name, content: bytes):
+        if file_name.endswith(".xml"):
+            with self.stats.stage("parse", rows=1, bytes=len(content)):
+                grant = extract_nsf_award(content)
+            self.writer.add(grant._replace(raw_text=content))
+
+    def _save_nih_checkpoint(self, completed: list[Window]):
+        self.data_source.checkpoint = {
+            "completed": [
+                [start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")]
+                for start, end in completed
+            ]
+        }
+        self.session.commit()
 
     def process_nih(self):
         year = self.source_name.split(" ")[1]
         logger.info(f"Processing NIH grants for {year}")
-        for data in get_nih_grants_by_year(year):
+        checkpoint = self.data_source.checkpoint or {}
+        completed = [
+            (datetime.strptime(start, "%Y-%m-%d"), datetime.strptime(end, "%Y-%m-%d"))
+            for start, end in checkpoint.get("completed", [])
+        ]
+        if completed:
+            logger.info(f"Skipping {len(completed)} windows completed previously")
+
+        def on_window_done(window: Window):
+            # Grants must be durable before the window is recorded as done
+            self.writer.commit()
+            completed.append(window)
+            self._save_nih_checkpoint(completed)
+
+        records = get_nih_grants_by_year(
+            year,
+            workers=self.workers,
+            requests_per_second=self.requests_per_second,
+            api_url=self.api_url,
+            limiter=self.nih_limiter,
+            completed=list(completed),
+            on_window_done=on_window_done,
+        )
+        while True:
+            # Fetching runs ahead on other threads, so this is time spent
+            # waiting on the API
+            with self.stats.stage("download"):
+                data = next(records, None)
+            if data is None:
+                break
+            self.stats.add("download", rows=1)
+            started = time.perf_counter()
             try:
-                award_id = data["appl_id"]
-                title = data["project_title"]
-                amount = data["award_amount"] or 0.0
-                description = data["abstract_text"]
-                investigators = data["principal_investigators"]
-                if type(investigators) != list:
-                    investigators = [investigators]
-                investigators = [
-                    x["first_name"] + " " + x["last_name"] for x in investigators
-                ]
-                # Parse dates from NIH format
-                start_date = datetime.strptime(
-                    data["project_start_date"], "%Y-%m-%dT%H:%M:%SZ"
-                )
-                end_date = datetime.strptime(
-                    data["project_end_date"], "%Y-%m-%dT%H:%M:%SZ"
-                )
-
-                # Create grantees from investigators
-                grantees = []
-                for investigator in investigators:
-                    # Check if grantee already exists
-                    grantee = (
-                        self.session.query(Grantee)
-                        .filter(Grantee.name == investigator)
-                        .first()
-                    )
-                    if not grantee:
-                        logger.info(f"Creating new grantee: {investigator}")
-                        grantee = Grantee(name=investigator)
-                        self.session.add(grantee)
-                    grantees.append(grantee)
-                self.session.commit()
-
-                grant = Grant(
-                    title=title,
-                    start_date=start_date,
-                    end_date=end_date,
-                    amount=float(amount),
-                    description=description,
-                    award_id=award_id,
-                    data_source_id=self.data_source.id,
-                    raw_text=json.dumps(data).encode(),
+                grant = parse_nih_project(data)
+                self.stats.record(
+                    "parse",
+                    time.perf_counter() - started,
+                    rows=1,
+                    bytes=len(grant.raw_text),
                 )
-                # Add grantees to grant
-                grant.grantees.extend(grantees)
-                self.session.add(grant)
-                self.session.commit()
-                logger.info(f"Created grant: {title}")
+                self.writer.add(grant)
             except Exception as e:
                 logger.error(
                     f"Error creating grant: {e} in {json.dumps(data, indent=2)}"
                 )
+        self.writer.commit()
+        self.data_source.checkpoint = None
+        self.session.commit()
+
+    def _local_path(self, source: str) -> str:
+        if urlparse(source).scheme:
+            path, _ = self._download(source)
+            return path
+        return source
+
+    def process_nih_exporter(self):
+        projects = self._local_path(self.source)
+        abstracts = (
+            self._local_path(self.abstracts_source) if self.abstracts_source else None
+        )
+        if abstracts is None:
+            logger.warning(
+                "No ExPORTER abstracts file given, descriptions will be empty"
+            )
+
+        rows = join_abstracts(projects, abstracts)
+        while True:
+            # Includes partitioning both files, which happens before the first row
+            with self.stats.stage("decompress"):
+                row = next(rows, None)
+            if row is None:
+                break
+            try:
+                with self.stats.stage("parse", rows=1):
+                    grant = parse_exporter_project(row)
+            except Exception as e:
+                logger.error(f"Error creating grant: {e} in {json.dumps(row)}")
+                continue
+            self.writer.add(grant)
+
+    def _ingest_stream(self):
+        file_content, filename = self._spool_content()
+        with file_content:
+            if filename.endswith(".zip"):
+                self._stream_zip(file_content)
+            elif filename.endswith(".gz"):
+                with gzip.GzipFile(fileobj=file_content) as decompressed:
+                    self.process_stream(filename[0:-3], decompressed)
+            else:
+                self.process_stream(filename, file_content)
 
     def ingest(self):
         self.session = Session()
@@ -262,7 +395,23 @@ class Ingester:
             )
             .first()
         )
-        if self.data_source:
+        existing = None
+        # A checkpoint is only left behind by an ingest that didn't finish
+        resuming = bool(self.data_source and self.data_source.checkpoint)
+        if resuming and self.mode == "swap":
+            logger.info(f"Resuming interrupted staging load of: {self.source}")
+        elif resuming:
+            logger.info(f"Resuming interrupted ingest of: {self.source}")
+            # Grants written before the interruption are skipped, not duplicated
+            existing = load_existing(session.connection(), self.data_source.id)
+        elif self.data_source and self.mode == "delta":
+            logger.info(f"Found existing data source: {self.source}")
+            existing = load_existing(session.connection(), self.data_source.id)
+            logger.info(f"Loaded {len(existing)} existing grants for delta ingest")
+        elif self.data_source and self.mode == "swap":
+            logger.info(f"Found existing data source: {self.source}")
+            logger.info("Its grants stay live until the staged reload is swapped in")
+        elif self.data_source:
             logger.info(f"Found existing data source: {self.source}")
             # Delete existing grants for this data source
             grants_to_delete = (
@@ -288,8 +437,32 @@ class Ingester:
             session.commit()
             logger.info(f"Created data source: {self.source}")
 
-        if self.agency == "NIH":
+        if self.mode == "swap":
+            self.writer = StagingWriter(
+                self.data_source.id,
+                self.grantees,
+                batch_size=self.batch_size,
+                commit_every=self.commit_every,
+                stats=self.stats,
+                log_rows=not self.quiet,
+                resume=resuming,
+            )
+        else:
+            self.writer = GrantWriter(
+                self.data_source.id,
+                self.grantees,
+                batch_size=self.batch_size,
+                commit_every=self.commit_every,
+                existing=existing,
+                stats=self.stats,
+                log_rows=not self.quiet,
+            )
+        if self.agency == "NIH" and self.nih_source == "exporter":
+            self.process_nih_exporter()
+        elif self.agency == "NIH":
             self.process_nih()
+        elif self.stream:
+            self._ingest_stream()
         else:
             file_content, filename = self._get_content()
 
@@ -298,26 +471,35 @@ class Ingester:
                 self._handle_zip(filename, file_content)
 
             elif filename.endswith(".gz"):
-                file_content = io.BytesIO(gzip.decompress(file_content))
+                with self.stats.stage("decompress"):
+                    file_content = io.BytesIO(gzip.decompress(file_content.getvalue()))
                 # Remove .gz
                 new_filename = self.source[0:-3]
-                self.process_file(new_filename, file_content)
+                self.process_file(new_filename, file_content.getvalue())
 
-            self.process_file(filename, file_content)
+            self.process_file(filename, file_content.getvalue())
+        if existing is not None and resuming:
+            # Grants from windows skipped on resume weren't seen this run
+            logger.info("Not deleting vanished grants after a resumed ingest")
+        elif existing is not None:
+            self.writer.delete_missing()
+        self.writer.close()
 
-        # Process grants through AI after ingestion
+        # Process grants through AI after ingestion. Unchanged grants from a
+        # delta ingest keep their derived data and are not sent again.
 
         logger.info("Processing grants through AI...")
-        with Session() as session:
-            grants = (
-                session.query(Grant)
-                .filter(Grant.data_source_id == self.data_source.id)
-                .all()
+        ai_processor = SendToAI()
+        with self.stats.stage("ai_handoff"):
+            processed = ai_processor.process_grant_texts(
+                stream_candidates(partial=True, data_source_id=self.data_source.id)
             )
+        self.stats.add("ai_handoff", rows=processed)
+        if processed:
+            logger.info(f"Processed {processed} grants through AI")
+        else:
+            logger.warn("No grants found to process through AI")
 
-            if grants:
-                ai_processor = SendToAI()
-                ai_processor.process_grants(grants)
-                logger.info(f"Processed {len(grants)} grants through AI")
-            else:
-                logger.warn("No grants found to process through AI")
+        self.stats.log_summary()
+        if self.stats_json:
+            self.stats.write_json(self.stats_json)
@@ -0,0 +1,215 @@
+"""
+Compact text of a grant for the LLM.
+
+Rather than the raw award XML or RePORTER JSON, analysis and query filtering
+send each grant's `llm_view`: its title, investigators, institution, amount
+and abstract as plain text, with the abstract cut to fit TOKEN_BUDGET. Views
+are built by the writer at ingest; grants ingested before that can be
+backfilled from their raw documents:
+
+    python -m grant_search.ingest.llm_view --backfill
+
+Tokens are counted with tiktoken's encoding for gpt-4o when it is available
+and estimated from the length otherwise. The writer only estimates the
+savings, keeping tiktoken off the ingest path; the backfill counts them.
+"""
+
+import argparse
+import html
+import json
+import logging
+import os
+import re
+import threading
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from grant_search.ingest.records import ParsedGrant
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Tokens per view, including the header lines; override with LLM_VIEW_TOKENS
+TOKEN_BUDGET = int(os.environ.get("LLM_VIEW_TOKENS", "1024"))
+# The encoding of gpt-4o and gpt-4o-mini
+ENCODING_NAME = "o200k_base"
+# Used to estimate without tiktoken
+CHARS_PER_TOKEN = 4
+
+BACKFILL_BATCH_SIZE = 500
+
+_TAG = re.compile(r"<[^>]+>")
+_SPACE = re.compile(r"[ \t\r\f\v]+")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+
+_encoding = None
+_encoding_loaded = False
+_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    with _lock:
+        if not _encoding_loaded:
+            _encoding_loaded = True
+            if tiktoken is None:
+                logger.warning("tiktoken is not installed, estimating tokens")
+            else:
+                try:
+                    _encoding = tiktoken.get_encoding(ENCODING_NAME)
+                except Exception as e:
+                    logger.warning(
+                        f"Could not load {ENCODING_NAME} ({e}), estimating tokens"
+                    )
+    return _encoding
+
+
+def estimate_tokens(length: int) -> int:
+    """Tokens in a text of `length` characters (or bytes), without encoding it."""
+    return (length + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return estimate_tokens(len(text))
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """`text` cut to at most `max_tokens`, at a word boundary where possible."""
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is None:
+        limit = max_tokens * CHARS_PER_TOKEN
+        if len(text) <= limit:
+            return text
+        cut = text[:limit]
+    else:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        cut = encoding.decode(tokens[:max_tokens])
+    space = cut.rfind(" ")
+    if space > len(cut) // 2:
+        cut = cut[:space]
+    return cut.rstrip() + " ..."
+
+
+def clean_text(text: Optional[str]) -> str:
+    """Plain text from an abstract that may hold HTML markup and entities."""
+    if not text:
+        return ""
+    text = text.replace("<br/>", "\n").replace("<br>", "\n")
+    text = html.unescape(_TAG.sub(" ", text))
+    text = "\n".join(_SPACE.sub(" ", line).strip() for line in text.split("\n"))
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def build_llm_view(grant: ParsedGrant, budget: int = TOKEN_BUDGET) -> str:
+    lines = [f"Title: {clean_text(grant.title)}"]
+    if grant.investigators:
+        lines.append(f"Investigators: {', '.join(grant.investigators)}")
+    if grant.institution:
+        lines.append(f"Institution: {grant.institution}")
+    if grant.amount:
+        lines.append(f"Amount: ${grant.amount:,.0f}")
+    header = "\n".join(lines) + "\nAbstract: "
+    abstract = truncate_tokens(
+        clean_text(grant.description), budget - count_tokens(header)
+    )
+    return header + abstract
+
+
+def parse_raw_document(raw_text: bytes) -> ParsedGrant:
+    """Re-parses a stored raw document, whichever source it came from."""
+    from grant_search.ingest.exporter import parse_exporter_project
+    from grant_search.ingest.nih import parse_nih_project
+    from grant_search.ingest.nsf import extract_nsf_award
+
+    if raw_text.lstrip().startswith(b"<"):
+        return extract_nsf_award(raw_text)
+    data = json.loads(raw_text)
+    if "APPLICATION_ID" in data:
+        return parse_exporter_project(data)
+    return parse_nih_project(data)
+
+
+def backfill(batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Builds views for grants that don't have one. Returns the number built."""
+    from sqlalchemy import bindparam, select, update
+
+    from grant_search.db import database, raw_store
+    from grant_search.db.models import Grant, GrantRawDocument
+
+    built = 0
+    view_tokens = 0
+    raw_tokens = 0
+    last_id = 0
+    with database.engine.connect() as connection:
+        while True:
+            rows = connection.execute(
+                select(Grant.id, GrantRawDocument.encoding, GrantRawDocument.data)
+                .join(GrantRawDocument, GrantRawDocument.grant_id == Grant.id)
+                .where(Grant.id > last_id, Grant.llm_view.is_(None))
+                .order_by(Grant.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            views = []
+            for grant_id, encoding, data in rows:
+                raw_text = raw_store.decompress(encoding, data)
+                try:
+                    view = build_llm_view(parse_raw_document(raw_text))
+                except Exception as e:
+                    logger.error(f"Could not build a view of grant {grant_id}: {e}")
+                    continue
+                views.append({"b_id": grant_id, "llm_view": view})
+                view_tokens += count_tokens(view)
+                raw_tokens += count_tokens(raw_text.decode("utf-8", errors="replace"))
+            if views:
+                connection.execute(
+                    update(Grant.__table__).where(Grant.id == bindparam("b_id")),
+                    views,
+                )
+                connection.commit()
+            built += len(views)
+            logger.info(f"Built {built} views")
+    log_savings(view_tokens, raw_tokens)
+    return built
+
+
+def log_savings(view_tokens: int, raw_tokens: int, estimated: bool = False):
+    if raw_tokens:
+        about = "about " if estimated else ""
+        logger.info(
+            f"LLM views: {about}{view_tokens} tokens against {raw_tokens} in the "
+            f"raw documents ({1 - view_tokens / raw_tokens:.0%} fewer)"
+        )
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Build compact LLM views of grants")
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        help="Build views for grants ingested without one",
+    )
+    parser.add_argument("--batch_size", type=int, default=BACKFILL_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.backfill:
+        backfill(batch_size=args.batch_size)
+    else:
+        parser.print_help()
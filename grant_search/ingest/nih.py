@@ -1,60 +1,349 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import json
+from queue import Full, Queue
+import threading
 import time
-from typing import Generator
+from typing import Callable, Generator, Optional
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+from grant_search.ingest.records import ParsedGrant
 
 logger = logging.getLogger(__name__)
 API_URL = "https://api.reporter.nih.gov/v2/projects/search"
 
-INTERVAL_DAYS = 14
+PAGE_SIZE = 500
+# RePORTER rejects offsets past this, so a search can return at most this many
+MAX_RESULTS = 15000
 
+# Number of date windows fetched at once
+DEFAULT_WORKERS = 4
+# RePORTER asks clients to stay at or below one request per second
+DEFAULT_REQUESTS_PER_SECOND = 1.0
 
-def _get_nih_grants_from(
-    start_date: datetime, end_date: datetime
-) -> Generator[dict, None, None]:
-    request = {
-        "criteria": {
-            "project_start_date": {
-                "from_date": start_date.strftime("%Y-%m-%d"),
-                "to_date": end_date.strftime("%Y-%m-%d"),
+# How long producers wait on a full queue before checking for cancellation
+_PUT_TIMEOUT = 1.0
+_DONE = object()
+
+# Inclusive (first day, last day) range of project start dates
+Window = tuple[datetime, datetime]
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def parse_nih_project(data: dict) -> ParsedGrant:
+    """A grant from a RePORTER API project."""
+    investigators = data["principal_investigators"]
+    if type(investigators) != list:
+        investigators = [investigators]
+    investigators = [x["first_name"] + " " + x["last_name"] for x in investigators]
+    organization = data.get("organization") or {}
+    return ParsedGrant(
+        award_id=str(data["appl_id"]),
+        title=data["project_title"],
+        start_date=datetime.strptime(data["project_start_date"], DATE_FORMAT),
+        end_date=datetime.strptime(data["project_end_date"], DATE_FORMAT),
+        amount=float(data["award_amount"] or 0.0),
+        description=data["abstract_text"],
+        investigators=investigators,
+        raw_text=json.dumps(data).encode(),
+        institution=organization.get("org_name"),
+    )
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, bursting to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def make_http_session(pool_size: int) -> requests.Session:
+    """A pooled session that retries transient errors with backoff."""
+    session = requests.Session()
+    retry = Retry(
+        total=5,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["POST"],
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class _WindowDone:
+    """Queue marker sent after the last record of a window."""
+
+    def __init__(self, window: Window):
+        self.window = window
+
+
+def remaining_windows(
+    start_date: datetime, end_date: datetime, completed: list[Window]
+) -> list[Window]:
+    """
+    Returns the parts of [start_date, end_date] (inclusive days) that are not
+    covered by any of the completed windows.
+    """
+    remaining = []
+    cursor = start_date
+    for done_start, done_end in sorted(completed):
+        if done_end < cursor:
+            continue
+        if done_start > end_date:
+            break
+        if done_start > cursor:
+            remaining.append((cursor, done_start - timedelta(days=1)))
+        cursor = max(cursor, done_end + timedelta(days=1))
+    if cursor <= end_date:
+        remaining.append((cursor, end_date))
+    return remaining
+
+
+def split_window(window: Window, parts: int = 2) -> list[Window]:
+    """`window` cut into `parts` windows of (nearly) equal days, at most one a day."""
+    start_date, end_date = window
+    days = (end_date - start_date).days + 1
+    parts = max(1, min(parts, days))
+    return [
+        (
+            start_date + timedelta(days=days * i // parts),
+            start_date + timedelta(days=days * (i + 1) // parts - 1),
+        )
+        for i in range(parts)
+    ]
+
+
+def _start_day(project: dict) -> Optional[datetime]:
+    if not project.get("project_start_date"):
+        return None
+    start = datetime.strptime(project["project_start_date"], DATE_FORMAT)
+    return datetime(start.year, start.month, start.day)
+
+
+class NIHFetcher:
+    """
+    Fetches a year of RePORTER projects, several date windows at a time.
+
+    Windows are fetched on a thread pool sharing one pooled HTTP session, and
+    every page request takes a token from a shared bucket so the combined
+    request rate stays at `requests_per_second`. Records are handed back
+    through a bounded queue, so the consumer sees a plain generator.
+
+    RePORTER stops paging at MAX_RESULTS, so windows start as wide as
+    possible (the whole part of the year still to fetch) and are split by the
+    total their first page reports: into enough windows to keep each under
+    MAX_RESULTS, and for the starting windows into up to `workers` of them so
+    every worker has one. Pages are sorted by start date, so a first page
+    already holds every project starting before the last start date on it:
+    those days are kept as a finished window, and only the rest is split.
+    Windows are sized by count rather than by calendar, so quiet periods end
+    up in a single wide window instead of many sparse ones.
+    """
+
+    def __init__(
+        self,
+        api_url: str = API_URL,
+        workers: int = DEFAULT_WORKERS,
+        requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+        limiter: Optional[TokenBucket] = None,
+    ):
+        self.api_url = api_url
+        self.workers = max(1, workers)
+        # Fetchers given the same limiter share one request budget
+        self.limiter = limiter or TokenBucket(requests_per_second)
+        self.session = make_http_session(self.workers)
+
+    def _fetch_page(
+        self, window: Window, offset: int, search_id: Optional[str]
+    ) -> dict:
+        start_date, end_date = window
+        request = {
+            "criteria": {
+                "project_start_date": {
+                    "from_date": start_date.strftime("%Y-%m-%d"),
+                    "to_date": end_date.strftime("%Y-%m-%d"),
+                },
             },
-        },
-        "limit": 500,
-    }
-    start_index = 0
-    search_id = None
-    while True:
-        request["offset"] = start_index
-        response = requests.post(API_URL, json=request)
-        time.sleep(1)
-        content = response.json()
-        for grant in content["results"]:
-            # logger.info(f"NIH grant: {grant['project_title']} {grant['appl_id']}")
-            # print(json.dumps(grant, indent=2))
-            yield grant
-
-        if search_id is None:
-            search_id = content["meta"]["search_id"]
+            "offset": offset,
+            "limit": PAGE_SIZE,
+            "sort_field": "project_start_date",
+            "sort_order": "asc",
+        }
+        if search_id is not None:
             request["searchId"] = search_id
+        self.limiter.acquire()
+        response = self.session.post(self.api_url, json=request)
+        response.raise_for_status()
+        return response.json()
 
-        start_index += len(content["results"])
-        # print(f"meta: {content['meta']}")
-        if start_index >= content["meta"]["total"]:
-            print(f"Reached total count {content['meta']['total']}")
-            break
+    def _split(self, window: Window, content: dict, parts: int, put, submit):
+        """
+        Splits `window` after its first page, keeping the days that page
+        covers in full as a finished window.
+        """
+        days = [_start_day(grant) for grant in content["results"]]
+        if days and None not in days and days[-1] > window[0]:
+            # Sorted by start date, so no other project starts before the last
+            # day on the page
+            for grant, day in zip(content["results"], days):
+                if day < days[-1] and not put(grant):
+                    return
+            put(_WindowDone((window[0], days[-1] - timedelta(days=1))))
+            window = (days[-1], window[1])
+        for part in split_window(window, parts):
+            submit(part)
 
+    def _fetch_window(self, window: Window, put, submit, fan_out: int = 1):
+        content = self._fetch_page(window, 0, None)
+        total = content["meta"]["total"]
+        parts = max(-(-total // MAX_RESULTS), min(fan_out, -(-total // PAGE_SIZE)))
+        if parts > 1 and window[1] > window[0]:
+            logger.info(f"Splitting window {window} with {total} results")
+            self._split(window, content, parts, put, submit)
+            return
+        if total > MAX_RESULTS:
+            logger.warning(
+                f"Window {window} has {total} results, only {MAX_RESULTS} are reachable"
+            )
 
-def get_nih_grants_by_year(year: str) -> Generator[dict, None, None]:
-    start_date = datetime(int(year), 1, 1)
-    end_date = datetime(int(year), 12, 31)
-    while start_date < end_date:
-        next_date = start_date + timedelta(days=INTERVAL_DAYS)
+        search_id = content["meta"]["search_id"]
+        offset = 0
+        while True:
+            for grant in content["results"]:
+                if not put(grant):
+                    return
+            offset += len(content["results"])
+            if offset >= min(total, MAX_RESULTS) or not content["results"]:
+                break
+            content = self._fetch_page(window, offset, search_id)
+        logger.info(f"Fetched {offset} grants for window {window}")
+        put(_WindowDone(window))
 
-        for grant in _get_nih_grants_from(start_date, min(next_date, end_date)):
-            yield grant
-        start_date = next_date
+    def fetch_year(
+        self,
+        year: str,
+        completed: Optional[list[Window]] = None,
+        on_window_done: Optional[Callable[[Window], None]] = None,
+    ) -> Generator[dict, None, None]:
+        """
+        Yields every project starting in `year`, skipping the windows listed
+        in `completed`.
+
+        `on_window_done` is called from the consuming thread once all of a
+        window's records have been yielded, which makes it a safe point to
+        checkpoint.
+        """
+        windows = remaining_windows(
+            datetime(int(year), 1, 1), datetime(int(year), 12, 31), completed or []
+        )
+        if not windows:
+            return
+        results = Queue(maxsize=PAGE_SIZE * self.workers)
+        stop = threading.Event()
+        outstanding = 0
+        outstanding_lock = threading.Lock()
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=_PUT_TIMEOUT)
+                    return True
+                except Full:
+                    continue
+            return False
+
+        def submit(window: Window, fan_out: int = 1):
+            nonlocal outstanding
+            with outstanding_lock:
+                outstanding += 1
+            executor.submit(fetch_window, window, fan_out)
+
+        def finish():
+            nonlocal outstanding
+            with outstanding_lock:
+                outstanding -= 1
+                if outstanding == 0:
+                    put(_DONE)
+
+        def fetch_window(window: Window, fan_out: int):
+            try:
+                self._fetch_window(window, put, submit, fan_out)
+            except Exception as e:
+                put(e)
+            finally:
+                finish()
+
+        # Hold one count until every initial window is submitted so an early
+        # finisher can't see zero outstanding
+        outstanding = 1
+        # The starting windows are split across the workers from the outset
+        fan_out = -(-self.workers // len(windows))
+        for window in windows:
+            submit(window, fan_out)
+        finish()
+        try:
+            while True:
+                item = results.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                if isinstance(item, _WindowDone):
+                    if on_window_done:
+                        on_window_done(item.window)
+                    continue
+                yield item
+        finally:
+            # Unblock producers if the consumer stopped early
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_nih_grants_by_year(
+    year: str,
+    workers: int = DEFAULT_WORKERS,
+    requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+    api_url: str = API_URL,
+    completed: Optional[list[Window]] = None,
+    on_window_done: Optional[Callable[[Window], None]] = None,
+    limiter: Optional[TokenBucket] = None,
+) -> Generator[dict, None, None]:
+    fetcher = NIHFetcher(
+        api_url=api_url,
+        workers=workers,
+        requests_per_second=requests_per_second,
+        limiter=limiter,
+    )
+    return fetcher.fetch_year(year, completed=completed, on_window_done=on_window_done)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,215 @@
+from datetime import datetime
+from typing import BinaryIO, Optional
+import xml.etree.ElementTree as ET
+
+from grant_search.ingest.records import ParsedGrant
+
+# Direct children of <Award> that make up a grant
+AWARD_FIELDS = {
+    "AwardID",
+    "AwardTitle",
+    "AwardEffectiveDate",
+    "AwardExpirationDate",
+    "AwardAmount",
+    "AbstractNarration",
+}
+INVESTIGATOR_NAME = "PI_FULL_NAME"
+# Elements whose children are still needed when they end
+READ_WHOLE = AWARD_FIELDS | {INVESTIGATOR_NAME, "Institution"}
+
+# Read size used when parsing archive members.
+CHUNK_SIZE = 1024 * 1024
+
+
+def xml_string_to_dict(xml_string: str):
+    tree = ET.fromstring(xml_string)
+    return _xml_to_dict(tree)
+
+
+def _xml_to_dict(element):
+    result = {}
+    # Add element attributes if any exist
+    if element.attrib:
+        result.update(element.attrib)
+
+    # Handle child elements
+    for child in element:
+        child_dict = _xml_to_dict(child)
+        child_tag = child.tag
+
+        if child_tag in result:
+            # If key exists, convert to list if not already
+            if not isinstance(result[child_tag], list):
+                result[child_tag] = [result[child_tag]]
+            result[child_tag].append(child_dict)
+        else:
+            result[child_tag] = child_dict
+
+    # Handle element text
+    if element.text and element.text.strip():
+        if result:  # If we have child elements/attributes
+            result["text"] = element.text.strip()
+        else:
+            result = element.text.strip()
+
+    return result
+
+
+def parse_nsf_award(data: dict, raw: bytes) -> ParsedGrant:
+    award = data["Award"]
+    award_id = award["AwardID"]
+    title = award["AwardTitle"]
+    start_date = datetime.strptime(award["AwardEffectiveDate"], "%m/%d/%Y")
+    end_date = datetime.strptime(award["AwardExpirationDate"], "%m/%d/%Y")
+    amount = award["AwardAmount"]
+    description = award["AbstractNarration"]
+    if description is None or len(description) == 0:
+        description = "No description provided"
+    investigators = award["Investigator"]
+    if type(investigators) != list:
+        investigators = [investigators]
+    investigators = [x["PI_FULL_NAME"] for x in investigators]
+    institution = award.get("Institution")
+    if isinstance(institution, list):
+        institution = institution[0]
+    return ParsedGrant(
+        award_id=award_id,
+        title=title,
+        start_date=start_date,
+        end_date=end_date,
+        amount=float(amount),
+        description=description,
+        investigators=investigators,
+        raw_text=raw,
+        institution=(
+            institution.get("Name") or None if isinstance(institution, dict) else None
+        ),
+    )
+
+
+def _leaf_value(element):
+    # Mirrors _xml_to_dict for the elements we read
+    if len(element) or element.attrib:
+        return _xml_to_dict(element)
+    text = element.text.strip() if element.text else ""
+    return text if text else {}
+
+
+class NSFAwardExtractor:
+    """
+    Incremental, schema-driven reader for a single NSF award document.
+
+    Feeds bytes to an XMLPullParser (the non-blocking form of iterparse) and
+    keeps only the fields that make up a grant. Every element is cleared as
+    soon as it ends, unless it sits inside an element that is read whole
+    once it ends, which clears it then. Produces the same grant as
+    parse_nsf_award(xml_string_to_dict(...)) with an empty raw_text; missing
+    fields raise KeyError like the dict lookups do.
+    """
+
+    def __init__(self):
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        # Open elements that are read whole, innermost last
+        self._reading = []
+        self._fields = {}
+        self._investigators = []
+        self._investigator_name = None
+        self._institution = None
+        self._institution_read = False
+
+    def feed(self, data: bytes):
+        self._parser.feed(data)
+        self._read_events()
+
+    def close(self) -> ParsedGrant:
+        self._parser.close()
+        self._read_events()
+        return self._grant()
+
+    def _read_events(self):
+        # These tags only occur at one place in the NSF award schema, so
+        # matching on the tag alone is enough to place an element
+        fields = self._fields
+        reading = self._reading
+        for event, element in self._parser.read_events():
+            tag = element.tag
+            if event == "start":
+                if tag in READ_WHOLE:
+                    reading.append(element)
+                continue
+            if reading and reading[-1] is element:
+                reading.pop()
+            if tag in AWARD_FIELDS:
+                if tag not in fields:
+                    fields[tag] = _leaf_value(element)
+            elif tag == INVESTIGATOR_NAME:
+                if self._investigator_name is None:
+                    self._investigator_name = _leaf_value(element)
+            elif tag == "Investigator":
+                if self._investigator_name is None:
+                    raise KeyError(INVESTIGATOR_NAME)
+                self._investigators.append(self._investigator_name)
+                self._investigator_name = None
+            elif tag == "Institution":
+                if not self._institution_read:
+                    self._institution_read = True
+                    name = element.find("Name")
+                    if name is not None:
+                        self._institution = _leaf_value(name) or None
+            if not reading:
+                element.clear()
+
+    def _grant(self) -> ParsedGrant:
+        fields = self._fields
+        if not self._investigators:
+            raise KeyError("Investigator")
+        description = fields["AbstractNarration"]
+        if description is None or len(description) == 0:
+            description = "No description provided"
+        return ParsedGrant(
+            award_id=fields["AwardID"],
+            title=fields["AwardTitle"],
+            start_date=datetime.strptime(fields["AwardEffectiveDate"], "%m/%d/%Y"),
+            end_date=datetime.strptime(fields["AwardExpirationDate"], "%m/%d/%Y"),
+            amount=float(fields["AwardAmount"]),
+            description=description,
+            investigators=self._investigators,
+            raw_text=b"",
+            institution=self._institution,
+        )
+
+
+def extract_nsf_award(content: bytes) -> ParsedGrant:
+    extractor = NSFAwardExtractor()
+    extractor.feed(content)
+    return extractor.close()
+
+
+def extract_nsf_award_stream(stream: BinaryIO) -> ParsedGrant:
+    """Extracts an award chunk by chunk, keeping the bytes read as raw_text."""
+    extractor = NSFAwardExtractor()
+    chunks = []
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        extractor.feed(chunk)
+        chunks.append(chunk)
+    return extractor.close()._replace(raw_text=b"".join(chunks))
+
+
+def parse_nsf_members(members: list[tuple[str, bytes]]) -> list[Optional[ParsedGrant]]:
+    """
+    Process pool entry point: parses a chunk of (file name, XML content) members.
+
+    The returned grants have an empty raw_text since the caller still holds
+    the member content, which keeps the results cheap to send back. Members
+    that fail to parse come back as None.
+    """
+    results = []
+    for file_name, content in members:
+        try:
+            results.append(extract_nsf_award(content))
+        except Exception:
+            results.append(None)
+    return results
@@ -0,0 +1,227 @@
+"""
+Ingests many data sources side by side from a manifest.
+
+    python -m grant_search.ingest.orchestrate manifest.json --parallelism 4
+
+The manifest is a JSON list of sources, or an object with "sources" and
+optional "defaults" applied to every source. Keys match the options of
+grant_search.ingest.cli:
+
+    {
+        "defaults": {"mode": "delta", "quiet": true, "batch_size": 1000},
+        "sources": [
+            {"source_name": "NSF 2023", "agency": "NSF", "input_url": "...",
+             "stream": true},
+            {"source_name": "NIH 2023", "agency": "NIH", "workers": 4}
+        ]
+    }
+
+Every ingest runs on its own thread in this process, so they share one
+GranteeResolver (each grantee is loaded once and created once), the
+engine's connection pool, and one RePORTER rate limit.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import logging
+import threading
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARALLELISM = 4
+PROGRESS_INTERVAL = 10.0
+
+# Each ingest holds a writer connection and a session, and briefly a third
+# connection for grantees, out of the engine's pool of 12 + 20 overflow.
+MAX_PARALLELISM = 10
+
+# Manifest keys that are named differently on Ingester
+MANIFEST_KEYS = {"input_url": "source", "abstracts_url": "abstracts_source"}
+
+
+def load_manifest(path: str) -> list[dict]:
+    with open(path, "rt") as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {"sources": manifest}
+    defaults = manifest.get("defaults", {})
+    sources = [{**defaults, **source} for source in manifest["sources"]]
+    for source in sources:
+        for key in ["source_name", "agency"]:
+            if key not in source:
+                raise Exception(f"Manifest source is missing {key}: {source}")
+    names = [source["source_name"] for source in sources]
+    if len(set(names)) != len(names):
+        raise Exception("Manifest source names must be unique")
+    return sources
+
+
+def _ensure_agencies(names: set[str]):
+    """
+    Creates missing agencies up front so concurrent ingests don't race to
+    create the same one.
+    """
+    from grant_search.db.database import Session
+    from grant_search.db.models import Agency
+
+    with Session() as session:
+        for name in sorted(names):
+            if not session.query(Agency).filter(Agency.name == name).first():
+                logger.warning(f"Creating agency: {name}")
+                session.add(Agency(name=name))
+        session.commit()
+
+
+class Orchestrator:
+    """Runs Ingesters for a list of sources, `parallelism` at a time."""
+
+    def __init__(
+        self,
+        sources: list[dict],
+        parallelism: int = DEFAULT_PARALLELISM,
+        requests_per_second: Optional[float] = None,
+    ):
+        # Load after setting up API key
+        from grant_search.ingest.grantees import GranteeResolver
+        from grant_search.ingest.ingest import Ingester
+        from grant_search.ingest.nih import DEFAULT_REQUESTS_PER_SECOND, TokenBucket
+
+        self.sources = sources
+        self.parallelism = max(1, min(parallelism, MAX_PARALLELISM))
+        if self.parallelism != parallelism:
+            logger.warning(
+                f"Limiting parallelism to {self.parallelism} to fit the DB pool"
+            )
+        self.grantees = GranteeResolver()
+        self.nih_limiter = TokenBucket(
+            requests_per_second or DEFAULT_REQUESTS_PER_SECOND
+        )
+        self.ingester_class = Ingester
+        self.ingesters = {}
+        self.finished: dict[str, float] = {}
+        self.failed: dict[str, Exception] = {}
+        self._done = threading.Event()
+        self._started = time.monotonic()
+
+    def _ingester(self, source: dict):
+        options = {
+            MANIFEST_KEYS.get(key, key): value
+            for key, value in source.items()
+            if key not in ["source_name", "agency", "input_url"]
+        }
+        return self.ingester_class(
+            source["source_name"],
+            source.get("input_url"),
+            source["agency"],
+            grantees=self.grantees,
+            nih_limiter=self.nih_limiter,
+            **options,
+        )
+
+    def _run(self, source: dict):
+        name = source["source_name"]
+        ingester = self._ingester(source)
+        self.ingesters[name] = ingester
+        started = time.monotonic()
+        logger.info(f"Starting ingest of {name}")
+        ingester.ingest()
+        return time.monotonic() - started
+
+    def _totals(self) -> tuple[int, int]:
+        grants = 0
+        for ingester in list(self.ingesters.values()):
+            writer = getattr(ingester, "writer", None)
+            if writer is not None:
+                # Swap-mode writers count staged rows until the swap
+                grants += max(
+                    writer.written + writer.updated + writer.skipped,
+                    getattr(writer, "staged", 0),
+                )
+        return grants, self.grantees.created
+
+    def log_progress(self):
+        elapsed = time.monotonic() - self._started
+        grants, grantees = self._totals()
+        running = len(self.ingesters) - len(self.finished) - len(self.failed)
+        queued = len(self.sources) - len(self.ingesters)
+        logger.info(
+            f"Progress after {elapsed:.0f}s: {len(self.finished)} done, "
+            f"{running} running, {queued} queued, {len(self.failed)} failed; "
+            f"{grants} grants ({grants / elapsed if elapsed else 0:.1f} grants/sec), "
+            f"{grantees} grantees created, {len(self.grantees.ids)} cached"
+        )
+
+    def _report_progress(self):
+        while not self._done.wait(PROGRESS_INTERVAL):
+            self.log_progress()
+
+    def run(self) -> bool:
+        """Ingests every source, returning whether all of them succeeded."""
+        _ensure_agencies({source["agency"] for source in self.sources})
+        reporter = threading.Thread(target=self._report_progress, daemon=True)
+        reporter.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+                futures = {
+                    executor.submit(self._run, source): source["source_name"]
+                    for source in self.sources
+                }
+                for future in as_completed(futures):
+                    name = futures[future]
+                    try:
+                        self.finished[name] = future.result()
+                        logger.info(
+                            f"Finished {name} in {self.finished[name]:.1f}s"
+                        )
+                    except Exception as e:
+                        # One bad source shouldn't stop the others
+                        logger.exception(f"Ingest of {name} failed: {e}")
+                        self.failed[name] = e
+        finally:
+            self._done.set()
+            reporter.join()
+
+        self.log_progress()
+        serial = sum(self.finished.values())
+        elapsed = time.monotonic() - self._started
+        logger.info(
+            f"Ingested {len(self.finished)} sources in {elapsed:.1f}s "
+            f"({serial:.1f}s if run one at a time, {serial / elapsed:.1f}x)"
+        )
+        for name, error in self.failed.items():
+            logger.error(f"Failed: {name}: {error}")
+        return not self.failed
+
+
+if __name__ == "__main__":
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(
+        description="Ingest several data sources concurrently from a manifest"
+    )
+    parser.add_argument("manifest", help="JSON list of sources to ingest")
+    parser.add_argument(
+        "--parallelism",
+        type=int,
+        default=DEFAULT_PARALLELISM,
+        help="Number of sources ingested at once",
+    )
+    parser.add_argument(
+        "--requests_per_second",
+        type=float,
+        help="Request rate shared by all NIH API sources",
+    )
+    args = parser.parse_args()
+
+    orchestrator = Orchestrator(
+        load_manifest(args.manifest),
+        parallelism=args.parallelism,
+        requests_per_second=args.requests_per_second,
+    )
+    if not orchestrator.run():
+        raise SystemExit(1)
@@ -0,0 +1,93 @@
+"""
+Several grants per GrantAnalysis request.
+
+Packing sends up to `pack_size` grants in one completion, each under a
+`### Grant <id>` header, and asks for a list of analyses keyed by grant id.
+The system prompt, the schema and the round trip are then paid once per
+pack rather than once per grant. Packs also stop short of PACK_TOKEN_BUDGET
+input tokens. Grants the model leaves out, or answers under the wrong id,
+are analyzed again on their own by the caller.
+"""
+
+from typing import Generic, List, TypeVar
+
+from pydantic import BaseModel, Field
+
+from grant_search.ingest.llm_view import count_tokens
+from grant_search.ingest.send_to_ai import SYSTEM_PROMPT, GrantAnalysis
+
+DEFAULT_PACK_SIZE = 8
+# Input tokens per pack, leaving room for the prompt and schema
+PACK_TOKEN_BUDGET = 8000
+# Completion tokens allowed per grant in a pack
+COMPLETION_TOKENS_PER_GRANT = 300
+
+PACKED_SYSTEM_PROMPT = SYSTEM_PROMPT + """
+The message holds several grants, each starting with a `### Grant <id>` line.
+Answer for every grant, one analysis each, with the grant's id as grant_id.
+"""
+
+T = TypeVar("T")
+
+
+class PackedGrantAnalysis(GrantAnalysis):
+    grant_id: int = Field(description="The id from the grant's `### Grant` line.")
+
+
+class PackedGrantAnalyses(BaseModel):
+    analyses: List[PackedGrantAnalysis] = Field(
+        description="One analysis for each grant in the message."
+    )
+
+
+class GrantPacker(Generic[T]):
+    """
+    Groups items into packs of at most `size` items and `token_budget` tokens
+    of text. A single grant over the budget still gets a pack of its own.
+    """
+
+    def __init__(self, size: int = DEFAULT_PACK_SIZE, token_budget=PACK_TOKEN_BUDGET):
+        self.size = max(1, size)
+        self.token_budget = token_budget
+        self._pack: list[T] = []
+        self._tokens = 0
+
+    def add(self, item: T, text: str) -> list[list[T]]:
+        """Adds an item, returning any packs that are now full."""
+        if self.size == 1:
+            return [[item]]
+        tokens = count_tokens(text)
+        ready = []
+        if self._pack and self._tokens + tokens > self.token_budget:
+            ready.append(self.flush())
+        self._pack.append(item)
+        self._tokens += tokens
+        if len(self._pack) >= self.size:
+            ready.append(self.flush())
+        return ready
+
+    def flush(self) -> list[T]:
+        pack, self._pack, self._tokens = self._pack, [], 0
+        return pack
+
+
+def packed_text(grants: list[tuple[int, str]]) -> str:
+    return "\n\n".join(f"### Grant {grant_id}\n{text}" for grant_id, text in grants)
+
+
+def packed_max_tokens(count: int) -> int:
+    return COMPLETION_TOKENS_PER_GRANT * count + 100
+
+
+def unpack(
+    result: PackedGrantAnalyses, grant_ids: list[int]
+) -> dict[int, GrantAnalysis]:
+    """The analyses of a pack by grant id, ignoring ids that weren't sent."""
+    wanted = set(grant_ids)
+    found = {}
+    for entry in result.analyses:
+        if entry.grant_id in wanted and entry.grant_id not in found:
+            found[entry.grant_id] = GrantAnalysis.model_validate(
+                entry.model_dump(exclude={"grant_id"})
+            )
+    return found
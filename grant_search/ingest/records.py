@@ -0,0 +1,23 @@
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+
+class ParsedGrant(NamedTuple):
+    """
+    A grant as extracted from a source document, before it is written.
+
+    Kept free of ORM state so parsers can build it anywhere (including in
+    worker processes) and the writer can insert it in bulk.
+    """
+
+    award_id: str
+    title: str
+    start_date: datetime
+    end_date: datetime
+    amount: float
+    description: str
+    investigators: list[str]
+    raw_text: bytes
+    institution: Optional[str] = None
+    # Built by the writer, see grant_search.ingest.llm_view
+    llm_view: Optional[str] = None
@@ -18,11 +18,44 @@ if __name__ == "__main__":
     parser.add_argument(
         "--partial", action="store_true", help="Only refresh partial data"
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="Completions in flight at once (default: AI_CONCURRENCY or 64)",
+    )
+    parser.add_argument(
+        "--pack_size",
+        type=int,
+        default=1,
+        help="Grants sent in each completion request (default: 1)",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Analyze every grant again instead of reusing cached results",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Submit through the Batch API and wait for the results",
+    )
 
     args = parser.parse_args()
 
-    send_to_ai = SendToAI()
+    if args.batch:
+        from grant_search.ingest.batch_analysis import BatchAnalysis
+
+        BatchAnalysis(use_cache=not args.no_cache).run(
+            all_grants=not args.partial, wait=True
+        )
+        raise SystemExit(0)
+
+    send_to_ai = SendToAI(
+        concurrency=args.concurrency,
+        use_cache=not args.no_cache,
+        pack_size=args.pack_size,
+    )
     if args.partial:
         send_to_ai.complete_partial_grants()
     else:
-        send_to_ai.process_all_grants()
+        send_to_ai.complete_all_grants()
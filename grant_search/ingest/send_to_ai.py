@@ -1,17 +1,15 @@
 import os
-from typing import List, Optional
+from typing import Iterable, List, Optional
 from instructor import Instructor, from_openai
 from openai import OpenAI
-from concurrent.futures import ThreadPoolExecutor
 import logging
 from pydantic import BaseModel, Field
 import traceback
 
-from sqlalchemy.orm import undefer
-
 from grant_search.ai.common import format_for_llm, get_ai_client
-from grant_search.db.database import Session
-from grant_search.db.models import DEIStatus, Grant, GrantDerivedData
+from grant_search.ai.rate_limit import get_rate_limiter
+from grant_search.ai.telemetry import telemetry_run
+from grant_search.db.models import DEIStatus, Grant
 
 logger = logging.getLogger(__name__)
 
@@ -67,87 +65,100 @@ MODEL = "gpt-4o"
 SYSTEM_PROMPT = """
 Process the grant description below to answer the questions in the model.
 """
-MAX_WORKERS = 4
+
+
+def grant_text(grant: Grant) -> str:
+    """The compact LLM view, or the raw document of grants without one."""
+    if grant.llm_view:
+        return grant.llm_view
+    if isinstance(grant.raw_text, bytes):
+        return grant.raw_text.decode("utf-8")
+    return grant.raw_text
 
 
 class SendToAI:
     client: Instructor
+    concurrency: Optional[int]
+    pack_size: int
+
+    def __init__(
+        self,
+        concurrency: Optional[int] = None,
+        use_cache: bool = True,
+        pack_size: int = 1,
+    ):
+        from grant_search.ingest.analysis_cache import AnalysisCache
 
-    def __init__(self):
         self.client = get_ai_client()
+        # None uses the engine's default (AI_CONCURRENCY)
+        self.concurrency = concurrency
+        # Grants per request; see grant_search.ingest.packing
+        self.pack_size = pack_size
+        self.cache = AnalysisCache() if use_cache else None
 
     def complete_partial_grants(self):
-        with Session() as session:
-            query = (
-                session.query(Grant)
-                .options(undefer(Grant.raw_text))
-                .filter(Grant.derived_data == None)
-                .all()
-            )
-            logger.info(f"Processing {len(query)} partial grants")
-            self.process_grants(query)
+        from grant_search.ingest.candidates import stream_candidates
+
+        logger.info("Processing partial grants")
+        self.process_grant_texts(stream_candidates(partial=True))
 
     def complete_all_grants(self):
-        with Session() as session:
-            query = session.query(Grant).all()
-            logger.info(f"Processing {len(query)} grants")
-            self.process_grants(query)
+        from grant_search.ingest.candidates import stream_candidates
+
+        logger.info("Processing all grants")
+        self.process_grant_texts(stream_candidates(partial=False))
 
     def process_single_grant(self, grant: Grant) -> GrantAnalysis:
+        results = self.analyze_text(grant.id, grant_text(grant))
+        if results is not None:
+            return (grant, results)
+
+    def analyze_text(self, grant_id: int, text: str) -> Optional[GrantAnalysis]:
+        """Analyzes one grant's text, or returns its cached analysis."""
+        from grant_search.ingest.analysis_cache import analysis_key
+
         try:
-            if isinstance(grant.raw_text, bytes):
-                text = grant.raw_text.decode("utf-8")
-            else:
-                text = grant.raw_text
+            key = analysis_key(text)
+            if self.cache is not None:
+                results = self.cache.get(key)
+                if results is not None:
+                    logger.info(f"Using cached analysis for grant: {grant_id}")
+                    return results
             messages = format_for_llm(SYSTEM_PROMPT, text)
-            logger.info(f"Processing grant: {grant.id}")
-            results = self.client.chat.completions.create(
+            logger.info(f"Processing grant: {grant_id}")
+            results = get_rate_limiter().create(
+                self.client,
+                site="analyze_grant",
                 model=MODEL,
                 messages=messages,
                 response_model=GrantAnalysis,
                 max_tokens=1024,
             )
-            return (grant, results)
+            if self.cache is not None:
+                self.cache.put(key, results)
+            return results
         except Exception as e:
             logger.error(f"Stack trace:\n{traceback.format_exc()}")
-            logger.error(f"Error processing grant {grant.id}: {str(e)}")
+            logger.error(f"Error processing grant {grant_id}: {str(e)}")
 
     def process_grants(self, grants: List[Grant]):
-
-        # Use ThreadPoolExecutor to process grants in parallel
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            # Submit all grants for processing
-            futures = [
-                executor.submit(self.process_single_grant, grant) for grant in grants
-            ]
-
-            # Wait for all futures to complete
-            session = Session()
-            for i, future in enumerate(futures):
-                try:
-                    result = future.result()
-                    if result:
-                        grant, analysis = result
-                        # Delete existing derived data if present
-                        existing = (
-                            session.query(GrantDerivedData)
-                            .filter(GrantDerivedData.grant_id == grant.id)
-                            .first()
-                        )
-                        if existing:
-                            session.delete(existing)
-                            session.flush()
-
-                        derived_data = GrantDerivedData(
-                            grant_id=grant.id,
-                            **analysis.model_dump(),
-                        )
-                        session.add(derived_data)
-                        logger.info(f"Saved derived data for grant {grant.id}")
-                        if i % 20 == 0:
-                            session.commit()
-                            session = Session()
-                except Exception as e:
-                    logger.error(f"Stack trace:\n{traceback.format_exc()}")
-                    logger.error(f"Thread execution failed: {str(e)}")
-                session.commit()
+        """
+        Analyzes grants concurrently on the async engine, saving results in
+        batches as they complete.
+        """
+        self.process_grant_texts((grant.id, grant_text(grant)) for grant in grants)
+
+    def process_grant_texts(self, grants: Iterable[tuple[int, str]]) -> int:
+        """
+        Analyzes (grant id, text) pairs on the async engine, reading them only
+        as fast as requests go out. Returns the number of grants handled.
+        """
+        from grant_search.ingest.analysis_engine import AsyncAnalysisEngine
+
+        options = {"cache": self.cache, "pack_size": self.pack_size}
+        if self.concurrency is not None:
+            options["concurrency"] = self.concurrency
+        engine = AsyncAnalysisEngine(**options)
+        with telemetry_run("analysis"):
+            engine.run(grants)
+        return engine.analyzed + engine.failed
@@ -0,0 +1,158 @@
+from contextlib import contextmanager
+import json
+import logging
+import random
+import threading
+import time
+from typing import BinaryIO
+
+logger = logging.getLogger(__name__)
+
+# Durations kept per stage for percentiles; totals are always exact
+MAX_SAMPLES = 10000
+
+# Reporting order for the stages Ingester records
+STAGES = [
+    "download",
+    "decompress",
+    "parse",
+    "grantee_resolution",
+    "llm_view",
+    "db_write",
+    "swap",
+    "ai_handoff",
+]
+
+
+class _Stage:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.samples: list[float] = []
+
+    def record(self, seconds: float):
+        self.calls += 1
+        self.seconds += seconds
+        # Reservoir sampling keeps a uniform sample of every call's duration
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(seconds)
+        else:
+            index = random.randrange(self.calls)
+            if index < MAX_SAMPLES:
+                self.samples[index] = seconds
+
+    def percentile(self, fraction: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class IngestStats:
+    """
+    Per-stage timers and counters for an ingest run.
+
+    Each stage tracks how often it ran, the total and p50/p95 time per call,
+    and the rows and bytes that went through it. Safe to share between
+    threads.
+    """
+
+    def __init__(self):
+        self._stages: dict[str, _Stage] = {}
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+
+    def _stage(self, name: str) -> _Stage:
+        if name not in self._stages:
+            self._stages[name] = _Stage()
+        return self._stages[name]
+
+    @contextmanager
+    def stage(self, name: str, rows: int = 0, bytes: int = 0):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started, rows=rows, bytes=bytes)
+
+    def record(self, name: str, seconds: float, rows: int = 0, bytes: int = 0):
+        with self._lock:
+            stage = self._stage(name)
+            stage.record(seconds)
+            stage.rows += rows
+            stage.bytes += bytes
+
+    def add(self, name: str, rows: int = 0, bytes: int = 0):
+        """Counts rows/bytes against a stage without timing a call."""
+        with self._lock:
+            stage = self._stage(name)
+            stage.rows += rows
+            stage.bytes += bytes
+
+    def summary(self) -> dict:
+        with self._lock:
+            names = [name for name in STAGES if name in self._stages] + sorted(
+                name for name in self._stages if name not in STAGES
+            )
+            stages = {}
+            for name in names:
+                stage = self._stages[name]
+                stages[name] = {
+                    "calls": stage.calls,
+                    "seconds": round(stage.seconds, 3),
+                    "rows": stage.rows,
+                    "bytes": stage.bytes,
+                    "rows_per_sec": (
+                        round(stage.rows / stage.seconds, 1)
+                        if stage.rows and stage.seconds
+                        else None
+                    ),
+                    "p50_ms": round(stage.percentile(0.5) * 1000, 3),
+                    "p95_ms": round(stage.percentile(0.95) * 1000, 3),
+                }
+        return {
+            "wall_seconds": round(time.monotonic() - self._started, 3),
+            "stages": stages,
+        }
+
+    def log_summary(self):
+        summary = self.summary()
+        logger.info(f"Ingest finished in {summary['wall_seconds']:.1f}s")
+        for name, stage in summary["stages"].items():
+            rate = (
+                f"{stage['rows_per_sec']:,.1f} rows/sec"
+                if stage["rows_per_sec"] is not None
+                else "-"
+            )
+            logger.info(
+                f"{name:>18}: {stage['seconds']:8.2f}s {stage['calls']:>8} calls "
+                f"{stage['rows']:>9} rows {stage['bytes'] / 1e6:9.1f}MB {rate:>18} "
+                f"p50 {stage['p50_ms']:.2f}ms p95 {stage['p95_ms']:.2f}ms"
+            )
+
+    def write_json(self, path: str):
+        with open(path, "wt") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+class TimedReader:
+    """
+    Wraps a binary stream and charges the time spent in read() to a stage,
+    e.g. to separate zip decompression from the parser consuming it.
+    """
+
+    def __init__(self, stream: BinaryIO, stats: IngestStats, stage: str):
+        self.stream = stream
+        self.stats = stats
+        self.stage = stage
+        self.seconds = 0.0
+
+    def read(self, size: int = -1) -> bytes:
+        started = time.perf_counter()
+        data = self.stream.read(size)
+        elapsed = time.perf_counter() - started
+        self.seconds += elapsed
+        self.stats.add(self.stage, bytes=len(data))
+        return data
@@ -1,3 +1,4 @@
+import argparse
 from queue import Queue
 from threading import Thread
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -8,8 +9,9 @@ import traceback
 import dotenv
 from pydantic import BaseModel, Field
 
-from grant_search.db.database import get_session
-from grant_search.db.models import Grant, GrantDerivedData
+from grant_search.ai import telemetry
+from grant_search.ingest.candidates import stream_candidates
+from grant_search.ingest.derived_writer import DerivedDataWriter
 from grant_search.ingest.send_to_ai import SendToAI
 
 MAX_CONCURRENT_GRANTS = 100
@@ -26,32 +28,15 @@ logger = logging.getLogger(__name__)
 ai_processor = SendToAI()
 
 
-# Update this function to check if the grant needs to be updated
-def needs_update(grant: Grant):
-    return grant.derived_data is None or grant.derived_data.summary is None
-
-
-def process_grant(grant_id: int):
-    with get_session() as process_session:
-        grant = process_session.get(Grant, grant_id)
-        _, analysis = ai_processor.process_single_grant(grant)
-        derived_data = grant.derived_data
-        if derived_data is None:
-            logger.info(f"Creating derived data for grant {grant.id}")
-            derived_data = GrantDerivedData(
-                grant_id=grant.id,
-                **analysis.model_dump(),
-            )
-            process_session.add(derived_data)
-        else:
-            for field, value in analysis.model_dump().items():
-                setattr(derived_data, field, value)
-
-        process_session.commit()
+def process_grant(grant_id: int, text: str, writer: DerivedDataWriter):
+    analysis = ai_processor.analyze_text(grant_id, text)
+    if analysis is None:
+        raise Exception(f"No analysis for grant {grant_id}")
+    writer.put(grant_id, analysis)
     return grant_id
 
 
-def process_grant_queue(grant_queue: Queue):
+def process_grant_queue(grant_queue: Queue, writer: DerivedDataWriter):
     executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_GRANTS)
     futures = []
     completed = 0
@@ -67,17 +52,20 @@ def process_grant_queue(grant_queue: Queue):
             logger.error(f"Future failed with error: {e}")
         completed += 1
         if completed % 100 == 0:
-            logger.info(f"Completed {completed} tasks")
+            logger.info(f"Completed {completed} tasks, {ai_processor.cache.summary()}")
 
     logger.info("Processing grant queue thread started")
     while True:
         try:
-            grant_id = grant_queue.get()
-            if grant_id is None:
+            item = grant_queue.get()
+            if item is None:
                 grant_queue.task_done()
                 break
 
-            futures.append(executor.submit(process_grant, grant_id))
+            grant_id, text = item
+            futures.append(
+                executor.submit(telemetry.bind(process_grant), grant_id, text, writer)
+            )
             # Check for completed futures
             if len(futures) >= MAX_CONCURRENT_GRANTS:
                 for completed_future in as_completed(futures):
@@ -94,37 +82,50 @@ def process_grant_queue(grant_queue: Queue):
 
 
 def update_all_grants():
-    session = get_session()
-
-    grants = (
-        session.query(Grant)
-        .join(GrantDerivedData, Grant.id == GrantDerivedData.grant_id, isouter=True)
-        .filter(GrantDerivedData.summary.is_(None))
-        .yield_per(100)
-    )
     grant_queue = Queue(maxsize=400)
+    writer = DerivedDataWriter()
+
+    with telemetry.telemetry_run("update"):
+        # Start worker thread
+        worker = Thread(
+            target=telemetry.bind(process_grant_queue),
+            args=(grant_queue, writer),
+            daemon=True,
+        )
+        worker.start()
+
+        # Waits for room in the queue rather than skipping grants
+        for grant_id, text in stream_candidates(partial=True):
+            grant_queue.put((grant_id, text))
+        grant_queue.put(None)
+        grant_queue.join()
+    writer.close()
+    logger.info(f"Done, {ai_processor.cache.summary()}")
 
-    # Start worker thread
-    worker = Thread(target=process_grant_queue, args=(grant_queue,), daemon=True)
-    worker.start()
 
-    for grant in grants:
-        try:
-            # Add grant to queue if it needs update
-            if needs_update(grant):
-                try:
-                    grant_queue.put(grant.id, block=False)
-                except:
-                    print(f"Queue full, skipping grant {grant.id}")
+if __name__ == "__main__":
+    dotenv.load_dotenv()
 
-        except Exception as e:
-            print(f"Error processing grant {grant.id}: {e}")
-            session.rollback()
-            continue
-    grant_queue.put(None)
-    grant_queue.join()
+    parser = argparse.ArgumentParser(description="Analyze grants missing a summary")
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Submit through the Batch API and wait for the results",
+    )
+    parser.add_argument(
+        "--queue",
+        action="store_true",
+        help="Add the grants to the Redis work queue for queue workers",
+    )
+    args = parser.parse_args()
 
+    if args.batch:
+        from grant_search.ingest.batch_analysis import BatchAnalysis
 
-if __name__ == "__main__":
-    dotenv.load_dotenv()
-    update_all_grants()
+        BatchAnalysis().run(wait=True)
+    elif args.queue:
+        from grant_search.ingest.work_queue import enqueue_candidates, get_work_queue
+
+        enqueue_candidates(get_work_queue())
+    else:
+        update_all_grants()
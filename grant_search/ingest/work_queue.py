@@ -0,0 +1,510 @@
+"""
+Durable queue of grants waiting for derived-data analysis.
+
+Grant ids are added to a Redis stream and read by any number of worker
+processes through one consumer group. A grant is acked (and removed from
+the stream) only once its analysis is written, so a worker that crashes
+loses nothing: its unacked grants are claimed by another worker after
+VISIBILITY_TIMEOUT seconds, while a live worker keeps claiming its batch
+afresh so a slow one isn't taken over. Failed grants are retried with
+exponential backoff through a sorted set, and after MAX_ATTEMPTS go to a
+dead-letter list, from which they can be requeued. A set of the grants on
+the queue keeps a grant from being queued twice.
+
+    python -m grant_search.ingest.work_queue enqueue
+    python -m grant_search.ingest.work_queue work --drain
+    python -m grant_search.ingest.work_queue stats
+    python -m grant_search.ingest.work_queue requeue_dead
+
+Workers use REDISCLOUD_URL; pass --redis_url redis://localhost:6379 to run
+against a local Redis instead.
+"""
+
+import argparse
+from datetime import datetime
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+from typing import Iterable, NamedTuple, Optional
+
+from dotenv import load_dotenv
+import redis
+
+from grant_search.common import get_mode
+
+logger = logging.getLogger(__name__)
+
+QUEUE_NAME = "derived_updates"
+GROUP_NAME = "derived_workers"
+# Deliveries of a grant before it is dead-lettered
+MAX_ATTEMPTS = 5
+# Seconds before the first retry, doubling up to MAX_BACKOFF
+BACKOFF = 5.0
+MAX_BACKOFF = 300.0
+# Seconds a delivered grant may go unacked before another worker claims it
+VISIBILITY_TIMEOUT = 600
+# Grants per worker batch, and the longest a read waits for one
+WORK_BATCH_SIZE = 200
+BLOCK_MS = 5000
+ENQUEUE_BATCH_SIZE = 1000
+
+# Adds each grant id in ARGV to the stream unless it is already queued
+#
+# KEYS: stream, queued set
+_ENQUEUE_SCRIPT = """
+local added = 0
+for _, grant_id in ipairs(ARGV) do
+    if redis.call('SADD', KEYS[2], grant_id) == 1 then
+        redis.call('XADD', KEYS[1], '*', 'data', '{"grant_id": ' .. grant_id .. ', "attempts": 0}')
+        added = added + 1
+    end
+end
+return added
+"""
+
+# Acks a failed message and either schedules its retry or dead-letters it
+_FAIL_SCRIPT = """
+redis.call('XACK', KEYS[1], ARGV[1], ARGV[2])
+redis.call('XDEL', KEYS[1], ARGV[2])
+local delay = tonumber(ARGV[4])
+if delay < 0 then
+    redis.call('LPUSH', KEYS[3], ARGV[3])
+    redis.call('SREM', KEYS[4], ARGV[5])
+else
+    local now_parts = redis.call('TIME')
+    local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+    redis.call('ZADD', KEYS[2], now + delay, ARGV[3])
+end
+return 1
+"""
+
+# Moves retries that are due back onto the stream
+_PROMOTE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local due = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now, 'LIMIT', 0, tonumber(ARGV[1]))
+for _, data in ipairs(due) do
+    redis.call('XADD', KEYS[1], '*', 'data', data)
+    redis.call('ZREM', KEYS[2], data)
+end
+return #due
+"""
+
+
+class WorkItem(NamedTuple):
+    message_id: str
+    grant_id: int
+    # Earlier failed attempts
+    attempts: int
+
+
+class WorkQueue:
+    """A Redis stream of grant ids with a consumer group, retries and a DLQ."""
+
+    def __init__(
+        self,
+        connection: redis.Redis,
+        prefix: str,
+        name: str = QUEUE_NAME,
+        group: str = GROUP_NAME,
+        max_attempts: int = MAX_ATTEMPTS,
+        visibility_timeout: float = VISIBILITY_TIMEOUT,
+    ):
+        self.connection = connection
+        self.stream = f"{prefix}:{name}"
+        self.retries = f"{prefix}:{name}:retry"
+        self.dead = f"{prefix}:{name}:dead"
+        # Grant ids queued, in progress or waiting for a retry
+        self.queued = f"{prefix}:{name}:queued"
+        self.group = group
+        self.max_attempts = max_attempts
+        self.visibility_timeout = visibility_timeout
+        self._enqueue = connection.register_script(_ENQUEUE_SCRIPT)
+        self._fail = connection.register_script(_FAIL_SCRIPT)
+        self._promote = connection.register_script(_PROMOTE_SCRIPT)
+        self._group_ready = False
+
+    def ensure_group(self):
+        if self._group_ready:
+            return
+        try:
+            self.connection.xgroup_create(
+                self.stream, self.group, id="0", mkstream=True
+            )
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._group_ready = True
+
+    def enqueue(self, grant_ids: Iterable[int]) -> int:
+        """
+        Adds grants to the queue, skipping those already on it, and returns
+        how many were added.
+        """
+        self.ensure_group()
+        added = 0
+        batch = []
+        for grant_id in grant_ids:
+            batch.append(int(grant_id))
+            if len(batch) == ENQUEUE_BATCH_SIZE:
+                added += self._enqueue(keys=[self.stream, self.queued], args=batch)
+                batch = []
+        if batch:
+            added += self._enqueue(keys=[self.stream, self.queued], args=batch)
+        return added
+
+    def read(
+        self, consumer: str, count: int = WORK_BATCH_SIZE, block_ms: int = BLOCK_MS
+    ) -> list[WorkItem]:
+        """
+        Up to `count` grants for `consumer`: first any due retries and grants
+        abandoned by other workers, then new ones, waiting up to `block_ms`
+        when there are none.
+        """
+        self.ensure_group()
+        self._promote(keys=[self.stream, self.retries], args=[count])
+        items = self._claim(consumer, count)
+        if len(items) < count:
+            response = self.connection.xreadgroup(
+                self.group,
+                consumer,
+                {self.stream: ">"},
+                count=count - len(items),
+                block=None if items else block_ms,
+            )
+            for _, messages in response or []:
+                items.extend(
+                    _item(message_id, fields) for message_id, fields in messages
+                )
+        return items
+
+    def _claim(self, consumer: str, count: int) -> list[WorkItem]:
+        response = self.connection.xautoclaim(
+            self.stream,
+            self.group,
+            consumer,
+            min_idle_time=int(self.visibility_timeout * 1000),
+            start_id="0-0",
+            count=count,
+        )
+        items = []
+        for message_id, fields in response[1]:
+            if not fields:
+                continue
+            item = _item(message_id, fields)
+            # A grant whose workers keep dying counts those deliveries as
+            # failures, so it can't take down every worker in turn
+            delivered = self.connection.xpending_range(
+                self.stream, self.group, min=message_id, max=message_id, count=1
+            )
+            deliveries = delivered[0]["times_delivered"] if delivered else 1
+            item = item._replace(attempts=max(item.attempts, deliveries - 1))
+            logger.warning(
+                f"Claimed grant {item.grant_id} after {deliveries - 1} abandoned deliveries"
+            )
+            if item.attempts >= self.max_attempts:
+                self.fail(item, "abandoned by its workers", retry=False)
+                continue
+            items.append(item)
+        return items
+
+    def ack(self, items: Iterable[WorkItem]):
+        items = list(items)
+        if not items:
+            return
+        message_ids = [item.message_id for item in items]
+        pipeline = self.connection.pipeline(transaction=True)
+        pipeline.xack(self.stream, self.group, *message_ids)
+        pipeline.xdel(self.stream, *message_ids)
+        pipeline.srem(self.queued, *{item.grant_id for item in items})
+        pipeline.execute()
+
+    def heartbeat(self, consumer: str, items: Iterable[WorkItem]):
+        """
+        Claims `consumer`'s unacked grants afresh, resetting their idle time
+        so no other worker takes them over while they are still being worked.
+        """
+        message_ids = [item.message_id for item in items]
+        if message_ids:
+            self.connection.xclaim(
+                self.stream,
+                self.group,
+                consumer,
+                min_idle_time=0,
+                message_ids=message_ids,
+                justid=True,
+            )
+
+    def fail(self, item: WorkItem, error: str, retry: bool = True):
+        """Schedules a retry of a failed grant, or dead-letters it."""
+        attempts = item.attempts + 1
+        if retry and attempts < self.max_attempts:
+            delay = min(MAX_BACKOFF, BACKOFF * 2 ** (attempts - 1))
+            data = _encode(item.grant_id, attempts)
+            logger.warning(
+                f"Grant {item.grant_id} failed ({error}), retrying in {delay:.0f}s"
+            )
+        else:
+            delay = -1
+            data = json.dumps(
+                {
+                    "grant_id": item.grant_id,
+                    "attempts": attempts,
+                    "error": error,
+                    "failed_at": datetime.utcnow().isoformat(),
+                }
+            )
+            logger.error(
+                f"Grant {item.grant_id} failed {attempts} times ({error}), dead-lettered"
+            )
+        self._fail(
+            keys=[self.stream, self.retries, self.dead, self.queued],
+            args=[self.group, item.message_id, data, delay, item.grant_id],
+        )
+
+    def requeue_dead(self) -> int:
+        """Puts every dead-lettered grant back on the queue."""
+        self.ensure_group()
+        entries = self.connection.lrange(self.dead, 0, -1)
+        if not entries:
+            return 0
+        pipeline = self.connection.pipeline(transaction=True)
+        self._enqueue(
+            keys=[self.stream, self.queued],
+            args=[json.loads(entry)["grant_id"] for entry in entries],
+            client=pipeline,
+        )
+        # Grants dead-lettered meanwhile were pushed on the left, so they stay
+        pipeline.ltrim(self.dead, 0, -len(entries) - 1)
+        pipeline.execute()
+        return len(entries)
+
+    def stats(self) -> dict:
+        self.ensure_group()
+        pipeline = self.connection.pipeline(transaction=False)
+        pipeline.xlen(self.stream)
+        pipeline.xpending(self.stream, self.group)
+        pipeline.zcard(self.retries)
+        pipeline.llen(self.dead)
+        length, pending, retrying, dead = pipeline.execute()
+        return {
+            "queued": length - pending["pending"],
+            "in_progress": pending["pending"],
+            "retrying": retrying,
+            "dead": dead,
+        }
+
+
+def _encode(grant_id: int, attempts: int) -> str:
+    return json.dumps({"grant_id": grant_id, "attempts": attempts})
+
+
+def _item(message_id, fields: dict) -> WorkItem:
+    data = json.loads(fields[b"data"])
+    if isinstance(message_id, bytes):
+        message_id = message_id.decode()
+    return WorkItem(message_id, data["grant_id"], data["attempts"])
+
+
+def get_work_queue(redis_url: Optional[str] = None) -> WorkQueue:
+    """The queue on REDISCLOUD_URL, or on `redis_url` when given."""
+    if redis_url is None:
+        from grant_search.db import redis as redis_db
+
+        return WorkQueue(redis_db.connection, redis_db.INSTANCE_PREFIX)
+    return WorkQueue(redis.from_url(redis_url), f"REDIS_{get_mode()}")
+
+
+def enqueue_candidates(
+    work_queue: WorkQueue,
+    partial: bool = True,
+    data_source_id: Optional[int] = None,
+) -> int:
+    from grant_search.db.database import Session
+    from grant_search.ingest.candidates import select_candidate_ids
+
+    with Session() as session:
+        added = work_queue.enqueue(
+            select_candidate_ids(
+                session, partial=partial, data_source_id=data_source_id
+            )
+        )
+    logger.info(f"Queued {added} grants")
+    return added
+
+
+class QueueWorker:
+    """
+    Analyzes grants from a WorkQueue a batch at a time on the async engine.
+    Each grant is acked as its analysis is written; the rest of the batch is
+    failed for a retry once the engine finishes.
+    """
+
+    def __init__(
+        self,
+        work_queue: WorkQueue,
+        consumer: Optional[str] = None,
+        batch_size: int = WORK_BATCH_SIZE,
+        concurrency: Optional[int] = None,
+        pack_size: int = 1,
+        use_cache: bool = True,
+    ):
+        from grant_search.ingest.analysis_cache import AnalysisCache
+
+        self.work_queue = work_queue
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.pack_size = pack_size
+        self.cache = AnalysisCache() if use_cache else None
+        self.done = 0
+        self.failed = 0
+        self.stopping = threading.Event()
+
+    def run(self, drain: bool = False):
+        """Works until stopped, or with `drain` until the queue is empty."""
+        from grant_search.ai.telemetry import telemetry_run
+
+        logger.info(f"Worker {self.consumer} started")
+        with telemetry_run("queue_worker"):
+            while not self.stopping.is_set():
+                items = self.work_queue.read(self.consumer, self.batch_size)
+                if items:
+                    self.process(items)
+                    continue
+                if drain:
+                    stats = self.work_queue.stats()
+                    if not stats["queued"] and not stats["retrying"]:
+                        break
+        logger.info(
+            f"Worker {self.consumer} stopped: {self.done} done, {self.failed} failed"
+        )
+
+    def stop(self):
+        """Stops after the current batch."""
+        self.stopping.set()
+
+    def process(self, items: list[WorkItem]):
+        from grant_search.db.database import Session
+        from grant_search.ingest.analysis_engine import AsyncAnalysisEngine
+        from grant_search.ingest.candidates import grant_texts
+        from grant_search.ingest.derived_writer import upsert_derived_data
+
+        by_grant: dict[int, list[WorkItem]] = {}
+        for item in items:
+            by_grant.setdefault(item.grant_id, []).append(item)
+        with Session() as session:
+            texts = grant_texts(session, list(by_grant))
+        for grant_id in by_grant.keys() - texts.keys():
+            for item in by_grant.pop(grant_id):
+                self.failed += 1
+                self.work_queue.fail(item, "grant has no text", retry=False)
+
+        written = set()
+        finished = threading.Event()
+
+        def heartbeat():
+            # Well within the visibility timeout, so the batch is never idle
+            # long enough to be claimed by another worker
+            while not finished.wait(self.work_queue.visibility_timeout / 3):
+                try:
+                    self.work_queue.heartbeat(
+                        self.consumer,
+                        [
+                            item
+                            for grant_id, grant_items in list(by_grant.items())
+                            if grant_id not in written
+                            for item in grant_items
+                        ],
+                    )
+                except Exception as e:
+                    logger.warning(f"Heartbeat of {self.consumer} failed: {e}")
+
+        heartbeats = threading.Thread(target=heartbeat, daemon=True)
+        heartbeats.start()
+
+        def write(results):
+            upsert_derived_data(results)
+            grant_ids = [grant_id for grant_id, _ in results]
+            self.work_queue.ack(
+                item for grant_id in grant_ids for item in by_grant[grant_id]
+            )
+            written.update(grant_ids)
+
+        options = {"writer": write, "cache": self.cache, "pack_size": self.pack_size}
+        if self.concurrency is not None:
+            options["concurrency"] = self.concurrency
+        try:
+            AsyncAnalysisEngine(**options).run(
+                (grant_id, texts[grant_id]) for grant_id in by_grant
+            )
+        except Exception as e:
+            # Whatever wasn't written is failed below
+            logger.exception(f"Batch of {len(items)} grants failed: {e}")
+        finally:
+            finished.set()
+            heartbeats.join()
+        for grant_id, grant_items in by_grant.items():
+            if grant_id in written:
+                self.done += len(grant_items)
+                continue
+            for item in grant_items:
+                self.failed += 1
+                self.work_queue.fail(item, "analysis failed")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    parser = argparse.ArgumentParser(description="Queue of grants to analyze")
+    parser.add_argument("command", choices=["enqueue", "work", "stats", "requeue_dead"])
+    parser.add_argument(
+        "--redis_url", help="Redis to use instead of REDISCLOUD_URL, e.g. a local one"
+    )
+    parser.add_argument(
+        "--all", action="store_true", help="Enqueue every grant, not just partial ones"
+    )
+    parser.add_argument("--data_source_id", type=int)
+    parser.add_argument("--batch_size", type=int, default=WORK_BATCH_SIZE)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="Completions in flight at once (default: AI_CONCURRENCY or 64)",
+    )
+    parser.add_argument("--pack_size", type=int, default=1)
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Analyze every grant again instead of reusing cached results",
+    )
+    parser.add_argument(
+        "--drain", action="store_true", help="Exit once the queue is empty"
+    )
+    parser.add_argument("--consumer", help="Consumer name (default: host-pid)")
+    args = parser.parse_args()
+
+    work_queue = get_work_queue(args.redis_url)
+    if args.command == "enqueue":
+        enqueue_candidates(
+            work_queue, partial=not args.all, data_source_id=args.data_source_id
+        )
+    elif args.command == "work":
+        worker = QueueWorker(
+            work_queue,
+            consumer=args.consumer,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            pack_size=args.pack_size,
+            use_cache=not args.no_cache,
+        )
+        # Dynos get SIGTERM on restarts; finish the batch in hand first
+        signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+        worker.run(drain=args.drain)
+    elif args.command == "requeue_dead":
+        logger.info(f"Requeued {work_queue.requeue_dead()} grants")
+    print(json.dumps(work_queue.stats()))
@@ -0,0 +1,538 @@
+import hashlib
+import logging
+import time
+from typing import Optional
+
+from sqlalchemy import (
+    ARRAY,
+    Integer,
+    and_,
+    any_,
+    bindparam,
+    delete,
+    exists,
+    func,
+    insert,
+    select,
+    update,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from grant_search.db import database
+from grant_search.db.models import (
+    FavoritedGrant,
+    Grant,
+    GrantDerivedData,
+    GrantEmbedding,
+    GrantRawDocument,
+    GrantStaging,
+    grant_grantee,
+    grant_search_query_grants,
+)
+from grant_search.db.raw_store import document_row
+from grant_search.ingest.grantees import GranteeResolver
+from grant_search.ingest.llm_view import build_llm_view, estimate_tokens, log_savings
+from grant_search.ingest.records import ParsedGrant
+from grant_search.ingest.stats import IngestStats
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_COMMIT_EVERY = 1
+
+grants_table = Grant.__table__
+raw_documents_table = GrantRawDocument.__table__
+staging_table = GrantStaging.__table__
+
+
+def content_hash(raw_text: bytes) -> str:
+    return hashlib.sha256(raw_text).hexdigest()
+
+
+def load_existing(connection, data_source_id: int) -> dict[str, tuple[int, str]]:
+    """Returns award_id -> (grant id, content hash) for a data source."""
+    rows = connection.execute(
+        select(Grant.award_id, Grant.id, Grant.content_hash).where(
+            Grant.data_source_id == data_source_id
+        )
+    )
+    return {award_id: (grant_id, digest) for award_id, grant_id, digest in rows}
+
+
+def delete_grants(connection, grant_ids: list[int]):
+    """Deletes grants along with every row that references them."""
+    if not grant_ids:
+        return
+    for table, column in [
+        (grant_grantee, grant_grantee.c.grant_id),
+        (grant_search_query_grants, grant_search_query_grants.c.grant_id),
+        (FavoritedGrant.__table__, FavoritedGrant.grant_id),
+        (GrantDerivedData.__table__, GrantDerivedData.grant_id),
+        (GrantEmbedding.__table__, GrantEmbedding.grant_id),
+        (raw_documents_table, GrantRawDocument.grant_id),
+        (grants_table, Grant.id),
+    ]:
+        connection.execute(delete(table).where(column.in_(grant_ids)))
+
+
+class GrantWriter:
+    """
+    Buffers parsed grants and writes them in batches.
+
+    Each batch is one multi-row INSERT into grants (returning the new ids in
+    parameter order) followed by one multi-row INSERT each into
+    grant_raw_documents (compressed) and grant_grantee.
+    The transaction is committed every `commit_every` batches. A batch size
+    and commit interval of 1 matches the old per-row behaviour, which is
+    useful as a baseline when comparing rates.
+
+    When `existing` holds the grants already stored for the data source, the
+    writer runs as a delta: grants whose content hash is unchanged are
+    skipped, changed grants are updated in place (dropping their derived data
+    and embeddings so they get analyzed again) and `delete_missing` removes
+    the grants that were not seen in this run.
+
+    Time spent resolving grantees and writing rows is charged to the
+    "grantee_resolution" and "db_write" stages of `stats`. `log_rows=False`
+    drops the per-grant log lines and keeps only the per-batch progress.
+    """
+
+    data_source_id: int
+    grantees: GranteeResolver
+    batch_size: int
+    commit_every: int
+    existing: dict[str, tuple[int, str]]
+    written: int
+    updated: int
+    skipped: int
+    deleted: int
+    stats: IngestStats
+    log_rows: bool
+
+    def __init__(
+        self,
+        data_source_id: int,
+        grantees: GranteeResolver,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        commit_every: int = DEFAULT_COMMIT_EVERY,
+        existing: Optional[dict[str, tuple[int, str]]] = None,
+        stats: Optional[IngestStats] = None,
+        log_rows: bool = True,
+    ):
+        self.data_source_id = data_source_id
+        self.grantees = grantees
+        self.batch_size = max(1, batch_size)
+        self.commit_every = max(1, commit_every)
+        self.existing = existing or {}
+        self.stats = stats or IngestStats()
+        self.log_rows = log_rows
+        self.written = 0
+        self.updated = 0
+        self.skipped = 0
+        self.deleted = 0
+        # Estimated tokens in the LLM views written, and in their raw documents
+        self.view_tokens = 0
+        self.raw_tokens = 0
+        self._inserts: list[ParsedGrant] = []
+        self._updates: list[tuple[int, ParsedGrant]] = []
+        self._seen: set[str] = set()
+        self._batches = 0
+        self._connection = database.engine.connect()
+        self._started = time.monotonic()
+
+    def add(self, grant: ParsedGrant):
+        if grant.award_id in self._seen:
+            logger.warning(f"Skipping duplicate award: {grant.award_id}")
+            return
+        self._seen.add(grant.award_id)
+
+        current = self.existing.get(grant.award_id)
+        if current is None:
+            self._inserts.append(grant)
+        elif current[1] == content_hash(grant.raw_text):
+            self.skipped += 1
+            return
+        else:
+            self._updates.append((current[0], grant))
+
+        if len(self._inserts) + len(self._updates) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._inserts and not self._updates:
+            return
+        inserts, self._inserts = self._inserts, []
+        updates, self._updates = self._updates, []
+        inserts = self._with_views(inserts)
+        updates = list(
+            zip(
+                [grant_id for grant_id, _ in updates],
+                self._with_views([grant for _, grant in updates]),
+            )
+        )
+
+        names = {
+            name
+            for grant in inserts + [grant for _, grant in updates]
+            for name in grant.investigators
+        }
+        with self.stats.stage("grantee_resolution", rows=len(names)):
+            grantee_ids = self.grantees.resolve(names)
+
+        with self.stats.stage("db_write", rows=len(inserts) + len(updates)):
+            self._write(inserts, updates, grantee_ids)
+
+        self.written += len(inserts)
+        self.updated += len(updates)
+        if self.log_rows:
+            for grant in inserts:
+                logger.info(f"Created grant: {grant.title}")
+            for _, grant in updates:
+                logger.info(f"Updated grant: {grant.title}")
+        logger.info(
+            f"Wrote {self.written + self.updated} grants ({self.rate():.1f} grants/sec)"
+        )
+
+    def _with_views(self, grants: list[ParsedGrant]) -> list[ParsedGrant]:
+        """Adds each grant's LLM view, estimating the tokens it saves."""
+        with self.stats.stage("llm_view", rows=len(grants)):
+            built = []
+            for grant in grants:
+                if grant.llm_view is None:
+                    grant = grant._replace(llm_view=build_llm_view(grant))
+                # From the lengths, since encoding every raw document is slow
+                self.view_tokens += estimate_tokens(len(grant.llm_view))
+                self.raw_tokens += estimate_tokens(len(grant.raw_text))
+                built.append(grant)
+        return built
+
+    def _write(
+        self,
+        inserts: list[ParsedGrant],
+        updates: list[tuple[int, ParsedGrant]],
+        grantee_ids: dict[str, int],
+    ):
+        linked = []
+        if inserts:
+            grant_ids = self._connection.execute(
+                insert(grants_table).returning(
+                    grants_table.c.id, sort_by_parameter_order=True
+                ),
+                [self._grant_row(grant) for grant in inserts],
+            ).scalars()
+            linked.extend(zip(grant_ids, inserts))
+        if updates:
+            self._update(updates)
+            linked.extend(updates)
+
+        links = [
+            {"grant_id": grant_id, "grantee_id": grantee_ids[name]}
+            for grant_id, grant in linked
+            for name in dict.fromkeys(grant.investigators)
+        ]
+        if links:
+            self._connection.execute(grant_grantee.insert(), links)
+
+        documents = pg_insert(raw_documents_table)
+        self._connection.execute(
+            documents.on_conflict_do_update(
+                index_elements=[raw_documents_table.c.grant_id],
+                set_={
+                    "encoding": documents.excluded.encoding,
+                    "raw_size": documents.excluded.raw_size,
+                    "data": documents.excluded.data,
+                },
+            ),
+            [document_row(grant_id, grant.raw_text) for grant_id, grant in linked],
+        )
+
+        self._batches += 1
+        if self._batches % self.commit_every == 0:
+            self._connection.commit()
+
+    def _update(self, updates: list[tuple[int, ParsedGrant]]):
+        ids = [grant_id for grant_id, _ in updates]
+        rows = []
+        for grant_id, grant in updates:
+            row = self._grant_row(grant)
+            row["b_id"] = grant_id
+            rows.append(row)
+        # The SET clause is built from the remaining keys of each row
+        self._connection.execute(
+            update(grants_table).where(grants_table.c.id == bindparam("b_id")),
+            rows,
+        )
+        # Analysis of the old content no longer applies
+        for table, column in [
+            (grant_grantee, grant_grantee.c.grant_id),
+            (GrantDerivedData.__table__, GrantDerivedData.grant_id),
+            (GrantEmbedding.__table__, GrantEmbedding.grant_id),
+        ]:
+            self._connection.execute(delete(table).where(column.in_(ids)))
+
+    def delete_missing(self):
+        """Deletes existing grants whose award was not seen in this run."""
+        self.flush()
+        missing = [
+            grant_id
+            for award_id, (grant_id, _) in self.existing.items()
+            if award_id not in self._seen
+        ]
+        with self.stats.stage("db_write", rows=len(missing)):
+            delete_grants(self._connection, missing)
+        self.deleted += len(missing)
+        logger.info(f"Deleted {len(missing)} grants no longer in the source")
+
+    def commit(self):
+        """Flushes the buffer and commits, e.g. before recording a checkpoint."""
+        self.flush()
+        self._connection.commit()
+
+    def close(self):
+        """Flushes and commits anything still buffered."""
+        try:
+            self.flush()
+            self._connection.commit()
+        finally:
+            self._connection.close()
+        logger.info(
+            f"Finished in {time.monotonic() - self._started:.1f}s: "
+            f"{self.written} created, {self.updated} updated, "
+            f"{self.skipped} unchanged, {self.deleted} deleted "
+            f"({self.rate():.1f} grants/sec)"
+        )
+        log_savings(self.view_tokens, self.raw_tokens, estimated=True)
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self._started
+        done = self.written + self.updated + self.skipped
+        return done / elapsed if elapsed > 0 else 0.0
+
+    def _grant_row(self, grant: ParsedGrant) -> dict:
+        row = grant._asdict()
+        del row["investigators"]
+        del row["institution"]
+        row["data_source_id"] = self.data_source_id
+        row["content_hash"] = content_hash(row.pop("raw_text"))
+        return row
+
+
+class StagingWriter(GrantWriter):
+    """
+    Loads a full reload of a data source into grant_staging, then swaps it in.
+
+    Batches are written (and committed) to the staging table only, so live
+    queries keep seeing the old grants while the load runs. `close` then
+    reconciles the source's grants with the staged rows in one transaction
+    of set-based statements:
+
+    - awards with an unchanged content hash are left alone, keeping their
+      ids, derived data and embeddings;
+    - changed awards are updated in place and lose their derived data and
+      embeddings so they get analyzed again;
+    - new awards are inserted and vanished ones deleted.
+
+    Staged rows are kept until the swap, so `resume=True` continues an
+    interrupted load; otherwise leftovers of an earlier run are cleared.
+    """
+
+    def __init__(
+        self,
+        data_source_id: int,
+        grantees: GranteeResolver,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        commit_every: int = DEFAULT_COMMIT_EVERY,
+        stats: Optional[IngestStats] = None,
+        log_rows: bool = True,
+        resume: bool = False,
+    ):
+        super().__init__(
+            data_source_id,
+            grantees,
+            batch_size=batch_size,
+            commit_every=commit_every,
+            stats=stats,
+            log_rows=log_rows,
+        )
+        self.staged = 0
+        if not resume:
+            self._connection.execute(
+                delete(staging_table).where(
+                    staging_table.c.data_source_id == data_source_id
+                )
+            )
+            self._connection.commit()
+
+    def flush(self):
+        if not self._inserts:
+            return
+        inserts, self._inserts = self._inserts, []
+        inserts = self._with_views(inserts)
+        names = {name for grant in inserts for name in grant.investigators}
+        with self.stats.stage("grantee_resolution", rows=len(names)):
+            grantee_ids = self.grantees.resolve(names)
+
+        with self.stats.stage("db_write", rows=len(inserts)):
+            rows = []
+            for grant in inserts:
+                row = self._grant_row(grant)
+                document = document_row(None, grant.raw_text)
+                row["grantee_ids"] = list(
+                    dict.fromkeys(grantee_ids[name] for name in grant.investigators)
+                )
+                row["raw_encoding"] = document["encoding"]
+                row["raw_size"] = document["raw_size"]
+                row["raw_data"] = document["data"]
+                rows.append(row)
+            # Awards staged before an interruption are already there
+            self._connection.execute(
+                pg_insert(staging_table).on_conflict_do_nothing(), rows
+            )
+            self._batches += 1
+            if self._batches % self.commit_every == 0:
+                self._connection.commit()
+
+        self.staged += len(inserts)
+        if self.log_rows:
+            for grant in inserts:
+                logger.info(f"Staged grant: {grant.title}")
+        logger.info(f"Staged {self.staged} grants ({self.rate():.1f} grants/sec)")
+
+    def delete_missing(self):
+        # Vanished awards are removed by the swap
+        pass
+
+    def close(self):
+        """Flushes the remaining grants and swaps the staged set in."""
+        try:
+            self.flush()
+            self._connection.commit()
+            with self.stats.stage("swap"):
+                self._swap()
+            self._connection.commit()
+        finally:
+            self._connection.close()
+        logger.info(
+            f"Finished in {time.monotonic() - self._started:.1f}s: "
+            f"{self.written} created, {self.updated} updated, "
+            f"{self.skipped} unchanged, {self.deleted} deleted "
+            f"({self.rate():.1f} grants/sec)"
+        )
+        log_savings(self.view_tokens, self.raw_tokens, estimated=True)
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self._started
+        return self.staged / elapsed if elapsed > 0 else 0.0
+
+    def _swap(self):
+        connection = self._connection
+        staged = staging_table.c
+        grants = grants_table.c
+        same_award = and_(
+            staged.data_source_id == grants.data_source_id,
+            staged.award_id == grants.award_id,
+        )
+        of_source = grants.data_source_id == self.data_source_id
+        staged_for_source = staged.data_source_id == self.data_source_id
+
+        vanished = list(
+            connection.execute(
+                select(grants.id).where(
+                    of_source, ~exists().where(same_award, staged_for_source)
+                )
+            ).scalars()
+        )
+        delete_grants(connection, vanished)
+
+        grant_columns = [
+            "award_id",
+            "start_date",
+            "end_date",
+            "amount",
+            "title",
+            "description",
+            "content_hash",
+            "llm_view",
+        ]
+        changed = list(
+            connection.execute(
+                update(grants_table)
+                .values({name: staged[name] for name in grant_columns[1:]})
+                .where(
+                    of_source,
+                    same_award,
+                    grants.content_hash.is_distinct_from(staged.content_hash),
+                )
+                .returning(grants.id)
+            ).scalars()
+        )
+        # Analysis of the old content no longer applies
+        for table, column in [
+            (grant_grantee, grant_grantee.c.grant_id),
+            (GrantDerivedData.__table__, GrantDerivedData.grant_id),
+            (GrantEmbedding.__table__, GrantEmbedding.grant_id),
+        ]:
+            connection.execute(delete(table).where(column.in_(changed)))
+
+        created = list(
+            connection.execute(
+                insert(grants_table)
+                .from_select(
+                    ["data_source_id"] + grant_columns,
+                    select(
+                        staged.data_source_id,
+                        *[staged[name] for name in grant_columns],
+                    ).where(
+                        staged_for_source,
+                        ~exists().where(same_award),
+                    ),
+                )
+                .returning(grants.id)
+            ).scalars()
+        )
+
+        # One array parameter rather than an IN list the size of the source
+        touched = bindparam("touched", changed + created, type_=ARRAY(Integer))
+        rewritten = (
+            select(grants.id, staging_table)
+            .where(grants.id == any_(touched), same_award)
+            .subquery()
+        )
+        connection.execute(
+            grant_grantee.insert().from_select(
+                ["grant_id", "grantee_id"],
+                select(rewritten.c.id, func.unnest(rewritten.c.grantee_ids)),
+            )
+        )
+        documents = pg_insert(raw_documents_table).from_select(
+            ["grant_id", "encoding", "raw_size", "data"],
+            select(
+                rewritten.c.id,
+                rewritten.c.raw_encoding,
+                rewritten.c.raw_size,
+                rewritten.c.raw_data,
+            ),
+        )
+        connection.execute(
+            documents.on_conflict_do_update(
+                index_elements=[raw_documents_table.c.grant_id],
+                set_={
+                    "encoding": documents.excluded.encoding,
+                    "raw_size": documents.excluded.raw_size,
+                    "data": documents.excluded.data,
+                },
+            )
+        )
+
+        total = connection.execute(
+            select(func.count()).select_from(staging_table).where(staged_for_source)
+        ).scalar()
+        connection.execute(delete(staging_table).where(staged_for_source))
+
+        self.written = len(created)
+        self.updated = len(changed)
+        self.deleted = len(vanished)
+        self.skipped = total - len(created) - len(changed)
+        logger.info(
+            f"Swapped in {total} staged grants for data source {self.data_source_id}"
+        )
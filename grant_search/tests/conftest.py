@@ -0,0 +1,79 @@
+import os
+
+# grant_search.db.database builds its engine at import. Only the tests using
+# the `db` fixture connect, and they are skipped if nothing is listening.
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/grant_search_test")
+
+import pytest
+
+from grant_search.ai import rate_limit
+from grant_search.bench.fake_openai import FakeOpenAI
+
+
+@pytest.fixture
+def rate_limiter(monkeypatch) -> rate_limit.LLMRateLimiter:
+    """A fresh process-local limiter, so AIMD state doesn't leak between tests."""
+    monkeypatch.delenv("REDISCLOUD_URL", raising=False)
+    limiter = rate_limit.LLMRateLimiter(rate_limit.LocalBuckets())
+    monkeypatch.setattr(rate_limit, "_rate_limiter", limiter)
+    return limiter
+
+
+@pytest.fixture
+def fake_openai(monkeypatch, rate_limiter):
+    """Starts a FakeOpenAI and points the clients at it; configure it in the test."""
+    with FakeOpenAI(latency=0.0, seed=0) as fake:
+        monkeypatch.setenv("OPEN_AI_BASE_URL", fake.base_url)
+        monkeypatch.setenv("OPEN_AI_KEY", "fake")
+        yield fake
+
+
+@pytest.fixture
+def redis_connection():
+    """fakeredis, or the throwaway Redis database at REDIS_TEST_URL if set."""
+    if os.getenv("REDIS_TEST_URL"):
+        import redis
+
+        connection = redis.Redis.from_url(os.environ["REDIS_TEST_URL"])
+    else:
+        import fakeredis
+
+        connection = fakeredis.FakeRedis()
+    connection.flushdb()
+    yield connection
+    connection.flushdb()
+
+
+@pytest.fixture(scope="session")
+def test_database():
+    """
+    Creates the schema in the throwaway Postgres at DATABASE_URL, dropping
+    whatever was there.
+    """
+    from sqlalchemy.exc import OperationalError
+
+    from grant_search.db import database
+    from grant_search.db.models import Base, init_db
+
+    try:
+        with database.engine.connect():
+            pass
+    except OperationalError:
+        pytest.skip(f"No test database at {database.engine.url}")
+    Base.metadata.drop_all(database.engine)
+    init_db()
+    yield database.engine
+    Base.metadata.drop_all(database.engine)
+
+
+@pytest.fixture
+def db(test_database):
+    """The test database engine, emptied after each test."""
+    from sqlalchemy import text
+
+    from grant_search.db.models import Base
+
+    yield test_database
+    tables = ", ".join(table.name for table in Base.metadata.sorted_tables)
+    with test_database.begin() as connection:
+        connection.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
@@ -0,0 +1,61 @@
+from grant_search.ingest.analysis_engine import AsyncAnalysisEngine
+
+GRANTS = [
+    (grant_id, f"Title: Grant {grant_id}\nAbstract: ...") for grant_id in range(40)
+]
+
+
+def run_engine(grants=GRANTS, **options) -> tuple[AsyncAnalysisEngine, list[int]]:
+    written = []
+    engine = AsyncAnalysisEngine(
+        writer=lambda results: written.extend(grant_id for grant_id, _ in results),
+        write_batch_size=1,
+        **options,
+    )
+    engine.run(grants)
+    return engine, written
+
+
+def test_results_are_written_as_they_finish(fake_openai):
+    fake_openai.latency = 0.05
+    fake_openai.jitter = 0.9
+
+    engine, written = run_engine(concurrency=8)
+
+    assert sorted(written) == [grant_id for grant_id, _ in GRANTS]
+    assert written != sorted(written)
+    assert engine.analyzed == len(GRANTS)
+    assert engine.failed == 0
+
+
+def test_in_flight_requests_stay_within_concurrency(fake_openai):
+    fake_openai.latency = 0.02
+
+    engine, written = run_engine(concurrency=4)
+
+    assert len(written) == len(GRANTS)
+    assert fake_openai.max_in_flight <= 4
+    assert engine.requests == len(GRANTS)
+
+
+def test_packed_retries_stay_within_concurrency(fake_openai):
+    fake_openai.latency = 0.02
+    fake_openai.drop_rate = 0.5
+
+    engine, written = run_engine(concurrency=3, pack_size=5)
+
+    assert sorted(written) == [grant_id for grant_id, _ in GRANTS]
+    assert engine.retried > 0
+    assert fake_openai.max_in_flight <= 3
+
+
+def test_failures_are_counted(fake_openai):
+    # Every call is rate limited, so each grant fails after its last attempt
+    fake_openai.error_rate = 1.0
+    fake_openai.retry_after = 0.0
+
+    engine, written = run_engine(GRANTS[:5], concurrency=8)
+
+    assert written == []
+    assert engine.failed == 5
+    assert engine.analyzed == 0
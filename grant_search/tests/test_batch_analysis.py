@@ -0,0 +1,166 @@
+import json
+import time
+
+import pytest
+
+from grant_search.ai.common import get_openai_client
+from grant_search.db import database
+from grant_search.ingest import derived_writer
+from grant_search.ingest.batch_analysis import BatchAnalysis
+
+GRANTS = [
+    (grant_id, f"Title: Grant {grant_id}\nAbstract: ...") for grant_id in range(30)
+]
+
+
+class FakeQuery:
+    """
+    Every job, whatever the filter: tests only poll while every job is
+    running and apply once every job is completed.
+    """
+
+    def __init__(self, jobs: list):
+        self.jobs = jobs
+
+    def filter(self, *criteria):
+        return self
+
+    def all(self) -> list:
+        return list(self.jobs)
+
+
+class FakeSession:
+    """Holds AnalysisBatchJob rows in memory in place of the database."""
+
+    def __init__(self):
+        self.jobs = []
+
+    def __call__(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def add(self, job):
+        self.jobs.append(job)
+
+    def commit(self):
+        pass
+
+    def query(self, model):
+        return FakeQuery(self.jobs)
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(database, "Session", session)
+    return session
+
+
+@pytest.fixture
+def saved(monkeypatch) -> dict:
+    saved = {}
+    monkeypatch.setattr(
+        derived_writer, "upsert_derived_data", lambda results: saved.update(results)
+    )
+    return saved
+
+
+def make_batch_analysis(monkeypatch, chunk_size: int) -> BatchAnalysis:
+    monkeypatch.setattr(
+        BatchAnalysis, "_grants", lambda self, session, all_grants: iter(GRANTS)
+    )
+    return BatchAnalysis(
+        chunk_size=chunk_size, client=get_openai_client(), use_cache=False
+    )
+
+
+def test_submit_poll_apply(fake_openai, monkeypatch, session, saved):
+    fake_openai.batch_delay = 1.0
+    analysis = make_batch_analysis(monkeypatch, chunk_size=12)
+
+    assert analysis.submit() == 3
+    assert [job.request_count for job in session.jobs] == [12, 12, 6]
+    assert analysis.poll() == 3
+
+    while analysis.poll():
+        time.sleep(0.05)
+    assert analysis.apply() == len(GRANTS)
+
+    assert sorted(saved) == [grant_id for grant_id, _ in GRANTS]
+    assert all(job.status == "completed" for job in session.jobs)
+    assert sum(job.applied_count for job in session.jobs) == len(GRANTS)
+    assert all(job.failed_count == 0 for job in session.jobs)
+
+
+def test_apply_counts_failed_requests(fake_openai, monkeypatch, session, saved):
+    # Failed requests go to the error file
+    fake_openai.error_rate = 0.3
+    analysis = make_batch_analysis(monkeypatch, chunk_size=len(GRANTS))
+    analysis.submit()
+    while analysis.poll():
+        time.sleep(0.05)
+    (job,) = session.jobs
+    errors = len(fake_openai.file_contents[job.error_file_id].splitlines())
+    # and a request the API answered with an error stays in the output file
+    lines = fake_openai.file_contents[job.output_file_id].decode().splitlines()
+    failed = json.loads(lines[0])
+    failed["response"] = {"status_code": 500, "body": {"error": {"message": "x"}}}
+    lines[0] = json.dumps(failed)
+    fake_openai.file_contents[job.output_file_id] = "\n".join(lines).encode()
+
+    assert analysis.apply() == len(GRANTS) - errors - 1
+
+    assert 0 < errors < len(GRANTS)
+    assert job.failed_count == errors + 1
+    assert job.applied_at is not None
+    assert len(saved) == job.applied_count
+    assert int(failed["custom_id"][len("grant-") :]) not in saved
+
+
+def test_apply_saves_what_an_expired_batch_finished(
+    fake_openai, monkeypatch, session, saved
+):
+    analysis = make_batch_analysis(monkeypatch, chunk_size=len(GRANTS))
+    analysis.submit()
+    (job,) = session.jobs
+    while fake_openai.batches[job.batch_id]["status"] != "completed":
+        time.sleep(0.05)
+    # Expired before the last third of the requests ran
+    batch = fake_openai.batches[job.batch_id]
+    batch["status"] = "expired"
+    lines = fake_openai.file_contents[batch["output_file_id"]].splitlines()
+    finished = lines[: len(lines) * 2 // 3]
+    fake_openai.file_contents[batch["output_file_id"]] = b"\n".join(finished)
+
+    assert analysis.poll() == 0
+    assert analysis.apply() == len(finished)
+
+    assert job.status == "expired"
+    assert job.applied_count == len(finished)
+    assert job.failed_count == len(GRANTS) - len(finished)
+    assert len(saved) == len(finished)
+
+
+def test_job_is_recorded_before_the_batch_is_created(fake_openai, monkeypatch, session):
+    analysis = make_batch_analysis(monkeypatch, chunk_size=len(GRANTS))
+    recorded = []
+
+    def create(**kwargs):
+        recorded.extend((job.status, job.batch_id) for job in session.jobs)
+        raise Exception("Batch API unavailable")
+
+    monkeypatch.setattr(analysis.client.batches, "create", create)
+    with pytest.raises(Exception):
+        analysis.submit()
+
+    assert recorded == [("submitting", None)]
+    # Nothing was submitted, so the grants are free for the next run
+    (job,) = session.jobs
+    assert job.status == "failed"
+    assert job.input_file_id is not None
+    assert job.request_count == len(GRANTS)
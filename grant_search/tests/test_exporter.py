@@ -0,0 +1,47 @@
+import zipfile
+
+import pytest
+
+from grant_search.ingest.exporter import open_csv, parse_pi_names
+
+HEADER = "APPLICATION_ID,PI_NAMEs,ORG_NAME\r\n"
+ROW = '1,"O\'NEIL, JOSÉ (contact);MCDONALD, ANNE M.;",Université de Montréal\r\n'
+
+
+def rows(path: str) -> list[dict]:
+    with open_csv(path) as reader:
+        return list(reader)
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "cp1252"])
+def test_open_csv_reads_utf8_and_cp1252(tmp_path, encoding):
+    path = tmp_path / "projects.csv"
+    path.write_bytes((HEADER + ROW).encode(encoding))
+    archive = tmp_path / "projects.zip"
+    with zipfile.ZipFile(archive, "w") as zip_ref:
+        zip_ref.write(path, "RePORTER_PRJ_C_FY2010.csv")
+
+    for source in [path, archive]:
+        (row,) = rows(str(source))
+        assert row["ORG_NAME"] == "Université de Montréal"
+        assert parse_pi_names(row["PI_NAMEs"]) == ["JOSÉ O'NEIL", "ANNE MCDONALD"]
+
+
+def test_open_csv_reads_cp1252_mixed_into_utf8(tmp_path):
+    path = tmp_path / "abstracts.csv"
+    path.write_bytes(
+        "APPLICATION_ID,ABSTRACT_TEXT\r\n1,Café ".encode()
+        + "“quoted” and \x81".encode("cp1252", errors="ignore")
+        + b"\x81\r\n"
+    )
+
+    (row,) = rows(str(path))
+
+    assert row["ABSTRACT_TEXT"] == "Café “quoted” and \x81"
+
+
+def test_pi_names_keep_their_casing():
+    assert parse_pi_names("McDonald, Ann;SMITH, JOHN A. (contact);;") == [
+        "Ann McDonald",
+        "JOHN SMITH",
+    ]
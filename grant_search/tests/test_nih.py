@@ -0,0 +1,140 @@
+from collections import Counter
+from datetime import datetime
+import threading
+import time
+
+import pytest
+
+from grant_search.bench.corpus import NIHCorpus
+from grant_search.bench.reporter_stub import ReporterStub
+from grant_search.ingest.nih import (
+    DATE_FORMAT,
+    MAX_RESULTS,
+    NIHFetcher,
+    TokenBucket,
+    remaining_windows,
+    split_window,
+)
+
+# More projects than one search can page through
+PROJECTS = 20000
+
+
+def day(month: int, day: int) -> datetime:
+    return datetime(2024, month, day)
+
+
+def test_token_bucket_holds_the_rate():
+    bucket = TokenBucket(rate=50)
+    started = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # The first token is there from the start
+    assert time.monotonic() - started >= 5 / 50 * 0.9
+
+
+def test_token_bucket_is_shared_by_threads():
+    bucket = TokenBucket(rate=100)
+    started = time.monotonic()
+    threads = [
+        threading.Thread(target=lambda: [bucket.acquire() for _ in range(3)])
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - started >= 11 / 100 * 0.9
+
+
+def test_split_window_covers_the_window():
+    year = (day(1, 1), day(12, 31))
+    for parts in [2, 3, 7, 12]:
+        windows = split_window(year, parts)
+        assert len(windows) == parts
+        assert windows[0][0] == year[0]
+        assert windows[-1][1] == year[1]
+        for (_, end), (start, _) in zip(windows, windows[1:]):
+            assert (start - end).days == 1
+        sizes = [(end - start).days + 1 for start, end in windows]
+        assert max(sizes) - min(sizes) <= 1
+
+
+def test_split_window_stops_at_single_days():
+    assert split_window((day(3, 1), day(3, 2)), 5) == [
+        (day(3, 1), day(3, 1)),
+        (day(3, 2), day(3, 2)),
+    ]
+    assert split_window((day(3, 1), day(3, 1))) == [(day(3, 1), day(3, 1))]
+
+
+def test_remaining_windows():
+    start, end = day(1, 1), day(12, 31)
+    assert remaining_windows(start, end, []) == [(start, end)]
+    assert remaining_windows(start, end, [(start, end)]) == []
+    assert remaining_windows(
+        start,
+        end,
+        # Out of order, overlapping and partly outside the year
+        [
+            (day(6, 1), day(6, 30)),
+            (datetime(2023, 12, 1), day(1, 31)),
+            (day(6, 15), day(7, 10)),
+        ],
+    ) == [(day(2, 1), day(5, 31)), (day(7, 11), end)]
+
+
+@pytest.fixture(scope="module")
+def reporter():
+    with ReporterStub(NIHCorpus(PROJECTS, year=2023)) as stub:
+        yield stub
+
+
+def fetcher(reporter) -> NIHFetcher:
+    return NIHFetcher(api_url=reporter.url, limiter=TokenBucket(1000, 1000))
+
+
+def in_windows(project: dict, windows: list) -> bool:
+    start = datetime.strptime(project["project_start_date"], DATE_FORMAT)
+    return any(first <= start <= last for first, last in windows)
+
+
+def test_fetch_year_fetches_every_project_once(reporter):
+    year = (datetime(2023, 1, 1), datetime(2023, 12, 31))
+    assert reporter.corpus.total(*year) > MAX_RESULTS
+    done = []
+
+    fetched = Counter(
+        project["appl_id"]
+        for project in fetcher(reporter).fetch_year("2023", on_window_done=done.append)
+    )
+
+    assert len(fetched) == PROJECTS
+    assert set(fetched.values()) == {1}
+    assert remaining_windows(*year, done) == []
+
+
+def test_fetch_year_resumes_from_completed_windows(reporter):
+    done = []
+    first_run = []
+    # Stopped, like a failed ingest, once two windows are checkpointed
+    records = fetcher(reporter).fetch_year("2023", on_window_done=done.append)
+    for project in records:
+        first_run.append(project)
+        if len(done) >= 2:
+            break
+    records.close()
+    completed = list(done)
+
+    second_run = Counter(
+        project["appl_id"]
+        for project in fetcher(reporter).fetch_year("2023", completed=completed)
+    )
+
+    kept = {
+        project["appl_id"] for project in first_run if in_windows(project, completed)
+    }
+    assert kept
+    assert set(second_run.values()) == {1}
+    assert not kept & second_run.keys()
+    assert len(kept) + len(second_run) == PROJECTS
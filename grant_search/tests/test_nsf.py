@@ -0,0 +1,81 @@
+import io
+import re
+
+import pytest
+
+from grant_search.bench.corpus import nsf_awards
+from grant_search.ingest.nsf import (
+    CHUNK_SIZE,
+    extract_nsf_award,
+    extract_nsf_award_stream,
+    parse_nsf_award,
+    xml_string_to_dict,
+)
+
+AWARDS = nsf_awards(200, seed=1)
+
+
+def without_institution(award: bytes) -> bytes:
+    return re.sub(rb"<Institution>.*?</Institution>", b"", award, flags=re.S)
+
+
+def with_empty_abstract(award: bytes) -> bytes:
+    return re.sub(
+        rb"<AbstractNarration>.*?</AbstractNarration>",
+        b"<AbstractNarration/>",
+        award,
+        flags=re.S,
+    )
+
+
+def with_blank_institution_name(award: bytes) -> bytes:
+    return re.sub(rb"<Name>[^<]*</Name>", b"<Name> </Name>", award)
+
+
+def parsed(award: bytes):
+    return parse_nsf_award(xml_string_to_dict(award), award)._replace(raw_text=b"")
+
+
+def test_corpus_covers_the_edge_cases():
+    grants = [parsed(award) for award in AWARDS]
+    assert any(len(grant.investigators) > 1 for grant in grants)
+    assert any(len(grant.investigators) == 1 for grant in grants)
+
+
+@pytest.mark.parametrize(
+    "variant",
+    [
+        lambda award: award,
+        without_institution,
+        with_empty_abstract,
+        with_blank_institution_name,
+    ],
+    ids=["as_generated", "no_institution", "empty_abstract", "blank_institution"],
+)
+def test_extract_matches_the_dict_parser(variant):
+    for award in AWARDS:
+        award = variant(award)
+        assert extract_nsf_award(award) == parsed(award)
+
+
+def test_edge_cases_parse_as_expected():
+    award = with_empty_abstract(without_institution(AWARDS[0]))
+    grant = extract_nsf_award(award)
+    assert grant.institution is None
+    assert grant.description == "No description provided"
+
+
+def test_stream_keeps_the_raw_text():
+    # Larger than one chunk, so the award is fed in pieces
+    award = AWARDS[0].replace(b"</AwardTitle>", b" " * CHUNK_SIZE + b"</AwardTitle>")
+    grant = extract_nsf_award_stream(io.BytesIO(award))
+    assert grant.raw_text == award
+    assert grant._replace(raw_text=b"") == parsed(award)
+
+
+def test_missing_fields_raise_key_error():
+    award = re.sub(rb"<AwardID>.*?</AwardID>", b"", AWARDS[0])
+    with pytest.raises(KeyError):
+        extract_nsf_award(award)
+    with pytest.raises(KeyError):
+        parsed(award)
@@ -0,0 +1,89 @@
+import json
+import time
+
+import pytest
+
+from grant_search.ingest import work_queue as work_queue_module
+from grant_search.ingest.work_queue import WorkQueue
+
+
+@pytest.fixture
+def work_queue(redis_connection, monkeypatch) -> WorkQueue:
+    # Retries are due as soon as they are scheduled
+    monkeypatch.setattr(work_queue_module, "BACKOFF", 0.0)
+    return WorkQueue(redis_connection, "TEST", max_attempts=3, visibility_timeout=0.2)
+
+
+def grant_ids(items) -> list[int]:
+    return sorted(item.grant_id for item in items)
+
+
+def test_enqueue_skips_grants_already_queued(work_queue):
+    assert work_queue.enqueue([1, 2, 3]) == 3
+    assert work_queue.enqueue([2, 3, 4]) == 1
+
+    items = work_queue.read("a", count=10, block_ms=1)
+
+    assert grant_ids(items) == [1, 2, 3, 4]
+    assert work_queue.enqueue([1]) == 0
+    work_queue.ack(items[:1])
+    assert work_queue.enqueue([items[0].grant_id]) == 1
+
+
+def test_read_claims_each_grant_once(work_queue):
+    work_queue.enqueue(range(10))
+
+    first = work_queue.read("a", count=6, block_ms=1)
+    second = work_queue.read("b", count=6, block_ms=1)
+
+    assert grant_ids(first + second) == list(range(10))
+    assert work_queue.read("c", count=6, block_ms=1) == []
+    assert work_queue.stats()["in_progress"] == 10
+
+
+def test_failures_retry_then_dead_letter(work_queue):
+    work_queue.enqueue([7])
+
+    for attempt in range(3):
+        (item,) = work_queue.read("a", block_ms=1)
+        assert item.attempts == attempt
+        work_queue.fail(item, "analysis failed")
+
+    assert work_queue.read("a", block_ms=1) == []
+    assert work_queue.stats() == {
+        "queued": 0,
+        "in_progress": 0,
+        "retrying": 0,
+        "dead": 1,
+    }
+    (entry,) = work_queue.connection.lrange(work_queue.dead, 0, -1)
+    assert json.loads(entry)["attempts"] == 3
+
+    assert work_queue.requeue_dead() == 1
+    (item,) = work_queue.read("a", block_ms=1)
+    assert (item.grant_id, item.attempts) == (7, 0)
+
+
+def test_abandoned_grants_are_claimed_by_another_worker(work_queue):
+    work_queue.enqueue([1, 2])
+    abandoned = work_queue.read("a", block_ms=1)
+
+    assert work_queue.read("b", block_ms=1) == []
+    time.sleep(0.3)
+    claimed = work_queue.read("b", block_ms=1)
+
+    assert grant_ids(claimed) == grant_ids(abandoned)
+    # The abandoned delivery counts as a failed attempt
+    assert all(item.attempts == 1 for item in claimed)
+
+
+def test_heartbeat_keeps_grants_from_being_claimed(work_queue):
+    work_queue.enqueue([1, 2])
+    items = work_queue.read("a", block_ms=1)
+
+    for _ in range(3):
+        time.sleep(0.1)
+        work_queue.heartbeat("a", items[:1])
+
+    claimed = work_queue.read("b", block_ms=1)
+    assert grant_ids(claimed) == [items[1].grant_id]
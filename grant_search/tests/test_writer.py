@@ -0,0 +1,163 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+from grant_search.db.database import Session
+from grant_search.db.models import (
+    Agency,
+    DataSource,
+    Grant,
+    GrantDerivedData,
+    GrantStaging,
+    grant_grantee,
+)
+from grant_search.ingest import writer as writer_module
+from grant_search.ingest.grantees import GranteeResolver
+from grant_search.ingest.records import ParsedGrant
+from grant_search.ingest.writer import GrantWriter, StagingWriter, load_existing
+
+
+def parsed_grant(award_id: str, version: int = 0, investigators=None) -> ParsedGrant:
+    title = f"Grant {award_id} v{version}"
+    return ParsedGrant(
+        award_id=award_id,
+        title=title,
+        start_date=datetime(2024, 1, 1),
+        end_date=datetime(2025, 1, 1),
+        amount=1000.0 * (version + 1),
+        description=f"Abstract of {title}",
+        investigators=investigators or [f"PI {award_id}"],
+        raw_text=f"<Award>{title}</Award>".encode(),
+    )
+
+
+FIRST_RUN = [parsed_grant("A"), parsed_grant("B"), parsed_grant("C")]
+# A is unchanged, B changed (with an investigator listed twice), C is gone
+# and D is new
+SECOND_RUN = [
+    parsed_grant("A"),
+    parsed_grant("B", version=1, investigators=["PI B2", "PI B3", "PI B2"]),
+    parsed_grant("D"),
+]
+
+
+@pytest.fixture
+def data_source_id(db) -> int:
+    with Session() as session:
+        data_source = DataSource(name="NSF test", agency=Agency(name="NSF"))
+        session.add(data_source)
+        session.commit()
+        return data_source.id
+
+
+def write(grants: list[ParsedGrant], data_source_id: int, staged: bool = False):
+    if staged:
+        writer = StagingWriter(data_source_id, GranteeResolver(), batch_size=2)
+    else:
+        with Session() as session:
+            existing = load_existing(session.connection(), data_source_id)
+        writer = GrantWriter(
+            data_source_id, GranteeResolver(), batch_size=2, existing=existing
+        )
+    for grant in grants:
+        writer.add(grant)
+    writer.delete_missing()
+    writer.close()
+    return writer
+
+
+def stored(data_source_id: int) -> dict[str, dict]:
+    """award_id -> what is stored for the grant."""
+    with Session() as session:
+        grants = session.query(Grant).filter(Grant.data_source_id == data_source_id)
+        return {
+            grant.award_id: {
+                "id": grant.id,
+                "title": grant.title,
+                "raw_text": grant.raw_text,
+                "grantees": sorted(grantee.name for grantee in grant.grantees),
+                "analyzed": grant.derived_data is not None,
+            }
+            for grant in grants
+        }
+
+
+def analyze_all(data_source_id: int):
+    with Session() as session:
+        for grant in session.query(Grant).filter(
+            Grant.data_source_id == data_source_id
+        ):
+            session.add(GrantDerivedData(grant_id=grant.id, summary="analyzed"))
+        session.commit()
+
+
+def expected_grant(grant: ParsedGrant) -> dict:
+    return {
+        "title": grant.title,
+        "raw_text": grant.raw_text,
+        "grantees": sorted(set(grant.investigators)),
+    }
+
+
+def without_ids(grants: dict[str, dict]) -> dict[str, dict]:
+    return {
+        award_id: {key: grant[key] for key in ["title", "raw_text", "grantees"]}
+        for award_id, grant in grants.items()
+    }
+
+
+@pytest.mark.parametrize("staged", [False, True], ids=["delta", "staged"])
+def test_rerun_skips_unchanged_and_updates_changed_in_place(data_source_id, staged):
+    first = write(FIRST_RUN, data_source_id, staged=staged)
+    assert first.written == 3
+    analyze_all(data_source_id)
+    before = stored(data_source_id)
+
+    second = write(SECOND_RUN, data_source_id, staged=staged)
+
+    assert (second.written, second.updated, second.skipped, second.deleted) == (
+        1,
+        1,
+        1,
+        1,
+    )
+    after = stored(data_source_id)
+    assert without_ids(after) == {
+        grant.award_id: expected_grant(grant) for grant in SECOND_RUN
+    }
+    # Same rows for A and B, but only A keeps its analysis
+    assert after["A"]["id"] == before["A"]["id"]
+    assert after["B"]["id"] == before["B"]["id"]
+    assert after["A"]["analyzed"]
+    assert not after["B"]["analyzed"]
+    assert not after["D"]["analyzed"]
+
+    with Session() as session:
+        links = session.execute(select(grant_grantee)).all()
+        assert len(links) == len(set(links)) == 4
+        assert session.query(GrantStaging).count() == 0
+
+
+def test_failed_swap_leaves_the_old_grants(data_source_id, monkeypatch):
+    write(FIRST_RUN, data_source_id, staged=True)
+    analyze_all(data_source_id)
+    before = stored(data_source_id)
+
+    writer = StagingWriter(data_source_id, GranteeResolver(), batch_size=2)
+    for grant in SECOND_RUN:
+        writer.add(grant)
+    writer.flush()
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("swap failed")
+
+    # Raw documents are written last, after every other statement of the swap
+    monkeypatch.setattr(writer_module, "pg_insert", fail)
+    with pytest.raises(RuntimeError):
+        writer.close()
+
+    assert stored(data_source_id) == before
+    with Session() as session:
+        # Still staged, so a resumed load can swap them in
+        assert session.query(GrantStaging).count() == len(SECOND_RUN)